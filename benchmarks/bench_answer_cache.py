@@ -0,0 +1,120 @@
+"""
+Measures the answer cache on traffic made of paraphrases of popular questions, fully offline with the harness's
+stand-ins for the LLM, the embedding model, the Serper API and websites (see `bench_end_to_end.py`).
+
+`--queries` queries are drawn from `--questions` questions with Zipf-distributed popularity, each asked in one of
+several phrasings, and answered with the answer cache disabled and then enabled. Reports the latency of the queries,
+the hit rate of the cache and the number of LLM calls made. Paraphrases are only as similar as the fake, bag-of-words
+embeddings make them, so the hit rate depends on `--threshold` more than it would with a real embedding model.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_answer_cache.py [--queries 200] [--questions 20] [--zipf 1.1]
+        [--concurrency 8] [--threshold 0.9] [--first-token-delay 0.3] [--tokens-per-second 50] [--output-tokens 150]
+        [--search-delay 0.2] [--hosts 8] [--seed 0]
+"""
+import os
+import asyncio
+import argparse
+from time import perf_counter
+from typing import List
+
+import numpy as np
+
+from harness import FakeLLM, FakeEmbedding, FixtureWebServer, FakeSerperServer, router_responder
+
+_PHRASINGS = ["What is the latest evidence on {}?", "what is the latest evidence on {} ?",
+              "Latest evidence on {}: what is it?", "What's the latest evidence on {}?",
+              "Tell me the latest evidence on {}."]
+_TOPICS = ["statin therapy in older adults", "metformin and longevity", "GLP-1 agonists for weight loss",
+           "long term effects of proton pump inhibitors", "vitamin D supplementation", "CRISPR based therapies",
+           "mRNA vaccine platforms", "antibiotic resistance in hospitals", "intermittent fasting and insulin",
+           "deep brain stimulation for Parkinson's disease", "gut microbiome and depression", "sleep and dementia"]
+
+
+def _queries(args: argparse.Namespace, cohort: str) -> List[str]:
+    rng = np.random.default_rng(args.seed)
+    popularity = 1 / np.arange(1, args.questions + 1) ** args.zipf
+    questions = rng.choice(args.questions, size=args.queries, p=popularity / popularity.sum())
+    phrasings = rng.integers(len(_PHRASINGS), size=args.queries)
+    return [_PHRASINGS[phrasing].format(f"{_TOPICS[question % len(_TOPICS)]} {cohort} {question // len(_TOPICS)}")
+            for question, phrasing in zip(questions, phrasings)]
+
+
+async def main(args: argparse.Namespace):
+    from intelliweb_GPT import main as pipeline
+    from intelliweb_GPT.llms import register_llm
+    from intelliweb_GPT.prompts import SOURCE_SELECTION
+
+    llm_calls, respond = 0, router_responder(SOURCE_SELECTION)
+
+    def _respond(prompt: str):
+        nonlocal llm_calls
+        llm_calls += 1
+        return respond(prompt)
+
+    llm = FakeLLM(respond=_respond, first_token_delay=args.first_token_delay,
+                  tokens_per_second=args.tokens_per_second, output_tokens=args.output_tokens)
+    for temperature in (0.4, 0.8):
+        register_llm(llm, model='gpt-4o', temperature=temperature)
+
+    print(f"{'cache':>8} {'queries':>8} {'seconds':>8} {'p50 ms':>8} {'p95 ms':>8} {'hit rate':>9} {'llm calls':>10} "
+          f"{'failed':>7}")
+    # Each mode asks about a different cohort, so that neither benefits from the routing caches of the other
+    for enabled, cohort in ((False, 'in adults'), (True, 'in children')):
+        os.environ['ANSWER_CACHE_ENABLED'] = str(enabled).lower()
+        pipeline._get_answer_cache.cache_clear()
+        semaphore, latencies, failed, calls = asyncio.Semaphore(args.concurrency), [], 0, llm_calls
+
+        async def _answer(query: str):
+            nonlocal failed
+            async with semaphore:
+                start = perf_counter()
+                try:
+                    response = await pipeline.generate_answer(query, use_serper_api=True, stream=True)
+                    async for _ in response['answer_generator']:
+                        pass
+                except Exception as exc:
+                    failed += 1
+                    print(f"Query {repr(query)} failed: {exc}")
+                    return
+                latencies.append(perf_counter() - start)
+
+        start = perf_counter()
+        await asyncio.gather(*(_answer(query) for query in _queries(args, cohort)))
+        elapsed = perf_counter() - start
+        answer_cache = pipeline._get_answer_cache()
+        p50, p95 = np.percentile(latencies, [50, 95]) * 1000
+        print(f"{'on' if enabled else 'off':>8} {args.queries:>8} {elapsed:>8.1f} {p50:>8.0f} {p95:>8.0f} "
+              f"{answer_cache.hit_rate if answer_cache else 0.0:>9.2f} {llm_calls - calls:>10} {failed:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--questions', type=int, default=20)
+    parser.add_argument('--zipf', type=float, default=1.1, help="Exponent of the popularity of the questions")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--threshold', type=float, default=0.9, help="Similarity for a cache hit")
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--output-tokens', type=int, default=150)
+    parser.add_argument('--search-delay', type=float, default=0.2)
+    parser.add_argument('--hosts', type=int, default=8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    sites = [FixtureWebServer(slow_fraction=0, host=f"127.0.0.{i + 1}").start() for i in range(args.hosts)]
+    serper = FakeSerperServer([site.url for site in sites], delay=args.search_delay).start()
+    os.environ.update({'SERPER_API_URL': serper.url, 'SERPER_API_KEY': 'offline', 'OPENAI_API_KEY': 'offline',
+                       'PAGE_CACHE_ENABLED': 'false', 'EMBEDDING_CACHE_ENABLED': 'false',
+                       'ANSWER_CACHE_THRESHOLD': str(args.threshold)})
+
+    from llama_index.core import Settings
+
+    Settings.embed_model = FakeEmbedding()
+    try:
+        asyncio.run(main(args))
+    finally:
+        serper.stop()
+        for site in sites:
+            site.stop()
@@ -0,0 +1,132 @@
+"""
+Compares answering a batch of queries by calling `generate_answer` for each (at the same concurrency) with a single
+`generate_answers` call, fully offline with the harness's stand-ins for the LLM, the embedding model, the Serper API
+and websites (see `bench_end_to_end.py`).
+
+The queries ask about `--topics` topics in several phrasings, which the fake router maps to the same search query, as
+the LLM would, so that the batch has searches, pages and documents in common like a nightly digest does. The page,
+embedding and answer caches are disabled, so that only the sharing within a batch is measured.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_batch.py [--queries 48] [--topics 12] [--concurrency 8]
+        [--first-token-delay 0.3] [--tokens-per-second 50] [--output-tokens 150] [--search-delay 0.2] [--hosts 8]
+"""
+import os
+import asyncio
+import argparse
+from time import perf_counter
+from typing import List
+
+from harness import FakeLLM, FakeEmbedding, FixtureWebServer, FakeSerperServer, router_responder
+
+_PHRASINGS = ["What is the latest evidence on {}?", "Summarize recent findings on {}.", "What do studies say on {}?",
+              "Give me an overview of research on {}."]
+_TOPICS = ["statin therapy in older adults", "metformin and longevity", "GLP-1 agonists for weight loss",
+           "long term effects of proton pump inhibitors", "vitamin D supplementation", "CRISPR based therapies",
+           "mRNA vaccine platforms", "antibiotic resistance in hospitals", "intermittent fasting and insulin",
+           "deep brain stimulation for Parkinson's disease", "gut microbiome and depression", "sleep and dementia"]
+
+
+def _search_query(query: str) -> str:
+    # The topic the query asks about, whatever its phrasing
+    for phrasing in _PHRASINGS:
+        prefix, suffix = phrasing.split('{}')
+        if query.startswith(prefix) and query.endswith(suffix):
+            return query[len(prefix):len(query) - len(suffix)]
+    return query
+
+
+def _queries(n_queries: int, n_topics: int, cohort: str) -> List[str]:
+    return [_PHRASINGS[(i // n_topics) % len(_PHRASINGS)].format(f"{_TOPICS[i % n_topics % len(_TOPICS)]} {cohort}")
+            for i in range(n_queries)]
+
+
+async def _answer_one_by_one(queries: List[str], concurrency: int) -> int:
+    from intelliweb_GPT.main import generate_answer
+
+    semaphore, failed = asyncio.Semaphore(concurrency), 0
+
+    async def _answer(query: str):
+        nonlocal failed
+        async with semaphore:
+            try:
+                await generate_answer(query, use_serper_api=True)
+            except Exception as exc:
+                failed += 1
+                print(f"Query {repr(query)} failed: {exc}")
+
+    await asyncio.gather(*(_answer(query) for query in queries))
+    return failed
+
+
+async def _answer_in_batch(queries: List[str], concurrency: int) -> int:
+    from intelliweb_GPT.main import generate_answers
+
+    return sum(['error' in result async for _, result in generate_answers(queries, use_serper_api=True,
+                                                                          concurrency=concurrency)])
+
+
+async def main(args: argparse.Namespace, serper: FakeSerperServer):
+    from intelliweb_GPT.llms import register_llm
+    from intelliweb_GPT.prompts import SOURCE_SELECTION, SOURCE_SELECTION_BATCH
+
+    counts = {'searches': 0, 'llm calls': 0}
+    respond = router_responder(SOURCE_SELECTION, SOURCE_SELECTION_BATCH, search_query=_search_query)
+    results = serper.results
+
+    def _respond(prompt: str):
+        counts['llm calls'] += 1
+        return respond(prompt)
+
+    def _results(query: str, source: str) -> dict:
+        counts['searches'] += 1
+        return results(query, source)
+
+    serper.results = _results
+    llm = FakeLLM(respond=_respond, first_token_delay=args.first_token_delay, tokens_per_second=args.tokens_per_second,
+                  output_tokens=args.output_tokens)
+    for temperature in (0.4, 0.8):
+        register_llm(llm, model='gpt-4o', temperature=temperature)
+
+    print(f"{'mode':>12} {'queries':>8} {'seconds':>8} {'queries/s':>10} {'searches':>9} {'llm calls':>10} "
+          f"{'failed':>7}")
+    # Each mode asks about a different cohort, so that neither benefits from the routing and search caches of the other
+    for mode, answer, cohort in (('one by one', _answer_one_by_one, 'in adults'),
+                                 ('batch', _answer_in_batch, 'in children')):
+        queries = _queries(args.queries, args.topics, cohort)
+        before = dict(counts)
+        start = perf_counter()
+        failed = await answer(queries, args.concurrency)
+        elapsed = perf_counter() - start
+        searches, llm_calls = (counts[name] - before[name] for name in ('searches', 'llm calls'))
+        print(f"{mode:>12} {len(queries):>8} {elapsed:>8.1f} {len(queries) / elapsed:>10.2f} {searches:>9} "
+              f"{llm_calls:>10} {failed:>7}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=48)
+    parser.add_argument('--topics', type=int, default=12)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--output-tokens', type=int, default=150)
+    parser.add_argument('--search-delay', type=float, default=0.2)
+    parser.add_argument('--hosts', type=int, default=8)
+    args = parser.parse_args()
+
+    sites = [FixtureWebServer(slow_fraction=0, host=f"127.0.0.{i + 1}").start() for i in range(args.hosts)]
+    serper = FakeSerperServer([site.url for site in sites], delay=args.search_delay).start()
+    os.environ.update({'SERPER_API_URL': serper.url, 'SERPER_API_KEY': 'offline', 'OPENAI_API_KEY': 'offline',
+                       'PAGE_CACHE_ENABLED': 'false', 'EMBEDDING_CACHE_ENABLED': 'false',
+                       'ANSWER_CACHE_ENABLED': 'false'})
+
+    from llama_index.core import Settings
+
+    Settings.embed_model = FakeEmbedding()
+    try:
+        asyncio.run(main(args, serper))
+    finally:
+        serper.stop()
+        for site in sites:
+            site.stop()
@@ -0,0 +1,52 @@
+"""
+Benchmark of the local embedding backend. Runs fully offline once the model is in the HuggingFace cache.
+
+Measures, for chunks of the size `DocumentGetter` produces:
+    1. Embedding one request's chunks one at a time vs. in a single batched forward pass.
+    2. Concurrent requests embedded independently vs. coalesced with micro-batching.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_embeddings.py [--model BAAI/bge-small-en-v1.5] [--chunks 40]
+        [--concurrency 8] [--window-ms 5]
+"""
+import asyncio
+import argparse
+from time import perf_counter
+
+from intelliweb_GPT.llms import LocalEmbedding
+
+_CHUNK = ("Hormone therapy for prostate cancer lowers the levels of testosterone in the body, which can cause side "
+          "effects such as hot flushes, breast swelling, tiredness and loss of muscle strength. ") * 12
+
+
+async def main(model: str, n_chunks: int, concurrency: int, window_ms: float):
+    chunks = [f"{i}. {_CHUNK}" for i in range(n_chunks)]
+    embed_model = LocalEmbedding(model_name=model)
+    embed_model.get_text_embedding_batch(chunks[:2])  # loads the model and warms it up
+
+    start = perf_counter()
+    for chunk in chunks:
+        embed_model.get_text_embedding(chunk)
+    one_by_one = perf_counter() - start
+    start = perf_counter()
+    embed_model.get_text_embedding_batch(chunks)
+    batched = perf_counter() - start
+    print(f"{n_chunks} chunks one at a time: {one_by_one * 1000:.0f} ms, in one batch: {batched * 1000:.0f} ms")
+
+    for window in (0.0, window_ms / 1000):
+        embed_model.micro_batch_window = window
+        start = perf_counter()
+        await asyncio.gather(*(embed_model.aget_text_embedding_batch(chunks) for _ in range(concurrency)))
+        elapsed = perf_counter() - start
+        print(f"{concurrency} concurrent requests of {n_chunks} chunks, micro-batch window {window * 1000:.0f} ms: "
+              f"{elapsed * 1000:.0f} ms ({concurrency / elapsed:.1f} requests/s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='BAAI/bge-small-en-v1.5')
+    parser.add_argument('--chunks', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--window-ms', type=float, default=5)
+    args = parser.parse_args()
+    asyncio.run(main(args.model, args.chunks, args.concurrency, args.window_ms))
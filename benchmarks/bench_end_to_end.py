@@ -0,0 +1,164 @@
+"""
+Measures the latency and throughput of `generate_answer` end to end, fully offline. The LLM and the embedding model
+are replaced by in-process fakes, and the Serper API and the websites it links to by local servers, all with tunable
+latency, so that the scraping and answering stages can be tuned without touching OpenAI, Serper or live websites.
+
+Reports the p50/p95/p99 latency and time to first token of the queries, the queries answered per second at the given
+concurrency and the latency of each pipeline stage.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_end_to_end.py [--queries 40] [--concurrency 8] [--distinct-queries 40]
+        [--first-token-delay 0.3] [--tokens-per-second 50] [--output-tokens 150] [--embedding-latency 0.05]
+        [--search-delay 0.2] [--page-kb 60] [--page-delay 0.05] [--slow-fraction 0.1] [--slow-delay 5]
+        [--failure-rate 0.05] [--hosts 8] [--max-concurrent-per-host N] [--warm-up 2] [--caches] [--speculative]
+
+The pipeline's own settings (e.g. `SCRAPER_MIN_DOCUMENTS`, `SCRAPER_SOFT_TIMEOUT`) are read from the env as usual.
+"""
+import os
+import asyncio
+import argparse
+from time import perf_counter
+from typing import Dict, List
+
+import numpy as np
+
+from harness import FakeLLM, FakeEmbedding, FixtureWebServer, FakeSerperServer, router_responder
+
+_TOPICS = ["statin therapy in older adults", "metformin and longevity", "GLP-1 agonists for weight loss",
+           "long term effects of proton pump inhibitors", "vitamin D supplementation", "CRISPR based therapies",
+           "mRNA vaccine platforms", "antibiotic resistance in hospitals", "intermittent fasting and insulin",
+           "deep brain stimulation for Parkinson's disease"]
+
+
+class _SpanCollector:
+    """
+    Keeps the durations of the pipeline stages, per stage, while enabled.
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.durations: Dict[str, List[float]] = {}
+
+    def export(self, span):
+        if self.enabled:
+            self.durations.setdefault(span.name, []).append(span.duration)
+
+
+def _percentiles(values: List[float]) -> str:
+    if not values:
+        return "n/a"
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return f"p50 {p50:7.0f} ms  p95 {p95:7.0f} ms  p99 {p99:7.0f} ms"
+
+
+async def _run_query(generate_answer, query: str, speculative: bool) -> (float, float):
+    start = perf_counter()
+    response = await generate_answer(query, use_serper_api=True, stream=True, speculative=speculative)
+    ttft = None
+    async for _ in response['answer_generator']:
+        if ttft is None:
+            ttft = perf_counter() - start
+    return ttft, perf_counter() - start
+
+
+async def main(args: argparse.Namespace, sites: List):
+    from intelliweb_GPT import telemetry
+    from intelliweb_GPT.llms import register_llm
+    from intelliweb_GPT.main import generate_answer
+    from intelliweb_GPT.prompts import SOURCE_SELECTION
+
+    llm = FakeLLM(respond=router_responder(SOURCE_SELECTION), first_token_delay=args.first_token_delay,
+                  tokens_per_second=args.tokens_per_second, output_tokens=args.output_tokens)
+    for temperature in (0.4, 0.8):
+        register_llm(llm, model='gpt-4o', temperature=temperature)
+    collector = _SpanCollector()
+    telemetry.add_exporter(collector)
+
+    queries = [f"What is the latest evidence on {_TOPICS[i % len(_TOPICS)]} (case {i // len(_TOPICS)})?"
+               for i in range(args.distinct_queries)]
+    # Warm-up queries are not repeated by the measured ones, unless caches are meant to be measured
+    for i in range(args.warm_up):
+        await _run_query(generate_answer, f"Warm-up question {i} about {_TOPICS[i % len(_TOPICS)]}", args.speculative)
+
+    semaphore = asyncio.Semaphore(args.concurrency)
+    ttfts, latencies, errors = [], [], 0
+
+    async def _worker(query: str):
+        nonlocal errors
+        async with semaphore:
+            try:
+                ttft, latency = await _run_query(generate_answer, query, args.speculative)
+            except Exception as exc:
+                errors += 1
+                print(f"Query {repr(query)} failed: {exc}")
+                return
+            latencies.append(latency)
+            if ttft is not None:
+                ttfts.append(ttft)
+
+    collector.enabled = True
+    start = perf_counter()
+    await asyncio.gather(*(_worker(queries[i % len(queries)]) for i in range(args.queries)))
+    elapsed = perf_counter() - start
+    collector.enabled = False
+
+    print(f"\n{args.queries} queries at concurrency {args.concurrency} in {elapsed:.1f} s "
+          f"({len(latencies) / elapsed:.2f} queries/s, {errors} failed)")
+    print(f"{'latency':>12}: {_percentiles(latencies)}")
+    print(f"{'ttft':>12}: {_percentiles(ttfts)}")
+    print("Stages:")
+    for stage, durations in collector.durations.items():
+        print(f"{stage:>12}: {_percentiles(durations)}  (n={len(durations)})")
+    print(f"Page requests in flight per host at most: {max(site.max_in_flight for site in sites)}, "
+          f"refused with a 429: {sum(site.throttled for site in sites)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=40)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--distinct-queries', type=int, default=None,
+                        help="Number of distinct queries to cycle through. Defaults to --queries (no repeats)")
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--output-tokens', type=int, default=150)
+    parser.add_argument('--embedding-latency', type=float, default=0.05)
+    parser.add_argument('--search-delay', type=float, default=0.2)
+    parser.add_argument('--page-kb', type=float, default=60)
+    parser.add_argument('--page-delay', type=float, default=0.05)
+    parser.add_argument('--slow-fraction', type=float, default=0.1)
+    parser.add_argument('--slow-delay', type=float, default=5)
+    parser.add_argument('--failure-rate', type=float, default=0.05)
+    parser.add_argument('--hosts', type=int, default=8, help="Number of websites the search results link to")
+    parser.add_argument('--max-concurrent-per-host', type=int, default=None,
+                        help="Requests in flight beyond which a website answers 429. No limit by default")
+    parser.add_argument('--warm-up', type=int, default=2)
+    parser.add_argument('--caches', action='store_true',
+                        help="Keep the page, embedding and answer caches enabled. They are disabled by default")
+    parser.add_argument('--speculative', action='store_true', help="Search while the source is being selected")
+    args = parser.parse_args()
+    args.distinct_queries = args.distinct_queries or args.queries
+
+    # Each website listens on its own loopback address, so that they are different hosts to the scraper
+    sites = [
+        FixtureWebServer(page_kb=args.page_kb, delay=args.page_delay, slow_fraction=args.slow_fraction,
+                         slow_delay=args.slow_delay, failure_rate=args.failure_rate,
+                         max_concurrent=args.max_concurrent_per_host, host=f"127.0.0.{i + 1}").start()
+        for i in range(args.hosts)
+    ]
+    serper = FakeSerperServer([site.url for site in sites], delay=args.search_delay).start()
+    # Read when the pipeline's components are created, on the first query
+    os.environ.update({'SERPER_API_URL': serper.url, 'SERPER_API_KEY': 'offline', 'OPENAI_API_KEY': 'offline'})
+    os.environ['ANSWER_CACHE_ENABLED'] = str(args.caches).lower()
+    if not args.caches:
+        os.environ.update({'PAGE_CACHE_ENABLED': 'false', 'EMBEDDING_CACHE_ENABLED': 'false'})
+
+    from llama_index.core import Settings
+
+    Settings.embed_model = FakeEmbedding(latency=args.embedding_latency)
+    try:
+        asyncio.run(main(args, sites))
+    finally:
+        serper.stop()
+        for site in sites:
+            site.stop()
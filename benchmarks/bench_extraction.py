@@ -0,0 +1,128 @@
+"""
+Compares ways of scraping a batch of large pages (the size of PMC articles) with trafilatura:
+
+- threads: `TrafilaturaWebReader.load_data` in a `ThreadPoolExecutor(max_workers=6)`, fetching and extracting in the
+  same thread, as `DocumentGetter` used to
+- async+threads: `DocumentGetter` with async fetching and extraction in the default thread pool
+- async+processes: `DocumentGetter` with async fetching and extraction in a pool of worker processes
+
+Reports the wall time, pages scraped per second and, for the async modes, how long the event loop was blocked at most
+(which delays everything else sharing the loop, e.g. streaming answers). Pages are served by a local fixture server
+running in its own process, unless `--live` is given, in which case the PMC articles from `document.py` are scraped.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_extraction.py [--urls 48] [--page-kb 400] [--page-delay 0.05]
+        [--workers 4] [--live]
+"""
+import os
+import sys
+import asyncio
+import argparse
+import multiprocessing
+from time import perf_counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+_LIVE_URLS = [
+    "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC2517082/",
+    "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC8022167/",
+    "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4150581/",
+    "https://www.ncbi.nlm.nih.gov/pmc/articles/PMC4884108/",
+]
+
+
+def _serve(page_kb: float, delay: float, connection):
+    from harness import FixtureWebServer
+
+    site = FixtureWebServer(page_kb=page_kb, delay=delay, slow_fraction=0, failure_rate=0).start()
+    connection.send(site.url)
+    connection.recv()
+    site.stop()
+
+
+def _scrape_with_threads(urls):
+    from llama_index.readers.web import TrafilaturaWebReader
+
+    reader = TrafilaturaWebReader()
+
+    def _scrape(url):
+        return reader.load_data(urls=[url], include_comments=False, include_tables=False)
+
+    with ThreadPoolExecutor(max_workers=6) as executor:
+        return [documents for documents in executor.map(_scrape, urls) if documents]
+
+
+async def _max_loop_lag(stop: asyncio.Event, interval: float = 0.005) -> float:
+    loop, max_lag = asyncio.get_running_loop(), 0.0
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, loop.time() - start - interval)
+    return max_lag
+
+
+async def _scrape_async(urls, workers: int) -> (int, float, float):
+    from intelliweb_GPT.components.document import DocumentGetter
+    from intelliweb_GPT.scraping import TextExtractor
+
+    extractor = TextExtractor(max_workers=workers)
+    # Worker processes are started ahead of the timings, as they would be when the app starts
+    extractor.warm_up()
+    document_getter = DocumentGetter(text_extractor=extractor)
+    stop = asyncio.Event()
+    lag = asyncio.create_task(_max_loop_lag(stop))
+    start = perf_counter()
+    try:
+        _, scraped_urls = await document_getter.aget_documents_from_urls(urls, scraper='default')
+    finally:
+        elapsed = perf_counter() - start
+        stop.set()
+        extractor.shutdown()
+    return len(scraped_urls), elapsed, await lag
+
+
+def main(args: argparse.Namespace, base_url: str):
+    from intelliweb_GPT.scraping import extract_text
+
+    # Imports trafilatura and the readers ahead of the timings
+    extract_text(b"<html><body><p>Warm-up</p></body></html>")
+    print(f"{'mode':>16} {'pages':>6} {'seconds':>8} {'pages/s':>8} {'max loop lag (ms)':>18}")
+    for mode, workers in (('threads', None), ('async+threads', 0), ('async+processes', args.workers)):
+        # Different URLs for each mode, so that none benefits from connections or pages cached by another
+        urls = _LIVE_URLS if args.live else [f"{base_url}/article/{mode}-{i}" for i in range(args.urls)]
+        if workers is None:
+            start = perf_counter()
+            pages, lag = len(_scrape_with_threads(urls)), None
+            elapsed = perf_counter() - start
+        else:
+            pages, elapsed, lag = asyncio.run(_scrape_async(urls, workers))
+        lag = f"{lag * 1000:18.0f}" if lag is not None else f"{'n/a':>18}"
+        print(f"{mode:>16} {pages:>6} {elapsed:>8.2f} {pages / elapsed:>8.1f} {lag}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--urls', type=int, default=48)
+    parser.add_argument('--page-kb', type=float, default=400)
+    parser.add_argument('--page-delay', type=float, default=0.05)
+    parser.add_argument('--workers', type=int, default=min(os.cpu_count() or 1, 4),
+                        help="Extraction worker processes")
+    parser.add_argument('--live', action='store_true', help="Scrape PMC articles instead of the fixture server")
+    args = parser.parse_args()
+    os.environ['PAGE_CACHE_ENABLED'] = 'false'
+
+    if args.live:
+        main(args, base_url='')
+    else:
+        # The fixture server renders pages in its own process, so that it does not compete for the GIL
+        parent, child = multiprocessing.Pipe()
+        server = multiprocessing.get_context('spawn').Process(
+            target=_serve, args=(args.page_kb, args.page_delay, child), daemon=True
+        )
+        server.start()
+        try:
+            main(args, base_url=parent.recv())
+        finally:
+            parent.send('stop')
+            server.join(timeout=5)
@@ -0,0 +1,86 @@
+"""
+Cold start benchmark and regression guard for the package imports. Each target is imported in fresh interpreters
+with `python -X importtime`, and the median total import time is reported along with the slowest imported packages.
+
+Fails (exit code 1) if an import exceeds its time budget, or if importing the package eagerly loads any of the heavy
+dependencies that are meant to be loaded on first use.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_import_time.py [--runs 5] [--package-budget-ms 300]
+        [--main-budget-ms 5000]
+"""
+import os
+import sys
+import argparse
+import statistics
+import subprocess
+from collections import defaultdict
+
+# Must not be imported before a query needs them
+_DEFERRED_MODULES = [
+    'trafilatura',
+    'GoogleNews',
+    'googlesearch',
+    'transformers',
+    'sentence_transformers',
+    'llama_index.llms.openai',
+    'llama_index.llms.anthropic',
+    'llama_index.llms.ollama',
+]
+
+
+def _import_time(module: str) -> (float, dict):
+    """
+    Returns the total import time of the module in ms, and the import time of each top-level package (the sum of the
+    self times of its modules) in ms.
+    """
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f"import {module}"],
+                            capture_output=True, text=True, env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing {module} failed:\n{result.stderr}")
+
+    total, packages = 0.0, defaultdict(float)
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_time, cumulative, name = line.split('|')
+        packages[name.strip().split('.')[0]] += int(self_time.split(':')[1]) / 1000
+        if name.strip() == module:
+            total = int(cumulative) / 1000
+    return total, packages
+
+
+def _loaded_deferred_modules(module: str) -> list:
+    code = f"import sys, {module}; print(' '.join(m for m in {_DEFERRED_MODULES!r} if m in sys.modules))"
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return result.stdout.split()
+
+
+def main(runs: int, budgets: dict) -> int:
+    failed = False
+    for module, budget_ms in budgets.items():
+        measurements = [_import_time(module) for _ in range(runs)]
+        median_ms = statistics.median(total for total, _ in measurements)
+        print(f"import {module}: median {median_ms:.0f} ms over {runs} runs (budget {budget_ms:.0f} ms)")
+        for package, package_ms in sorted(measurements[-1][1].items(), key=lambda p: -p[1])[:8]:
+            print(f"    {package:<30} {package_ms:>8.0f} ms")
+        if median_ms > budget_ms:
+            print(f"FAIL: import {module} is over budget")
+            failed = True
+        loaded = _loaded_deferred_modules(module)
+        if loaded:
+            print(f"FAIL: import {module} eagerly loads {', '.join(loaded)}")
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--package-budget-ms', type=float, default=300)
+    parser.add_argument('--main-budget-ms', type=float, default=5000)
+    args = parser.parse_args()
+    sys.exit(main(args.runs, {
+        'intelliweb_GPT': args.package_budget_ms,
+        'intelliweb_GPT.main': args.main_budget_ms,
+    }))
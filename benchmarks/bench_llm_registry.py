@@ -0,0 +1,59 @@
+"""
+Measures the time saved per chat turn by the shared LLM registry. A chat turn makes several small LLM calls (routing,
+reframing, answering, follow-ups). Each turn is run once with fresh LLM instances for every call, as `load_llm` used to
+return, and once with the shared instances `load_llm` returns now, and the p50/p95 turn latencies are compared.
+
+Needs an OpenAI compatible endpoint: set `OPENAI_API_KEY` (and `OPENAI_API_BASE` to point it to a local stand-in).
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_llm_registry.py [--model gpt-4o] [--turns 20] [--calls-per-turn 4]
+"""
+import asyncio
+import argparse
+import statistics
+from time import perf_counter
+
+from llama_index.core.llms import ChatMessage
+
+from llama_index.llms.openai import OpenAI
+
+from intelliweb_GPT.llms import load_llm
+
+
+async def _run_turn(get_llm, calls_per_turn: int) -> float:
+    start = perf_counter()
+    for _ in range(calls_per_turn):
+        await get_llm().achat([ChatMessage(role='user', content="Reply with the single word: ok")], max_tokens=1)
+    return perf_counter() - start
+
+
+def _percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+async def main(model: str, turns: int, calls_per_turn: int):
+    variants = {
+        # What `load_llm` used to do: a new client, with its own connection pool, for every call
+        'fresh': lambda: OpenAI(model=model, temperature=0.4, seed=42),
+        'shared': lambda: load_llm(model=model),
+    }
+    results = {name: [] for name in variants}
+    for _ in range(turns):
+        # Interleaved, so that both variants see the same network conditions
+        for name, get_llm in variants.items():
+            results[name].append(await _run_turn(get_llm, calls_per_turn))
+
+    for name, latencies in results.items():
+        print(f"{name:>7}: p50 {_percentile(latencies, 50) * 1000:.0f} ms, "
+              f"p95 {_percentile(latencies, 95) * 1000:.0f} ms")
+    saved = _percentile(results['fresh'], 50) - _percentile(results['shared'], 50)
+    print(f"p50 saved per turn of {calls_per_turn} calls: {saved * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--model', default='gpt-4o')
+    parser.add_argument('--turns', type=int, default=20)
+    parser.add_argument('--calls-per-turn', type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(main(args.model, args.turns, args.calls_per_turn))
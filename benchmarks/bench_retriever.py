@@ -0,0 +1,63 @@
+"""
+Microbenchmark of building a retriever over one query's chunks and retrieving from it: llama_index's
+`VectorStoreIndex` + `VectorIndexRetriever` against `NumpyRetriever`. Embeddings are random and precomputed, so only
+the retrieval machinery is measured.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_retriever.py [--dim 1536] [--iterations 200]
+"""
+import asyncio
+import argparse
+from time import perf_counter
+
+import numpy as np
+
+from llama_index.core import VectorStoreIndex, MockEmbedding
+from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.schema import TextNode, QueryBundle
+
+from intelliweb_GPT.retrieval import NumpyRetriever
+
+
+async def _retrieve_with_index(nodes, embeddings, query_bundle, embed_model):
+    for node, embedding in zip(nodes, embeddings):
+        node.embedding = embedding.tolist()
+    index = VectorStoreIndex(nodes=nodes, embed_model=embed_model)
+    return await VectorIndexRetriever(index=index, similarity_top_k=5).aretrieve(query_bundle)
+
+
+async def _retrieve_with_numpy(nodes, embeddings, query_bundle, embed_model):
+    return await NumpyRetriever(nodes, embeddings, embed_model=embed_model, similarity_top_k=5).aretrieve(query_bundle)
+
+
+async def main(dim: int, iterations: int):
+    rng = np.random.default_rng(42)
+    embed_model = MockEmbedding(embed_dim=dim)
+    print(f"{'chunks':>8} {'index (ms)':>12} {'numpy (ms)':>12} {'speedup':>9}")
+    for n_chunks in (8, 20, 40):
+        embeddings = rng.standard_normal((n_chunks, dim)).astype(np.float32)
+        query_bundle = QueryBundle(query_str="query", embedding=rng.standard_normal(dim).tolist())
+        timings = {}
+        for name, retrieve in (('index', _retrieve_with_index), ('numpy', _retrieve_with_numpy)):
+            nodes = [TextNode(text=f"chunk {i}") for i in range(n_chunks)]
+            start = perf_counter()
+            for _ in range(iterations):
+                results = await retrieve(nodes, embeddings, query_bundle, embed_model)
+            timings[name] = (perf_counter() - start) / iterations * 1000
+            timings[f"{name}_ids"] = [result.node.get_content() for result in results]
+        assert timings['index_ids'] == timings['numpy_ids'], "Retrievers disagree on the top-k nodes"
+        print(f"{n_chunks:>8} {timings['index']:>12.3f} {timings['numpy']:>12.3f} "
+              f"{timings['index'] / timings['numpy']:>8.1f}x")
+
+    # A query whose search or scraping came up empty still gets an (empty) retrieval, as with the index
+    query_bundle = QueryBundle(query_str="query", embedding=rng.standard_normal(dim).tolist())
+    for name, retrieve in (('index', _retrieve_with_index), ('numpy', _retrieve_with_numpy)):
+        assert await retrieve([], [], query_bundle, embed_model) == [], f"The {name} retriever found chunks in none"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--dim', type=int, default=1536)
+    parser.add_argument('--iterations', type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(main(args.dim, args.iterations))
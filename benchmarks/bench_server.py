@@ -0,0 +1,158 @@
+"""
+Measures the HTTP service (`intelliweb_GPT.server`) under a burst of traffic, fully offline with the harness's
+stand-ins for the LLM, the embedding model, the Serper API and websites (see `bench_end_to_end.py`).
+
+A burst of `--requests` streaming requests hits the server at once, first without admission control (every request
+admitted) and then with at most `--max-in-flight` requests answered and `--max-queue` waiting. Reports, for each run,
+the requests answered, rejected because the queue was full, rejected after waiting too long for a slot and timed out,
+the time to first token and latency of the answered requests and how fast requests were rejected. A share
+`--disconnect-fraction` of the clients disconnects after the first token, to check that their slots are freed.
+
+Usage:
+    PYTHONPATH=$PWD python benchmarks/bench_server.py [--requests 64] [--max-in-flight 8] [--max-queue 16]
+        [--queue-timeout 5] [--timeout 30] [--disconnect-fraction 0.1] [--first-token-delay 0.3]
+        [--tokens-per-second 50] [--output-tokens 150] [--search-delay 0.2] [--hosts 8]
+"""
+import os
+import json
+import socket
+import asyncio
+import argparse
+from time import perf_counter
+from typing import Dict, List
+
+import httpx
+import numpy as np
+
+from harness import FakeLLM, FakeEmbedding, FixtureWebServer, FakeSerperServer, router_responder
+
+_TOPICS = ["statin therapy in older adults", "metformin and longevity", "GLP-1 agonists for weight loss",
+           "long term effects of proton pump inhibitors", "vitamin D supplementation", "CRISPR based therapies",
+           "mRNA vaccine platforms", "antibiotic resistance in hospitals", "intermittent fasting and insulin",
+           "deep brain stimulation for Parkinson's disease"]
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def _request(client: httpx.AsyncClient, query: str, timeout: float, disconnect: bool) -> Dict:
+    start, result = perf_counter(), {'outcome': None, 'ttft': None}
+    async with client.stream('POST', '/answer', json={'query': query, 'timeout': timeout}) as response:
+        if response.status_code == 503:
+            result['outcome'] = json.loads(await response.aread())['reason']
+        elif response.status_code != 200:
+            result['outcome'] = f"http {response.status_code}"
+        else:
+            event = None
+            async for line in response.aiter_lines():
+                if line.startswith('event: '):
+                    event = line[len('event: '):]
+                elif line.startswith('data: ') and event == 'token' and result['ttft'] is None:
+                    result['ttft'] = perf_counter() - start
+                    if disconnect:
+                        result['outcome'] = 'disconnected'
+                        break
+                elif line.startswith('data: ') and event in ('done', 'error'):
+                    result['outcome'] = 'ok' if event == 'done' else json.loads(line[len('data: '):])['error']
+                    break
+    result['latency'] = perf_counter() - start
+    return result
+
+
+def _ms(values: List[float], q: float) -> str:
+    return f"{np.percentile(values, q) * 1000:.0f}" if values else "n/a"
+
+
+async def _burst(args: argparse.Namespace, max_in_flight: int, max_queue: int, cohort: str) -> Dict:
+    import uvicorn
+    from intelliweb_GPT.server import AdmissionController, AnswerServer
+
+    server = AnswerServer(admission=AdmissionController(max_in_flight, max_queue), queue_timeout=args.queue_timeout,
+                          warm_up=False)
+    port = _free_port()
+    uvicorn_server = uvicorn.Server(uvicorn.Config(server.app, host='127.0.0.1', port=port, log_level='warning'))
+    serving = asyncio.create_task(uvicorn_server.serve())
+    while not uvicorn_server.started:
+        await asyncio.sleep(0.05)
+
+    limits = httpx.Limits(max_connections=args.requests + 8, max_keepalive_connections=args.requests + 8)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=None) as client:
+        rng = np.random.default_rng(0)
+        disconnects = rng.random(args.requests) < args.disconnect_fraction
+        start = perf_counter()
+        results = await asyncio.gather(*(
+            _request(client, f"What is the latest evidence on {_TOPICS[i % len(_TOPICS)]} {cohort} {i}?",
+                     args.timeout, bool(disconnects[i]))
+            for i in range(args.requests)
+        ))
+        elapsed = perf_counter() - start
+        await asyncio.sleep(0.5)  # Lets the server notice the disconnections
+        readiness = (await client.get('/readyz')).json()
+
+    uvicorn_server.should_exit = True
+    await serving
+    return {'results': results, 'elapsed': elapsed, 'readiness': readiness}
+
+
+async def main(args: argparse.Namespace):
+    from intelliweb_GPT.llms import register_llm
+    from intelliweb_GPT.prompts import SOURCE_SELECTION
+
+    llm = FakeLLM(respond=router_responder(SOURCE_SELECTION), first_token_delay=args.first_token_delay,
+                  tokens_per_second=args.tokens_per_second, output_tokens=args.output_tokens)
+    for temperature in (0.4, 0.8):
+        register_llm(llm, model='gpt-4o', temperature=temperature)
+
+    print(f"{'admission':>10} {'seconds':>8} {'ok':>5} {'full':>5} {'waited':>7} {'deadline':>9} {'other':>6} "
+          f"{'ttft p50':>9} {'ttft p95':>9} {'p95 ms':>8} {'reject p95':>11} {'in flight after':>16}")
+    # Each run asks about a different cohort, so that neither benefits from the routing caches of the other
+    for label, max_in_flight, max_queue, cohort in (('unbounded', args.requests, 0, 'in adults'),
+                                                     ('bounded', args.max_in_flight, args.max_queue, 'in children')):
+        run = await _burst(args, max_in_flight, max_queue, cohort)
+        results = run['results']
+        outcomes = [result['outcome'] for result in results]
+        answered = [result for result in results if result['outcome'] in ('ok', 'disconnected')]
+        rejected = [result['latency'] for result in results if result['outcome'] in ('queue_full', 'queue_timeout')]
+        other = len(results) - len(answered) - len(rejected) - outcomes.count('deadline_exceeded')
+        print(f"{label:>10} {run['elapsed']:>8.1f} {outcomes.count('ok'):>5} {outcomes.count('queue_full'):>5} "
+              f"{outcomes.count('queue_timeout'):>7} "
+              f"{outcomes.count('deadline_exceeded'):>9} {other:>6} "
+              f"{_ms([result['ttft'] for result in answered], 50):>9} "
+              f"{_ms([result['ttft'] for result in answered], 95):>9} "
+              f"{_ms([result['latency'] for result in results if result['outcome'] == 'ok'], 95):>8} "
+              f"{_ms(rejected, 95):>11} {run['readiness'].get('in_flight', 'n/a'):>16}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--max-in-flight', type=int, default=8)
+    parser.add_argument('--max-queue', type=int, default=16)
+    parser.add_argument('--queue-timeout', type=float, default=5)
+    parser.add_argument('--timeout', type=float, default=30, help="Deadline of each request, in seconds")
+    parser.add_argument('--disconnect-fraction', type=float, default=0.1)
+    parser.add_argument('--first-token-delay', type=float, default=0.3)
+    parser.add_argument('--tokens-per-second', type=float, default=50)
+    parser.add_argument('--output-tokens', type=int, default=150)
+    parser.add_argument('--search-delay', type=float, default=0.2)
+    parser.add_argument('--hosts', type=int, default=8)
+    args = parser.parse_args()
+
+    sites = [FixtureWebServer(slow_fraction=0, host=f"127.0.0.{i + 1}").start() for i in range(args.hosts)]
+    serper = FakeSerperServer([site.url for site in sites], delay=args.search_delay).start()
+    os.environ.update({'SERPER_API_URL': serper.url, 'SERPER_API_KEY': 'offline', 'OPENAI_API_KEY': 'offline',
+                       'PAGE_CACHE_ENABLED': 'false', 'EMBEDDING_CACHE_ENABLED': 'false',
+                       'ANSWER_CACHE_ENABLED': 'false'})
+
+    from llama_index.core import Settings
+
+    Settings.embed_model = FakeEmbedding()
+    try:
+        asyncio.run(main(args))
+    finally:
+        serper.stop()
+        for site in sites:
+            site.stop()
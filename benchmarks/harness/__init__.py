@@ -0,0 +1,9 @@
+"""
+Local stand-ins for the remote services the answer pipeline depends on (LLMs, embeddings, the Serper API and the
+websites it links to), to benchmark the pipeline offline.
+"""
+from .models import FakeLLM, FakeEmbedding, lorem
+from .servers import FixtureWebServer, FakeSerperServer
+from .routing import router_responder
+
+__all__ = ['FakeLLM', 'FakeEmbedding', 'lorem', 'FixtureWebServer', 'FakeSerperServer', 'router_responder']
@@ -0,0 +1,165 @@
+import time
+import asyncio
+import hashlib
+from typing import Any, Callable, Iterator, List, Sequence
+
+import numpy as np
+
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+from llama_index.core.base.llms.types import (
+    ChatMessage,
+    ChatResponse,
+    ChatResponseAsyncGen,
+    CompletionResponse,
+    CompletionResponseAsyncGen,
+    CompletionResponseGen,
+    LLMMetadata,
+)
+from llama_index.core.base.llms.generic_utils import completion_response_to_chat_response
+from llama_index.core.llms.callbacks import llm_chat_callback, llm_completion_callback
+from llama_index.core.llms import CustomLLM
+
+_WORDS = ("the study found that patients treated with the drug showed a significant reduction in symptoms compared "
+          "to placebo while side effects remained mild and transient across all age groups").split()
+
+
+def lorem(n_words: int, seed: str = "") -> str:
+    """
+    Returns `n_words` words of plausible looking filler text, the same for the same seed.
+    """
+    offset = int(hashlib.md5(seed.encode()).hexdigest(), 16) % len(_WORDS)
+    return " ".join(_WORDS[(offset + i * 7) % len(_WORDS)] for i in range(n_words))
+
+
+class FakeLLM(CustomLLM):
+    """
+    Stands in for a remote LLM: answers after `first_token_delay` seconds, then streams `output_tokens` words at
+    `tokens_per_second`. Async calls sleep on the event loop, so concurrent queries overlap like they would with an
+    API. Responses are filler text, unless `respond` returns one for the prompt (e.g. JSON for structured calls).
+    """
+    first_token_delay: float = Field(default=0.3, description="Seconds before the first token.")
+    tokens_per_second: float = Field(default=50.0, description="Rate at which tokens are generated.")
+    output_tokens: int = Field(default=150, description="Number of tokens of the filler responses.")
+    context_window: int = Field(default=128000, description="Context window reported to llama_index.")
+
+    _respond: Callable[[str], str | None] = PrivateAttr()
+
+    def __init__(self, respond: Callable[[str], str | None] = None, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._respond = respond or (lambda prompt: None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "fake_llm"
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(context_window=self.context_window, num_output=self.output_tokens, model_name='fake')
+
+    def _tokens(self, prompt: str) -> List[str]:
+        text = self._respond(prompt) or lorem(self.output_tokens, seed=prompt)
+        words = text.split(" ")
+        return [word + " " for word in words[:-1]] + words[-1:]
+
+    def _stream(self, tokens: List[str]) -> Iterator[CompletionResponse]:
+        text = ""
+        for token in tokens:
+            text += token
+            yield CompletionResponse(text=text, delta=token)
+
+    @llm_completion_callback()
+    def complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        time.sleep(self.first_token_delay + len(tokens) / self.tokens_per_second)
+        return CompletionResponse(text="".join(tokens))
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponseGen:
+        def gen() -> CompletionResponseGen:
+            time.sleep(self.first_token_delay)
+            for response in self._stream(self._tokens(prompt)):
+                yield response
+                time.sleep(1 / self.tokens_per_second)
+
+        return gen()
+
+    @llm_completion_callback()
+    async def acomplete(self, prompt: str, formatted: bool = False, **kwargs: Any) -> CompletionResponse:
+        tokens = self._tokens(prompt)
+        await asyncio.sleep(self.first_token_delay + len(tokens) / self.tokens_per_second)
+        return CompletionResponse(text="".join(tokens))
+
+    @llm_completion_callback()
+    async def astream_complete(self, prompt: str, formatted: bool = False,
+                               **kwargs: Any) -> CompletionResponseAsyncGen:
+        async def gen() -> CompletionResponseAsyncGen:
+            await asyncio.sleep(self.first_token_delay)
+            for response in self._stream(self._tokens(prompt)):
+                yield response
+                await asyncio.sleep(1 / self.tokens_per_second)
+
+        return gen()
+
+    @llm_chat_callback()
+    async def achat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponse:
+        response = await self.acomplete(self.messages_to_prompt(messages), formatted=True, **kwargs)
+        return completion_response_to_chat_response(response)
+
+    @llm_chat_callback()
+    async def astream_chat(self, messages: Sequence[ChatMessage], **kwargs: Any) -> ChatResponseAsyncGen:
+        responses = await self.astream_complete(self.messages_to_prompt(messages), formatted=True, **kwargs)
+
+        async def gen() -> ChatResponseAsyncGen:
+            text = ""
+            async for response in responses:
+                text += response.delta
+                yield ChatResponse(message=ChatMessage(role='assistant', content=text), delta=response.delta)
+
+        return gen()
+
+
+class FakeEmbedding(BaseEmbedding):
+    """
+    Stands in for a remote embedding model: each call takes `latency` seconds, and texts are embedded by hashing
+    their words, so that texts sharing words are similar and retrieval still ranks chunks meaningfully.
+    """
+    embed_dim: int = Field(default=384, description="Dimensions of the embeddings.")
+    latency: float = Field(default=0.05, description="Seconds taken by each call.")
+
+    def __init__(self, model_name: str = 'fake-hashing', **kwargs: Any):
+        super().__init__(model_name=model_name, **kwargs)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "FakeEmbedding"
+
+    def _embed(self, texts: List[str]) -> List[Embedding]:
+        vectors = np.zeros((len(texts), self.embed_dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in text.lower().split():
+                vectors[i, int(hashlib.md5(word.encode()).hexdigest(), 16) % self.embed_dim] += 1
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-9)
+        return vectors.tolist()
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        time.sleep(self.latency)
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        await asyncio.sleep(self.latency)
+        return self._embed([query])[0]
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        time.sleep(self.latency)
+        return self._embed(texts)
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        await asyncio.sleep(self.latency)
+        return self._embed(texts)
+
+
+__all__ = ['FakeLLM', 'FakeEmbedding', 'lorem']
@@ -0,0 +1,29 @@
+import re
+import json
+from typing import Callable
+
+
+def router_responder(source_selection_prompt: str, batch_source_selection_prompt: str = None,
+                     search_query: Callable[[str], str] = lambda query: query) -> Callable[[str], str | None]:
+    """
+    Returns a `FakeLLM` responder that routes every query to a web search, as the LLM would for most questions, with
+    the search query given by `search_query`. Answers both the single query and the batch source selection prompts.
+    """
+    header = source_selection_prompt.split('{query}')[0]
+    batch_header = batch_source_selection_prompt.split('{queries}')[0] if batch_source_selection_prompt else None
+
+    def _decision(query: str) -> dict:
+        return {'source': 'Google Web Search', 'search_query': search_query(query)}
+
+    def respond(prompt: str) -> str | None:
+        if batch_header and batch_header in prompt:
+            queries = re.findall(r'^\d+\. (.*)$', prompt.split(batch_header, 1)[1], flags=re.MULTILINE)
+            return json.dumps({'decisions': [_decision(query.strip()) for query in queries]})
+        if header in prompt:
+            return json.dumps(_decision(prompt.split(header, 1)[1].split('\n', 1)[0].strip()))
+        return None
+
+    return respond
+
+
+__all__ = ['router_responder']
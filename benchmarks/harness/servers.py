@@ -0,0 +1,192 @@
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import threading
+from functools import lru_cache
+from typing import List
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from .models import lorem
+
+
+class _QuietHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: bytes, content_type: str):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def handle_error(self, request, client_address):
+        # Clients hanging up early (e.g. scrapes cancelled by the pipeline) are expected
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class _BackgroundServer:
+    """
+    Serves `handler` on a free local port from a background thread. Usable as a context manager.
+    """
+    handler = _QuietHandler
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0):
+        self._server = _Server((host, port), self.handler)
+        self._server.owner = self
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+class _ArticleHandler(_QuietHandler):
+    def do_GET(self):
+        site: FixtureWebServer = self.server.owner
+        if not self.path.startswith('/article/'):
+            self._send(404, b'Not found', 'text/plain')
+            return
+        if not site.enter():
+            self.send_response(429)
+            self.send_header('Retry-After', str(site.retry_after))
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        try:
+            delay, fails = site.behaviour(self.path)
+            time.sleep(delay)
+            if fails:
+                self._send(500, b'Internal server error', 'text/plain')
+                return
+            self._send(200, site.page(self.path), 'text/html; charset=utf-8')
+        finally:
+            site.exit()
+
+
+class FixtureWebServer(_BackgroundServer):
+    """
+    Serves generated news-site like articles of about `page_kb` KB at `/article/<anything>`. Each path behaves the same
+    on every request: it is served after `delay` seconds, or `slow_delay` seconds for a `slow_fraction` of the paths,
+    and a `failure_rate` fraction of the paths fail with a 500. Like a site enforcing politeness limits, requests beyond
+    `max_concurrent` in flight are refused with a 429 and a `Retry-After` of `retry_after` seconds.
+    """
+    handler = _ArticleHandler
+
+    def __init__(self, page_kb: float = 60, delay: float = 0.05, slow_fraction: float = 0.1, slow_delay: float = 5.0,
+                 failure_rate: float = 0.05, seed: int = 0, max_concurrent: int = None, retry_after: int = 1,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.max_concurrent = max_concurrent
+        self.retry_after = retry_after
+        self.in_flight = self.max_in_flight = self.throttled = 0
+        self._lock = threading.Lock()
+        self.page_kb = page_kb
+        self.delay = delay
+        self.slow_fraction = slow_fraction
+        self.slow_delay = slow_delay
+        self.failure_rate = failure_rate
+        self.seed = seed
+        self.page = lru_cache(maxsize=4096)(self._render_page)
+
+    def enter(self) -> bool:
+        with self._lock:
+            if self.max_concurrent is not None and self.in_flight >= self.max_concurrent:
+                self.throttled += 1
+                return False
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            return True
+
+    def exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def behaviour(self, path: str) -> (float, bool):
+        rng = random.Random(f"{self.seed}:{path}")
+        delay = self.slow_delay if rng.random() < self.slow_fraction else self.delay
+        return delay, rng.random() < self.failure_rate
+
+    def _render_page(self, path: str) -> bytes:
+        title = lorem(8, seed=path).capitalize()
+        boilerplate = "".join(f'<li><a href="/article/related-{i}">{lorem(5, seed=f"{path}{i}")}</a></li>'
+                              for i in range(30))
+        # About 3/4 of a real article page is markup, navigation and scripts around the text
+        n_paragraphs = max(int(self.page_kb * 1024 / 4 / 600), 1)
+        paragraphs = "".join(f"<p>{lorem(90, seed=f'{path}:{i}').capitalize()}.</p>" for i in range(n_paragraphs))
+        filler = '<script>var _analytics = "' + 'x' * 1024 + '";</script>'
+        html = (
+            f'<!DOCTYPE html><html lang="en"><head><meta charset="utf-8"><title>{title}</title>'
+            f'<meta name="description" content="{lorem(20, seed=title)}"></head><body>'
+            f'<header><nav><ul>{boilerplate}</ul></nav></header>'
+            f'<main><article><h1>{title}</h1><p class="byline">By Staff Writer</p>{paragraphs}</article>'
+            f'<aside><ul>{boilerplate}</ul></aside></main><footer><p>Copyright Example News</p></footer>'
+        )
+        while len(html) < self.page_kb * 1024:
+            html += filler
+        return (html + '</body></html>').encode()
+
+
+class _SerperHandler(_QuietHandler):
+    def do_POST(self):
+        serper: FakeSerperServer = self.server.owner
+        source = self.path.strip('/')
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if source not in ('search', 'news'):
+            self._send(404, b'{"message": "Not found"}', 'application/json')
+            return
+        time.sleep(serper.delay)
+        query = json.loads(body or b'{}').get('q', '')
+        self._send(200, json.dumps(serper.results(query, source)).encode(), 'application/json')
+
+
+class FakeSerperServer(_BackgroundServer):
+    """
+    Answers Serper API searches (`POST /search` and `POST /news`) after `delay` seconds, with `n_results` links to
+    articles of `site_url`, or spread over several sites if given a list of URLs. The links depend on the query, so
+    different queries lead to different pages.
+    """
+    handler = _SerperHandler
+
+    def __init__(self, site_url: str | List[str], n_results: int = 8, delay: float = 0.2, **kwargs):
+        super().__init__(**kwargs)
+        self.site_urls = [url.rstrip('/') for url in ([site_url] if isinstance(site_url, str) else site_url)]
+        self.n_results = n_results
+        self.delay = delay
+
+    def results(self, query: str, source: str) -> dict:
+        slug = re.sub(r'[^a-z0-9]+', '-', query.lower()).strip('-')[:60]
+        slug = f"{slug}-{hashlib.md5(query.encode()).hexdigest()[:8]}"
+        items = [{'title': lorem(8, seed=f"{slug}{i}"),
+                  'link': f"{self.site_urls[i % len(self.site_urls)]}/article/{slug}-{i}",
+                  'snippet': lorem(25, seed=f"{slug}{i}"), 'position': i + 1} for i in range(self.n_results)]
+        return {'searchParameters': {'q': query, 'type': source}, 'news' if source == 'news' else 'organic': items}
+
+
+__all__ = ['FixtureWebServer', 'FakeSerperServer']
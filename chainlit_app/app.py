@@ -2,14 +2,70 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
+import os
 import asyncio
+from functools import cache
+from time import perf_counter
+from typing import Dict, List
 import chainlit as cl
 from intelliweb_GPT import generate_answer
-from intelliweb_GPT.components import FollowUpQueryCreator, QueryReframer
+from intelliweb_GPT.main import get_source_selector
+from intelliweb_GPT.components import FollowUpQueryCreator, QueryPlanner
+from intelliweb_GPT.llms import awarm_up_llms
+from intelliweb_GPT.telemetry import span
 
-query_reframer = QueryReframer()
 follow_up_query_creator = FollowUpQueryCreator()
 
+# Whether follow-up messages are reframed into standalone queries from the chat history. They are reframed in the same
+# LLM call that selects their source
+USE_CHAT_HISTORY = os.getenv('USE_CHAT_HISTORY', 'true').lower() == 'true'
+# Follow-up queries are generated from the partial answer once this many characters of it have been streamed, rather
+# than after the whole answer. 0 waits for the whole answer
+FOLLOW_UP_PARTIAL_CHARS = int(os.getenv('FOLLOW_UP_PARTIAL_CHARS', 800))
+
+# LLMs are warmed up once per process, by the first chat session, in the background
+_warm_up_task: asyncio.Task | None = None
+
+
+async def _warm_up_llms():
+    try:
+        await awarm_up_llms()
+    except Exception as exc:
+        print(f"Failed to warm up the LLMs: {exc}")
+
+
+@cache
+def _get_query_planner() -> QueryPlanner:
+    # Shares its source selector with `generate_answer`, so that first turns and follow-up turns are routed alike. It is
+    # created with the pipeline components on the first message, rather than when the app is imported
+    return QueryPlanner(source_selector=get_source_selector())
+
+
+def _cancel_follow_ups():
+    follow_up_task = cl.user_session.get("follow_up_task")
+    if follow_up_task is not None and not follow_up_task.done():
+        follow_up_task.cancel()
+
+
+async def _send_related_questions(conversation: List[Dict], answer_done: asyncio.Event):
+    """
+    Generates follow-up queries for the conversation and shows them as actions once the answer is done, in the
+    background of the chat turn.
+    """
+    with span('follow_ups') as follow_ups_span:
+        related_questions = await follow_up_query_creator.create_follow_up_queries(conversation)
+    print(f"Generating follow-up queries took {follow_ups_span.duration:.2f} seconds.")
+    await answer_done.wait()
+    if not related_questions:
+        return
+    related_questions_actions = [
+        cl.Action(name="Thinking and Answering...", label=question, value=question, description=question)
+        for question in related_questions
+    ]
+    msg = cl.Message(content="Related Questions:", actions=related_questions_actions, disable_feedback=True)
+    await msg.send()
+    cl.user_session.set("related_questions_msg", msg)
+
 
 @cl.on_chat_end
 async def remove_related_questions_element():
@@ -34,7 +90,7 @@ async def on_action(action: cl.Action):
 async def chat(message: cl.Message):
     """
     This function is called every time a user inputs a message in the UI.
-    It sends back an intermediate response from the tool, followed by the final answer.
+    It streams back the answer as soon as its first token is generated, and follow-up queries once they are ready.
 
     Args:
         message: The user's message.
@@ -42,7 +98,9 @@ async def chat(message: cl.Message):
     Returns:
         None.
     """
+    _cancel_follow_ups()
     await remove_related_questions_element()
+    turn_start, timings = perf_counter(), {}
 
     message = message.content
 
@@ -54,51 +112,73 @@ async def chat(message: cl.Message):
         'use_serper_api': True
     }
 
-    reframed_query = query_reframer.reframe_query(chat_history[-5:]) \
-        if chat_params.get('use_history') else chat_history[-1]['content']
-    chat_params['query'] = reframed_query
+    with span('planning'):
+        query_planner = await asyncio.to_thread(_get_query_planner)
+        plan = await query_planner.aplan(chat_history[-5:] if USE_CHAT_HISTORY else chat_history[-1:])
+    reframed_query = plan.reframed_query
+    chat_params.update(query=reframed_query, source=plan.source, search_query=plan.search_query)
+    timings['planning'] = perf_counter() - turn_start
 
     msg = cl.Message(content="")
     await msg.send()
 
-    async with cl.Step(name="intelliwebGPT", type="llm", root=True) as step:
-        step.input = message
-        response_dict = await generate_answer(**chat_params)
-        answer_generator = response_dict['answer_generator']
-        references = response_dict['references']
-
-        print("ANSWER GENERATOR: ", answer_generator)
-        print("REFERENCES: ", references)
-        await asyncio.sleep(5)
-
-        async for token in answer_generator:
-            await step.stream_token(token)
-
-        if references:
-            references_str = "<ul>"
-            for reference in references:
-                references_str += "<li><a href={}>{}</a></li>".format(reference, reference)
-            references_str += "</ul>"
-            await step.stream_token(f"\n<hr><h3>References:</h3>{references_str}")
-
-    await step.update()
-    answer = step.output
-    chat_history.append({"role": "assistant", "content": answer})
+    answer_done = asyncio.Event()
+
+    def _start_follow_ups(answer: str):
+        cl.user_session.set("follow_up_task", asyncio.create_task(_send_related_questions(
+            [{"role": "user", "content": reframed_query}, {"role": "assistant", "content": answer}], answer_done
+        )))
+
+    try:
+        async with cl.Step(name="intelliwebGPT", type="llm", root=True) as step:
+            step.input = message
+            response_dict = await generate_answer(**chat_params)
+            answer_generator = response_dict['answer_generator']
+            references = response_dict['references']
+
+            answer, follow_ups_started = "", False
+            async for token in answer_generator:
+                if not answer:
+                    timings['first_token'] = perf_counter() - turn_start
+                answer += token
+                await step.stream_token(token)
+                if not follow_ups_started and FOLLOW_UP_PARTIAL_CHARS and len(answer) >= FOLLOW_UP_PARTIAL_CHARS:
+                    # Follow-up queries only need the gist of the answer, so they are generated while the rest streams
+                    _start_follow_ups(answer)
+                    follow_ups_started = True
+            timings['answer'] = perf_counter() - turn_start
+            if not follow_ups_started:
+                _start_follow_ups(answer)
+
+            if references:
+                references_str = "<ul>"
+                for reference in references:
+                    references_str += "<li><a href={}>{}</a></li>".format(reference, reference)
+                references_str += "</ul>"
+                await step.stream_token(f"\n<hr><h3>References:</h3>{references_str}")
+
+        await step.update()
+    except BaseException:
+        # e.g. the turn was stopped by the user
+        _cancel_follow_ups()
+        raise
+    answer_done.set()
+    chat_history.append({"role": "assistant", "content": step.output})
     cl.user_session.set("chat_history", chat_history)
+    print("Chat turn timings: " + ", ".join(f"{phase} {seconds:.2f} s" for phase, seconds in timings.items()))
 
-    related_questions = await follow_up_query_creator.create_follow_up_queries(cl.user_session.get("chat_history")[-2:])
-    related_questions_actions = [
-        cl.Action(name="Thinking and Answering...", label=question, value=question, description=question)
-        for question in related_questions
-    ]
-    msg = cl.Message(content="Related Questions:", actions=related_questions_actions, disable_feedback=True)
-    await msg.send()
-    cl.user_session.set("related_questions_msg", msg)
+
+@cl.on_stop
+async def stop():
+    _cancel_follow_ups()
 
 
 @cl.on_chat_start
 async def start():
+    global _warm_up_task
     cl.user_session.set("chat_history", [])
+    if _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(_warm_up_llms())
     await cl.Message(
         content="Hi there!\nI am **intelliweb-GPT**, a question answering tool that help you answer your questions by "
                 "accessing the internet.\n"
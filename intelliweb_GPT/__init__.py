@@ -2,6 +2,13 @@ from dotenv import load_dotenv
 
 load_dotenv()
 
-from intelliweb_GPT.main import generate_answer
 
-__all__ = ['generate_answer']
+def __getattr__(name):
+    # Deferred, so that importing the package does not pull in llama_index and the LLM and scraper integrations
+    if name in ('generate_answer', 'generate_answers'):
+        from intelliweb_GPT import main
+        return getattr(main, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['generate_answer', 'generate_answers']
@@ -0,0 +1,8 @@
+from intelliweb_GPT.cache.ttl import TTLCache
+from intelliweb_GPT.cache.singleflight import SingleFlight
+from intelliweb_GPT.cache.page import PageCache, CachedPage, normalize_url
+from intelliweb_GPT.cache.embedding import EmbeddingCache
+from intelliweb_GPT.cache.answer import AnswerCache, CachedAnswer
+
+__all__ = ['TTLCache', 'SingleFlight', 'PageCache', 'CachedPage', 'normalize_url', 'EmbeddingCache', 'AnswerCache',
+           'CachedAnswer']
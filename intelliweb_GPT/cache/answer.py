@@ -0,0 +1,151 @@
+import os
+import re
+import time
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Sequence
+
+import numpy as np
+
+
+@dataclass
+class CachedAnswer:
+    query: str
+    answer: str
+    references: List[str] = field(default_factory=list)
+    source: str = 'LLM'
+    similarity: float = 1.0
+
+
+class AnswerCache:
+    """
+    In-memory cache of final answers, looked up by the similarity of query embeddings, so that paraphrases of a query
+    answered before are served without running the pipeline again. A lookup hits the most similar live entry if its
+    cosine similarity is at least `threshold`.
+
+    Entries expire after a TTL that depends on the source the answer came from (news goes stale in minutes, answers
+    from the LLM's own knowledge last for days), and the least recently used entry is evicted once `max_entries` are
+    held. The embeddings live in a matrix preallocated for `max_entries` rows, so memory is bounded and a lookup is a
+    single matrix-vector product. Keeps count of its hits, misses and evictions.
+
+    Embeddings of short queries differing only by an entity or a number ("weather in Paris" and "weather in Prague",
+    "2023 results" and "2024 results") are often similar enough to pass any threshold, so a hit also requires both
+    queries to have the same numbers and capitalized words (see `key_tokens`).
+    """
+
+    def __init__(self, max_entries: int = None, threshold: float = None, ttls: Dict[str, float] = None):
+        self._max_entries = max_entries or int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', 2048))
+        self._threshold = threshold if threshold is not None else float(os.getenv('ANSWER_CACHE_THRESHOLD', 0.95))
+        self._ttls = ttls or {
+            'Google News Search': float(os.getenv('ANSWER_CACHE_TTL_NEWS', 10 * 60)),
+            'Google Web Search': float(os.getenv('ANSWER_CACHE_TTL_SEARCH', 6 * 60 * 60)),
+            'LLM': float(os.getenv('ANSWER_CACHE_TTL_LLM', 7 * 24 * 60 * 60)),
+        }
+        self._vectors: np.ndarray | None = None  # Allocated on the first insert, once the dimension is known
+        # Free rows never expire, so they can be masked out of lookups like expired ones
+        self._expires_at = np.full(self._max_entries, -np.inf)
+        self._entries: OrderedDict[int, CachedAnswer] = OrderedDict()  # Row -> entry, least recently used first
+        self._key_tokens: Dict[int, FrozenSet[str]] = {}
+        self._free_rows = list(range(self._max_entries - 1, -1, -1))
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key_tokens(query: str) -> FrozenSet[str]:
+        """
+        Returns the words of the query that likely name what it is about: those with digits and those capitalized
+        past the first word.
+        """
+        words = re.findall(r"[\w'-]+", query)
+        return frozenset(word.lower() for index, word in enumerate(words)
+                         if any(char.isdigit() for char in word) or (index and word[0].isupper()))
+
+    @staticmethod
+    def _normalize(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        return vector / (np.linalg.norm(vector) or 1)
+
+    def _release(self, row: int):
+        del self._entries[row]
+        del self._key_tokens[row]
+        self._expires_at[row] = -np.inf
+        self._free_rows.append(row)
+
+    def _best_match(self, vector: np.ndarray, key_tokens: FrozenSet[str]) -> (int | None, float):
+        """
+        Returns the row of the most similar live entry above the threshold with the same key tokens, if any.
+        """
+        similarities = self._vectors @ vector
+        similarities[self._expires_at < time.monotonic()] = -np.inf
+        candidates = np.flatnonzero(similarities >= self._threshold)
+        for row in candidates[np.argsort(-similarities[candidates])]:
+            if self._key_tokens[row] == key_tokens:
+                return int(row), float(similarities[row])
+        return None, 0.0
+
+    def get(self, embedding: Sequence[float], query: str) -> CachedAnswer | None:
+        """
+        Returns the cached answer to the most similar query, or None if no live entry is similar enough.
+        """
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._entries and self._vectors.shape[1] == len(vector):
+                row, similarity = self._best_match(vector, self.key_tokens(query))
+                if row is not None:
+                    self._entries.move_to_end(row)
+                    self.hits += 1
+                    entry = self._entries[row]
+                    return CachedAnswer(entry.query, entry.answer, list(entry.references), entry.source, similarity)
+            self.misses += 1
+            return None
+
+    def set(self, query: str, embedding: Sequence[float], answer: str, references: List[str], source: str):
+        """
+        Caches the answer to the query, for the TTL of its source. It replaces the entry of a query similar enough to
+        be served in its place.
+        """
+        ttl = self._ttls.get(source, 0)
+        if ttl <= 0:
+            return
+        vector = self._normalize(embedding)
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != len(vector):
+                # The embedding model changed, so the cached embeddings can no longer be compared with new ones
+                self._vectors = np.zeros((self._max_entries, len(vector)), dtype=np.float32)
+                for row in list(self._entries):
+                    self._release(row)
+
+            key_tokens = self.key_tokens(query)
+            row, _ = self._best_match(vector, key_tokens) if self._entries else (None, 0.0)
+            if row is not None:
+                self._release(row)
+            if not self._free_rows:
+                for expired_row in [row for row in self._entries if self._expires_at[row] < time.monotonic()]:
+                    self._release(expired_row)
+            if not self._free_rows:
+                self._release(next(iter(self._entries)))
+                self.evictions += 1
+
+            row = self._free_rows.pop()
+            self._vectors[row] = vector
+            self._expires_at[row] = time.monotonic() + ttl
+            self._entries[row] = CachedAnswer(query, answer, list(references), source)
+            self._key_tokens[row] = key_tokens
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def stats(self) -> Dict:
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses, 'hit_rate': self.hit_rate,
+                'evictions': self.evictions}
+
+
+__all__ = ['AnswerCache', 'CachedAnswer']
@@ -0,0 +1,190 @@
+import os
+import re
+import json
+import fcntl
+import hashlib
+import threading
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+def _hash_text(text: str) -> str:
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class _EmbeddingStore:
+    """
+    Embeddings of a single model. Vectors are appended to a raw float32 file which is memory-mapped for reads, and the
+    hash of the text of each vector is appended to an index file, one per line, in the same order. Appends are guarded
+    by a file lock, so that several processes can share a store.
+
+    An append writes its vectors before their index lines, so a crash can only leave vectors without index lines or a
+    partial last index line. Both are cut off by the next append, before it writes, so that rows never shift.
+
+    Once more than `max_rows` rows would be held, the oldest are dropped: the newest three quarters are copied to a new
+    generation of files, which `meta.json` then points to. Processes reading an older generation reload from scratch.
+    """
+
+    def __init__(self, directory: str, max_rows: int = None):
+        os.makedirs(directory, exist_ok=True)
+        self._directory = directory
+        self._max_rows = max_rows or int(os.getenv('EMBEDDING_CACHE_MAX_ROWS', 500000))
+        self._meta_path = os.path.join(directory, 'meta.json')
+        self._lock_path = os.path.join(directory, '.lock')
+        self._lock = threading.Lock()
+        self._generation: int | None = None
+        self._dim: int | None = None
+        self._reset(0)
+        self._load()
+
+    def _paths(self, generation: int) -> (str, str):
+        suffix = f'.{generation}' if generation else ''
+        return (os.path.join(self._directory, f'vectors{suffix}.f32'),
+                os.path.join(self._directory, f'index{suffix}.txt'))
+
+    def _reset(self, generation: int):
+        self._generation = generation
+        self._vectors_path, self._index_path = self._paths(generation)
+        self._rows: Dict[str, int] = {}
+        self._n_index_rows = 0
+        self._index_offset = 0
+        self._vectors: np.ndarray | None = None
+
+    def _write_meta(self):
+        with open(self._meta_path + '.tmp', 'w') as f:
+            json.dump({'dim': self._dim, 'generation': self._generation}, f)
+        os.replace(self._meta_path + '.tmp', self._meta_path)
+
+    def _load(self):
+        """
+        Picks up the rows appended to the files since they were last read (possibly by another process).
+        """
+        if not os.path.exists(self._meta_path):
+            return
+        with open(self._meta_path) as f:
+            meta = json.load(f)
+        self._dim = meta['dim']
+        if meta.get('generation', 0) != self._generation:
+            self._reset(meta.get('generation', 0))
+        if not os.path.exists(self._index_path):
+            return
+        with open(self._index_path) as f:
+            f.seek(self._index_offset)
+            lines = f.read()
+        # A partially written last line belongs to an append still in progress
+        complete = lines[:lines.rfind('\n') + 1]
+        self._index_offset += len(complete.encode())
+        for text_hash in complete.splitlines():
+            self._rows.setdefault(text_hash, self._n_index_rows)
+            self._n_index_rows += 1
+        vectors_size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        n_rows = min(self._n_index_rows, vectors_size // (4 * self._dim))
+        self._vectors = np.memmap(self._vectors_path, dtype=np.float32, mode='r', shape=(n_rows, self._dim)) \
+            if n_rows else None
+
+    def _rewrite(self, first_row: int, last_row: int):
+        """
+        Moves rows `first_row` to `last_row` (excluded) to a new generation of files and drops the others. Must hold
+        the file lock.
+        """
+        hashes = [None] * last_row
+        for text_hash, row in self._rows.items():
+            if row < last_row:
+                hashes[row] = text_hash
+        kept = [row for row in range(first_row, last_row) if hashes[row] is not None]
+        old_paths, generation = self._paths(self._generation), self._generation + 1
+        vectors_path, index_path = self._paths(generation)
+        with open(vectors_path, 'wb') as f:
+            if kept:
+                f.write(np.ascontiguousarray(self._vectors[kept]).tobytes())
+        with open(index_path, 'w') as f:
+            f.write(''.join(f"{hashes[row]}\n" for row in kept))
+        self._reset(generation)
+        self._write_meta()
+        for path in old_paths:
+            if os.path.exists(path):
+                os.remove(path)  # Still readable through the memory maps of other processes until they reload
+        self._load()
+
+    def _repair(self):
+        """
+        Cuts off what a crashed append left behind. Must hold the file lock, so that no append is in progress.
+        """
+        if os.path.exists(self._index_path) and os.path.getsize(self._index_path) > self._index_offset:
+            os.truncate(self._index_path, self._index_offset)
+        vectors_size = os.path.getsize(self._vectors_path) if os.path.exists(self._vectors_path) else 0
+        expected_size = self._n_index_rows * self._dim * 4
+        if vectors_size > expected_size:
+            os.truncate(self._vectors_path, expected_size)
+        elif vectors_size < expected_size:
+            # Index lines without their vectors can only come from a damaged file, so they are dropped
+            self._rewrite(0, vectors_size // (self._dim * 4))
+
+    def lookup(self, text_hashes: Sequence[str]) -> List[np.ndarray | None]:
+        with self._lock:
+            if any(text_hash not in self._rows for text_hash in text_hashes):
+                self._load()
+            vectors, n_rows = self._vectors, 0 if self._vectors is None else len(self._vectors)
+            rows = [self._rows.get(text_hash) for text_hash in text_hashes]
+        return [vectors[row] if row is not None and row < n_rows else None for row in rows]
+
+    def add(self, text_hashes: Sequence[str], vectors: np.ndarray):
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock, open(self._lock_path, 'w') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self._load()
+            if self._dim is None:
+                self._dim = vectors.shape[1]
+                self._write_meta()
+            self._repair()
+            new = {}
+            for text_hash, vector in zip(text_hashes, vectors):
+                if text_hash not in self._rows and text_hash not in new:
+                    new[text_hash] = vector
+            new = dict(list(new.items())[-self._max_rows:])
+            if new and self._n_index_rows + len(new) > self._max_rows:
+                n_kept = max(self._max_rows * 3 // 4 - len(new), 0)
+                self._rewrite(self._n_index_rows - n_kept, self._n_index_rows)
+            if new:
+                # Vectors are written before their index lines, so an index line always has its vector on disk
+                with open(self._vectors_path, 'ab') as f:
+                    f.write(np.stack(list(new.values())).tobytes())
+                with open(self._index_path, 'a') as f:
+                    f.write(''.join(f"{text_hash}\n" for text_hash in new))
+                self._load()
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of text embeddings, keyed by embedding model and the hash of the embedded text. Cached vectors
+    are returned as zero-copy views into a memory-mapped file, so only texts not seen before need to be embedded. Each
+    model keeps up to `EMBEDDING_CACHE_MAX_ROWS` embeddings (500,000 by default), dropping the oldest beyond that.
+    """
+
+    def __init__(self, directory: str = None):
+        cache_dir = os.getenv('INTELLIWEB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'intelliweb_GPT'))
+        self._directory = directory or os.path.join(cache_dir, 'embeddings')
+        self._stores: Dict[str, _EmbeddingStore] = {}
+        self._lock = threading.Lock()
+
+    def _get_store(self, model_name: str) -> _EmbeddingStore:
+        with self._lock:
+            if model_name not in self._stores:
+                self._stores[model_name] = _EmbeddingStore(
+                    os.path.join(self._directory, re.sub(r'[^\w.-]', '_', model_name))
+                )
+            return self._stores[model_name]
+
+    def lookup(self, model_name: str, texts: Sequence[str]) -> List[np.ndarray | None]:
+        """
+        Returns the cached embedding of each text, or None for the texts that have not been embedded yet.
+        """
+        return self._get_store(model_name).lookup([_hash_text(text) for text in texts])
+
+    def add(self, model_name: str, texts: Sequence[str], vectors: Sequence[Sequence[float]] | np.ndarray):
+        if len(texts):
+            self._get_store(model_name).add([_hash_text(text) for text in texts], np.asarray(vectors))
+
+
+__all__ = ['EmbeddingCache']
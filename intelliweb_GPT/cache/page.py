@@ -0,0 +1,122 @@
+import os
+import time
+import sqlite3
+import threading
+from dataclasses import dataclass
+from urllib.parse import urlsplit, urlunsplit, parse_qsl, urlencode
+
+_TRACKING_PARAMS = ('utm_', 'fbclid', 'gclid', 'mc_cid', 'mc_eid', 'ocid')
+
+
+def normalize_url(url: str) -> str:
+    """
+    Normalizes a URL so that trivially different spellings of the same page share a cache entry. Lowercases the scheme
+    and host, drops default ports, fragments and tracking parameters, and sorts the query parameters.
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower()
+    host = (parts.hostname or '').lower()
+    if parts.port and (scheme, parts.port) not in (('http', 80), ('https', 443)):
+        host = f"{host}:{parts.port}"
+    query = urlencode(sorted(
+        (key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+        if not key.lower().startswith(_TRACKING_PARAMS)
+    ))
+    return urlunsplit((scheme, host, parts.path or '/', query, ''))
+
+
+@dataclass
+class CachedPage:
+    url: str
+    text: str
+    etag: str | None
+    last_modified: str | None
+    fetched_at: float
+
+
+class PageCache:
+    """
+    Persistent cache of pages extracted from the web, keyed by normalized URL. Entries hold the extracted text along
+    with the validators (ETag/Last-Modified) of the response it was extracted from, so that stale entries can be
+    revalidated with a conditional GET instead of being downloaded and extracted again.
+
+    Entries are fresh for a TTL that depends on the source they are used for ('news' pages change faster than 'search'
+    ones) and the least recently used entries are evicted once the texts stored exceed `max_bytes`, down to 90% of it.
+    The bytes stored are tracked as entries are written rather than summed over the table, and only summed again once
+    they seem to exceed `max_bytes` (other processes may share the cache).
+
+    Its methods block on sqlite, so async code calls them in a thread (see `DocumentGetter`).
+    """
+
+    def __init__(self, path: str = None, max_bytes: int = None, ttls: dict = None):
+        cache_dir = os.getenv('INTELLIWEB_CACHE_DIR', os.path.join(os.path.expanduser('~'), '.cache', 'intelliweb_GPT'))
+        self._path = path or os.path.join(cache_dir, 'pages.sqlite3')
+        self._max_bytes = max_bytes or int(os.getenv('PAGE_CACHE_MAX_BYTES', 256 * 1024 * 1024))
+        self._ttls = ttls or {
+            'news': float(os.getenv('PAGE_CACHE_TTL_NEWS', 15 * 60)),
+            'search': float(os.getenv('PAGE_CACHE_TTL_SEARCH', 24 * 60 * 60)),
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(self._path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            "url TEXT PRIMARY KEY, text TEXT NOT NULL, etag TEXT, last_modified TEXT, fetched_at REAL NOT NULL, "
+            "accessed_at REAL NOT NULL, size INTEGER NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS pages_accessed_at ON pages (accessed_at)")
+        self._total_bytes = self._stored_bytes()
+
+    def _stored_bytes(self) -> int:
+        return self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def get(self, url: str) -> CachedPage | None:
+        """
+        Returns the cached page for the URL (fresh or not), or None if it is not cached.
+        """
+        key = normalize_url(url)
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, etag, last_modified, fetched_at FROM pages WHERE url = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE pages SET accessed_at = ? WHERE url = ?", (time.time(), key))
+        return CachedPage(url, *row)
+
+    def is_fresh(self, page: CachedPage, source: str = 'search') -> bool:
+        return time.time() - page.fetched_at < self._ttls.get(source, self._ttls['search'])
+
+    def put(self, url: str, text: str, etag: str = None, last_modified: str = None):
+        now, key, size = time.time(), normalize_url(url), len(text.encode())
+        with self._lock:
+            replaced = self._conn.execute("SELECT size FROM pages WHERE url = ?", (key,)).fetchone()
+            self._conn.execute("INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?, ?, ?)",
+                               (key, text, etag, last_modified, now, now, size))
+            self._total_bytes += size - (replaced[0] if replaced else 0)
+            if self._total_bytes > self._max_bytes:
+                self._evict()
+
+    def mark_revalidated(self, url: str):
+        """
+        Marks a cached page as fresh again, after the server answered a conditional GET with 304 Not Modified.
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute("UPDATE pages SET fetched_at = ?, accessed_at = ? WHERE url = ?",
+                               (now, now, normalize_url(url)))
+
+    def _evict(self):
+        # Evicting below the limit leaves room for the next puts, so that the table is not summed on each of them
+        self._total_bytes, target_bytes = self._stored_bytes(), int(self._max_bytes * 0.9)
+        if self._total_bytes <= self._max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT url, size FROM pages ORDER BY accessed_at").fetchall():
+            self._conn.execute("DELETE FROM pages WHERE url = ?", (key,))
+            self._total_bytes -= size
+            if self._total_bytes <= target_bytes:
+                break
+
+
+__all__ = ['PageCache', 'CachedPage', 'normalize_url']
@@ -0,0 +1,45 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls for the same key: while a call is in flight, later callers with the same key wait for
+    its result instead of making their own. Keeps count of the calls it saved.
+    """
+
+    def __init__(self):
+        self._in_flight: Dict[Hashable, _Call] = {}
+        self.coalesced = 0
+
+    def _forget(self, key: Hashable, call: _Call):
+        if self._in_flight.get(key) is call:
+            del self._in_flight[key]
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._in_flight.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(func()))
+            self._in_flight[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+        else:
+            self.coalesced += 1
+        call.waiters += 1
+        try:
+            # Shielded so that one caller giving up does not cancel the call for everyone else waiting on it
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            if not call.waiters and not call.task.done():
+                # The last caller gave up, so nobody needs the result any more
+                self._forget(key, call)
+                call.task.cancel()
+
+
+__all__ = ['SingleFlight']
@@ -0,0 +1,49 @@
+import time
+import threading
+from collections import OrderedDict
+from typing import Any, Hashable
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    In-memory LRU cache whose entries expire after a per-entry TTL. Keeps count of its hits and misses.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._entries: OrderedDict[Hashable, (float, Any)] = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            expires_at, value = self._entries.get(key, (0, _MISSING))
+            if value is _MISSING or expires_at < time.monotonic():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key: Hashable, value: Any, ttl: float = None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (self._ttl if ttl is None else ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+__all__ = ['TTLCache']
@@ -1,8 +1,22 @@
-from intelliweb_GPT.components.answer import QueryAnswerer
-from intelliweb_GPT.components.source import SourceSelector
-from intelliweb_GPT.components.web import WebRetriever
-from intelliweb_GPT.components.document import DocumentGetter
-from intelliweb_GPT.components.reframe import QueryReframer
-from intelliweb_GPT.components.follow_up import FollowUpQueryCreator
-
-__all__ = ['QueryAnswerer', 'SourceSelector', 'WebRetriever', 'DocumentGetter', 'QueryReframer', 'FollowUpQueryCreator']
+import importlib
+
+# Components are imported on first access, so that using one of them does not import the dependencies of all of them
+_component_modules = {
+    'QueryAnswerer': 'intelliweb_GPT.components.answer',
+    'SourceSelector': 'intelliweb_GPT.components.source',
+    'WebRetriever': 'intelliweb_GPT.components.web',
+    'DocumentGetter': 'intelliweb_GPT.components.document',
+    'QueryReframer': 'intelliweb_GPT.components.reframe',
+    'QueryPlanner': 'intelliweb_GPT.components.planner',
+    'FollowUpQueryCreator': 'intelliweb_GPT.components.follow_up',
+}
+
+
+def __getattr__(name):
+    if name in _component_modules:
+        return getattr(importlib.import_module(_component_modules[name]), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+__all__ = ['QueryAnswerer', 'SourceSelector', 'WebRetriever', 'DocumentGetter', 'QueryReframer', 'QueryPlanner',
+           'FollowUpQueryCreator']
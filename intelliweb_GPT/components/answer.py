@@ -1,15 +1,53 @@
-from typing import List, Dict, AsyncGenerator
-from intelliweb_GPT.llms import load_llm
+import os
+import asyncio
+import numpy as np
+from time import perf_counter
+from typing import List, Dict, Tuple, AsyncGenerator, AsyncIterable
+from intelliweb_GPT.llms import load_llm, load_embed_model, get_model_tokenizer, get_token_limits
+from intelliweb_GPT.cache import EmbeddingCache
+from intelliweb_GPT.retrieval import BM25Retriever, ContextPacker, HybridRetriever, MinHashDeduplicator, NumpyRetriever
+from intelliweb_GPT.components.document import collect_documents
+from intelliweb_GPT.telemetry import span, record_span, current_trace_id
 
-from llama_index.core import VectorStoreIndex, get_response_synthesizer
-from llama_index.core.schema import Document
+from llama_index.core import PromptHelper, Settings, VectorStoreIndex, get_response_synthesizer
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.ingestion import arun_transformations
+from llama_index.core.schema import BaseNode, Document, MetadataMode, NodeWithScore, QueryBundle
 from llama_index.core.llms import ChatMessage, MessageRole
 from llama_index.core.prompts import ChatPromptTemplate
-from llama_index.core.retrievers import VectorIndexRetriever
+from llama_index.core.prompts.prompt_utils import get_biggest_prompt
+from llama_index.core.retrievers import BaseRetriever, VectorIndexRetriever
 from llama_index.core.query_engine import RetrieverQueryEngine
 
 
 class QueryAnswerer:
+    """
+    Generates answers to user queries, either from documents scraped from the web or from the LLM's own knowledge.
+
+    Attributes:
+        _embed_model: Model to embed document chunks and queries with. Defaults to the one configured through the
+            `EMBED_BACKEND` env variable
+        _embedding_cache: Cache of the chunk embeddings computed previously. Disabled if the `EMBEDDING_CACHE_ENABLED`
+            env variable is false
+        _deduplicator: Drops near-duplicate documents and chunks before they are embedded. Its similarity threshold
+            is set by the `DEDUP_THRESHOLD` env variable, and it is disabled if `DEDUP_ENABLED` is false
+        _context_packer: Fits the retrieved chunks into a single prompt, so that no refine calls are needed.
+            Disabled if the `CONTEXT_PACKING_ENABLED` env variable is false
+    """
+
+    def __init__(self, embed_model: BaseEmbedding = None, embedding_cache: EmbeddingCache = None,
+                 deduplicator: MinHashDeduplicator = None, context_packer: ContextPacker = None):
+        self._embed_model = embed_model
+        self._embedding_cache = embedding_cache or (
+            EmbeddingCache() if os.getenv("EMBEDDING_CACHE_ENABLED", "true").lower() == "true" else None
+        )
+        self._deduplicator = deduplicator or (
+            MinHashDeduplicator(threshold=float(os.getenv("DEDUP_THRESHOLD", 0.8)))
+            if os.getenv("DEDUP_ENABLED", "true").lower() == "true" else None
+        )
+        self._context_packer = context_packer or (
+            ContextPacker() if os.getenv("CONTEXT_PACKING_ENABLED", "true").lower() == "true" else None
+        )
 
     @staticmethod
     def _format_msgs(messages: List) -> List:
@@ -27,21 +65,167 @@ class QueryAnswerer:
             formatted_msgs.append(ChatMessage(role=role, content=msg['content']))
         return formatted_msgs
 
-    async def answer_from_documents(self, query: str, documents: List[Document], qa_prompt: List[ChatMessage] = None,
-                                    refine_prompt: List[ChatMessage] = None, stream: bool = False,
-                                    **kwargs) -> AsyncGenerator | Dict:
+    @property
+    def embed_model(self) -> BaseEmbedding:
+        return self._embed_model or load_embed_model()
+
+    async def _aembed_texts(self, texts: List[str]) -> List:
+        """
+        Embeds the texts. Only the texts missing from the embedding cache are sent to the embedding model.
+        """
+        embed_model = self.embed_model
+        with span('embedding', chunks=len(texts)) as embedding_span:
+            if self._embedding_cache is None:
+                return await embed_model.aget_text_embedding_batch(texts)
+
+            model_key = f"{embed_model.class_name()}:{embed_model.model_name}"
+            # The cache reads and writes files under a lock shared with other processes, so it is kept off the loop
+            embeddings = await asyncio.to_thread(self._embedding_cache.lookup, model_key, texts)
+            missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+            embedding_span.set_attribute('cache', 'miss' if len(missing) == len(texts) else 'partial' if missing
+                                         else 'hit')
+            embedding_span.set_attribute('embedded_chunks', len(missing))
+            if missing:
+                new_embeddings = await embed_model.aget_text_embedding_batch([texts[i] for i in missing])
+                await asyncio.to_thread(self._embedding_cache.add, model_key, [texts[i] for i in missing],
+                                        new_embeddings)
+                for i, embedding in zip(missing, new_embeddings):
+                    embeddings[i] = embedding
+        print(f"Embedded {len(missing)} of {len(texts)} chunks, {len(texts) - len(missing)} found in cache.")
+        return embeddings
+
+    def _deduplicate(self, items: List, key) -> List:
+        # A few milliseconds per page, cheaper than a round trip through the (often busy) default thread pool
+        return self._deduplicator.deduplicate(items, key) if self._deduplicator else items
+
+    async def _achunk_documents(self, documents: List[Document]) -> List[BaseNode]:
+        """
+        Splits the documents into nodes, on the event loop with async calls. Near-duplicate documents, and then
+        near-duplicate chunks, are dropped.
+        """
+        with span('dedup_documents', documents=len(documents)) as dedup_span:
+            unique_documents = self._deduplicate(documents, key=lambda document: document.text)
+            dedup_span.set_attribute('duplicate_documents', len(documents) - len(unique_documents))
+        with span('chunking', documents=len(unique_documents)) as chunking_span:
+            nodes = await arun_transformations(unique_documents, Settings.transformations)
+            chunking_span.set_attribute('chunks', len(nodes))
+        with span('dedup_chunks', chunks=len(nodes)) as dedup_span:
+            unique_nodes = self._deduplicate(nodes, key=lambda node: node.get_content(MetadataMode.NONE))
+            dedup_span.set_attribute('duplicate_chunks', len(nodes) - len(unique_nodes))
+        if len(unique_documents) < len(documents) or len(unique_nodes) < len(nodes):
+            print(f"Dropped {len(documents) - len(unique_documents)} near-duplicate documents and "
+                  f"{len(nodes) - len(unique_nodes)} near-duplicate chunks.")
+        return unique_nodes
+
+    async def _aembed_documents(self, documents: List[Document]) -> (List[BaseNode], List):
+        """
+        Splits the documents into nodes and embeds them. Both run on the event loop with async calls
+        (`VectorStoreIndex.from_documents` would block it).
+        """
+        nodes = await self._achunk_documents(documents)
+        embeddings = await self._aembed_texts([node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes])
+        return nodes, embeddings
+
+    async def aindex_documents(self, documents: List[Document],
+                               retrieval_mode: str = 'vector') -> (List[BaseNode], List | None):
+        """
+        Splits the documents into chunks and, unless they are retrieved lexically, embeds them.
+
+        Returns:
+            (List[BaseNode], List | None): The chunks and their embeddings (None for the 'lexical' retrieval mode)
+        """
+        if retrieval_mode == 'lexical':
+            return await self._achunk_documents(documents), None
+        return await self._aembed_documents(documents)
+
+    def _create_retriever(self, nodes: List[BaseNode], embeddings: List | None, **kwargs) -> BaseRetriever:
+        """
+        Creates the retriever for the `retrieval_mode` kwarg: 'vector' (default) for an in-memory NumPy retriever,
+        'index' for a llama_index vector store index, 'lexical' for BM25 over the chunks (no embeddings needed) or
+        'hybrid' for both BM25 and vector retrieval, with their rankings fused.
+        """
+        similarity_top_k = kwargs.get('similarity_top_k', 5)
+        match kwargs.get('retrieval_mode', 'vector'):
+            case 'index':
+                for node, embedding in zip(nodes, embeddings):
+                    node.embedding = np.asarray(embedding).tolist()
+                index = VectorStoreIndex(nodes=nodes, embed_model=self.embed_model)
+                return VectorIndexRetriever(index=index, similarity_top_k=similarity_top_k)
+            case 'vector':
+                return NumpyRetriever(nodes, embeddings, embed_model=self.embed_model,
+                                      similarity_top_k=similarity_top_k)
+            case 'lexical':
+                return BM25Retriever(nodes, similarity_top_k=similarity_top_k)
+            case 'hybrid':
+                # Each retriever ranks more candidates than are kept, so that nodes ranked highly by only one of them
+                # still make it into the fused ranking
+                candidates = similarity_top_k * kwargs.get('hybrid_candidates_factor', 2)
+                return HybridRetriever([
+                    BM25Retriever(nodes, similarity_top_k=candidates),
+                    NumpyRetriever(nodes, embeddings, embed_model=self.embed_model, similarity_top_k=candidates),
+                ], similarity_top_k=similarity_top_k)
+            case retrieval_mode:
+                raise Exception(f"Invalid retrieval mode {repr(retrieval_mode)}. "
+                                f"Must be one of 'vector', 'index', 'lexical', 'hybrid'")
+
+    async def answer_from_documents(self, query: str, documents: List[Document] | AsyncIterable[Tuple[str, List]],
+                                    qa_prompt: List[ChatMessage] = None, refine_prompt: List[ChatMessage] = None,
+                                    stream: bool = False, **kwargs) -> AsyncGenerator | Dict:
         """
         Given a query and list of documents, it generates answer to the query using the texts from the documents as
         contest.
+
+        `documents` can also be a stream of scraped documents (see `DocumentGetter.astream_documents_from_urls`), in
+        which case indexing starts as soon as `min_documents` URLs have arrived or `collect_timeout` seconds have
+        passed (passed as kwargs), and the remaining URLs are cancelled.
+
+        The `retrieval_mode` kwarg picks how chunks are retrieved (see `_create_retriever`). 'lexical' skips the
+        embedding of the chunks altogether, for the lowest latency at some cost in relevance.
+
+        Several queries can be answered from the same documents without chunking and embedding them again for each,
+        by passing what `aindex_documents` returned for them as the `indexed_documents` kwarg.
         """
 
+        # The response is generated when the caller consumes it, possibly outside the context of the trace
+        trace_id = current_trace_id()
+
+        async def _aretrieve() -> (QueryBundle, List[NodeWithScore]):
+            query_bundle = QueryBundle(query)
+            with span('retrieval', trace_id=trace_id, mode=kwargs.get('retrieval_mode', 'vector')) as retrieval_span:
+                retrieved_nodes = await query_engine.aretrieve(query_bundle)
+                retrieval_span.set_attribute('nodes', len(retrieved_nodes))
+                retrieval_span.set_attribute('context_tokens', sum(
+                    len(tokenizer(node.get_content(metadata_mode=MetadataMode.LLM))) for node in retrieved_nodes
+                ))
+            if self._context_packer is not None:
+                with span('packing', trace_id=trace_id):
+                    retrieved_nodes = self._context_packer.pack(retrieved_nodes, query, token_budget, tokenizer)
+            return query_bundle, retrieved_nodes
+
         async def _response_stream():
-            query_results = await query_engine.aquery(query)
-            async for token in query_results.async_response_gen():
-                yield token
+            query_bundle, retrieved_nodes = await _aretrieve()
+            start_time, tokens, status = perf_counter(), [], 'cancelled'
+            try:
+                query_results = await query_engine.asynthesize(query_bundle, retrieved_nodes)
+                # In llama-index 0.10.29 the `async_response_gen` field of the response shadows the method of the same
+                # name, and holds the token generator itself
+                response_gen = query_results.async_response_gen
+                async for token in (response_gen() if callable(response_gen) else response_gen):
+                    tokens.append(token)
+                    yield token
+                status = 'ok'
+            except Exception:
+                status = 'error'
+                raise
+            finally:
+                record_span('synthesis', perf_counter() - start_time, trace_id=trace_id, mode='stream',
+                            status=status, output_tokens=len(tokenizer("".join(tokens))))
 
         async def _response():
-            query_results = await query_engine.aquery(query)
+            query_bundle, retrieved_nodes = await _aretrieve()
+            with span('synthesis', trace_id=trace_id, mode='blocking') as synthesis_span:
+                query_results = await query_engine.asynthesize(query_bundle, retrieved_nodes)
+                synthesis_span.set_attribute('output_tokens', len(tokenizer(query_results.response or "")))
             yield query_results.response.strip()
 
         print("Generating answer from documents..")
@@ -51,22 +235,32 @@ class QueryAnswerer:
         }
         print(f"Chat model params for answer generation: {model_params}")
         llm = load_llm(**model_params)
+        qa_template, refine_template = ChatPromptTemplate(qa_prompt or []), ChatPromptTemplate(refine_prompt or [])
 
-        index = VectorStoreIndex.from_documents(
-            documents,
-            use_async=True,
-            show_progress=True
-        )
-        retriever = VectorIndexRetriever(
-            index=index,
-            similarity_top_k=kwargs.get('similarity_top_k', 5),
-        )
+        # Tokens are counted with the model's own tokenizer, both here and by the synthesizer when it packs the chunks
+        # into prompts, so that chunks packed to fit the budget are answered in a single LLM call
+        tokenizer = get_model_tokenizer(model_params['model'])
+        context_window, num_output = get_token_limits(model_params['model'])
+        prompt_helper = PromptHelper(context_window=context_window, num_output=num_output, tokenizer=tokenizer)
+        # The synthesizer packs the chunks to fit the larger of its two prompts, with the query filled in
+        biggest_prompt = get_biggest_prompt([qa_template.partial_format(query_str=query),
+                                             refine_template.partial_format(query_str=query)])
+        token_budget = prompt_helper.get_text_splitter_given_prompt(biggest_prompt).chunk_size
+        token_budget = min(token_budget, kwargs.get('context_token_budget') or token_budget)
+
+        if not isinstance(documents, list):
+            documents, _ = await collect_documents(documents, min_documents=kwargs.get('min_documents'),
+                                                   soft_timeout=kwargs.get('collect_timeout'))
+        nodes, embeddings = kwargs.get('indexed_documents') or \
+            await self.aindex_documents(documents, retrieval_mode=kwargs.get('retrieval_mode', 'vector'))
+        retriever = self._create_retriever(nodes, embeddings, **kwargs)
         response_synthesizer = get_response_synthesizer(
             llm=llm,
             response_mode=kwargs.get('response_mode', 'compact'),
             streaming=stream,
-            text_qa_template=ChatPromptTemplate(qa_prompt or []),
-            refine_template=ChatPromptTemplate(refine_prompt or []),
+            text_qa_template=qa_template,
+            refine_template=refine_template,
+            prompt_helper=prompt_helper,
         )
         query_engine = RetrieverQueryEngine(
             retriever=retriever,
@@ -83,7 +277,8 @@ class QueryAnswerer:
         async def _response_stream():
             query_results = await llm.astream_chat(formatted_messages)
             async for token in query_results:  # Iterate through the query results
-                yield token
+                if token.delta:
+                    yield token.delta
 
         async def _response():
             query_results = await llm.achat(formatted_messages)
@@ -101,5 +296,11 @@ class QueryAnswerer:
 
         return _response_stream() if stream else _response()
 
+    def stats(self) -> Dict:
+        """
+        Returns how the retrieved chunks were packed into prompts (see `ContextPacker.stats`).
+        """
+        return {'context_packing': self._context_packer.stats() if self._context_packer else None}
+
 
 __all__ = ['QueryAnswerer']
@@ -1,12 +1,15 @@
 import os
-from time import time
-from typing import List
-import concurrent.futures
-from trafilatura.settings import use_config
+import asyncio
+from time import time, perf_counter
+from typing import Dict, List, Tuple, AsyncGenerator, AsyncIterable
+from functools import cached_property
+
+from intelliweb_GPT.cache import PageCache, CachedPage, SingleFlight, normalize_url
+from intelliweb_GPT.scraping import PageFetcher, TextExtractor, ScraperStats
+from intelliweb_GPT.telemetry import increment, span
 
 from llama_index.core.schema import Document
 from llama_index.core.node_parser import TokenTextSplitter
-from llama_index.readers.web import TrafilaturaWebReader, SpiderWebReader
 
 
 class DocumentGetter:
@@ -14,13 +17,39 @@ class DocumentGetter:
     Fetches and extracts documents from the provided URLs.
 
     Attributes:
-        _spider_reader: Configured document reader for spider
-        _trafilatura_reader: Configured document reader for trafilatura
+        _spider_reader: Configured document reader for spider. Created on first use
+        _page_fetcher: Downloads the raw pages for trafilatura, with caps on their size and content type
+        _text_extractor: Extracts the text of the downloaded pages with trafilatura, in a pool of worker processes
+        _page_cache: Cache of the pages scraped previously. Disabled if the `PAGE_CACHE_ENABLED` env variable is false
+        _single_flight: Coalesces concurrent scrapes of the same URL (e.g. by queries sharing search results)
+        _scraper_stats: Success rates and latencies of the scrapers per host, used by the 'hedged' scraper to pick
+            which one to try first
+        _hedge_delay: Seconds after which the 'hedged' scraper also tries the other scraper on a page. Set by the
+            `SCRAPER_HEDGE_DELAY` env variable, 2 by default
     """
 
-    def __init__(self):
+    def __init__(self, page_cache: PageCache = None, page_fetcher: PageFetcher = None,
+                 text_extractor: TextExtractor = None, scraper_stats: ScraperStats = None):
         self._text_splitter = TokenTextSplitter(separator=" ", chunk_size=1024, chunk_overlap=10)
-        self._spider_reader = SpiderWebReader(
+        self._page_cache = page_cache or (
+            PageCache() if os.getenv("PAGE_CACHE_ENABLED", "true").lower() == "true" else None
+        )
+        self._page_fetcher = page_fetcher or PageFetcher()
+        self._text_extractor = text_extractor or TextExtractor()
+        self._single_flight = SingleFlight()
+        self._scraper_stats = scraper_stats or ScraperStats()
+        self._hedge_delay = float(os.getenv("SCRAPER_HEDGE_DELAY", 2))
+        # Scrapers the 'hedged' scraper chooses from, in the order they are tried on hosts without history. The local
+        # extractor comes first, as it is faster and free
+        self._scrapers = {'trafilatura': self._ascrape_with_trafilatura, 'spider': self._ascrape_with_spider}
+
+    # The web readers take seconds to import, so they are only loaded once a scraper needs them
+
+    @cached_property
+    def _spider_reader(self):
+        from llama_index.readers.web import SpiderWebReader
+
+        return SpiderWebReader(
             api_key=os.getenv("SPIDER_API_KEY", "dummy-key"),
             mode="scrape",
             params={
@@ -30,44 +59,226 @@ class DocumentGetter:
                 "return_format": "text"
             }
         )
-        self._trafilatura_config = use_config()
-        self._trafilatura_config.set("DEFAULT", "EXTRACTION_TIMEOUT", "0")
-        self._trafilatura_reader = TrafilaturaWebReader()
 
-    def _scrape_with_trafilatura(self, url: str):
-        return self._trafilatura_reader.load_data(urls=[url], include_comments=False, include_tables=False,
-                                                  config=self._trafilatura_config)
+    def _get_cached_page(self, url: str, source: str) -> (CachedPage | None, bool):
+        """
+        Returns the cached page for the URL (if any) and whether it is still fresh for the given source.
+        """
+        page = self._page_cache.get(url) if self._page_cache else None
+        return page, page is not None and self._page_cache.is_fresh(page, source)
+
+    async def _aget_cached_page(self, url: str, source: str) -> (CachedPage | None, bool):
+        # The page cache blocks on sqlite, so it is kept off the event loop
+        if not self._page_cache:
+            return None, False
+        return await asyncio.to_thread(self._get_cached_page, url, source)
+
+    def _cache_documents(self, url: str, documents: List[Document], etag: str = None, last_modified: str = None):
+        text = "\n\n".join(document.text for document in documents)
+        if self._page_cache and text:
+            self._page_cache.put(url, text, etag=etag, last_modified=last_modified)
+
+    async def _acache_documents(self, url: str, documents: List[Document], etag: str = None,
+                                last_modified: str = None):
+        if self._page_cache and documents:
+            await asyncio.to_thread(self._cache_documents, url, documents, etag, last_modified)
+
+    def _scrape_with_spider(self, url: str, source: str = "search"):
+        page, fresh = self._get_cached_page(url, source)
+        if fresh:
+            return [Document(text=page.text, id_=url)]
+        documents = [document for document in self._spider_reader.load_data(url=url) if document.text]
+        self._cache_documents(url, documents)
+        return documents
+
+    async def _ascrape_with_trafilatura(self, url: str, source: str = "search"):
+        with span('fetch', scraper='trafilatura', url=url) as fetch_span:
+            page, fresh = await self._aget_cached_page(url, source)
+            if fresh:
+                fetch_span.set_attribute('cache', 'hit')
+                return [Document(text=page.text, id_=url)]
+
+            # A stale page is revalidated with a conditional GET, and reused as is if it has not been modified since
+            headers = {}
+            if page and page.etag:
+                headers['If-None-Match'] = page.etag
+            if page and page.last_modified:
+                headers['If-Modified-Since'] = page.last_modified
+            fetch_span.set_attribute('cache', 'miss')
+            response = await self._page_fetcher.afetch(url, headers=headers)
+            fetch_span.set_attribute('http_status', response.status_code)
+            fetch_span.set_attribute('bytes', len(response.content))
+            if page and response.status_code == 304:
+                fetch_span.set_attribute('cache', 'revalidated')
+                await asyncio.to_thread(self._page_cache.mark_revalidated, url)
+                return [Document(text=page.text, id_=url)]
+
+        # Extraction is CPU bound, so it runs in the worker processes of the extractor
+        with span('extraction', scraper='trafilatura', url=url) as extraction_span:
+            text = await self._text_extractor.aextract(response.content)
+            extraction_span.set_attribute('chars', len(text or ''))
+        documents = [Document(text=text, id_=url)] if text else []
+        await self._acache_documents(url, documents, etag=response.headers.get('ETag'),
+                                     last_modified=response.headers.get('Last-Modified'))
+        return documents
+
+    async def _ascrape_with_spider(self, url: str, source: str = "search"):
+        # Spider fetches and extracts in a single API call
+        with span('fetch', scraper='spider', url=url):
+            return await asyncio.to_thread(self._scrape_with_spider, url, source)
+
+    async def _atimed_scrape(self, scraper: str, url: str, source: str) -> List[Document]:
+        """
+        Scrapes the URL with the scraper, recording in the per-host stats whether it got any text and how long it took.
+        """
+        start_time = perf_counter()
+        try:
+            documents = await self._scrapers[scraper](url, source)
+        except Exception:
+            self._scraper_stats.record(url, scraper, False, perf_counter() - start_time)
+            increment('scrape_attempts', scraper=scraper, status='error')
+            raise
+        self._scraper_stats.record(url, scraper, bool(documents), perf_counter() - start_time)
+        increment('scrape_attempts', scraper=scraper, status='ok' if documents else 'empty')
+        return documents
+
+    async def _ascrape_hedged(self, url: str, source: str = "search"):
+        """
+        Scrapes the URL with the scraper expected to get text from its host the fastest, and starts the next one as
+        well once the first fails, comes back empty, or takes longer than `_hedge_delay` seconds. Returns the first
+        non-empty result, cancelling the scrapers still running.
+        """
+        page, fresh = await self._aget_cached_page(url, source)
+        if fresh:
+            return [Document(text=page.text, id_=url)]
+
+        scrapers = self._scraper_stats.rank(url, list(self._scrapers))
+        running: Dict[asyncio.Task, Tuple[str, float]] = {}
+        error, winner = None, None
+        try:
+            while scrapers or running:
+                if scrapers:
+                    scraper = scrapers.pop(0)
+                    task = asyncio.ensure_future(self._atimed_scrape(scraper, url, source))
+                    running[task] = (scraper, perf_counter())
+                done, _ = await asyncio.wait(running, timeout=self._hedge_delay if scrapers else None,
+                                             return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    scraper, _ = running.pop(task)
+                    try:
+                        documents = task.result()
+                    except Exception as exc:
+                        error = exc
+                        continue
+                    if documents:
+                        winner = scraper
+                        return documents
+                if scrapers:
+                    increment('scrape_hedges', status='failed' if done else 'delay')
+            if error is not None:
+                raise error
+            return []
+        finally:
+            for task, (scraper, start_time) in running.items():
+                task.cancel()
+                if winner is not None:
+                    # Outrun by the winner, so slower on this host even if it would have got the text eventually
+                    self._scraper_stats.record(url, scraper, False, perf_counter() - start_time)
+
+    def get_documents_from_urls(self, urls: List[str], scraper: str = None, source: str = "search") -> (List, List):
+        """
+        Sync version of `aget_documents_from_urls`, scraping all the URLs. Cannot be called from a running event loop.
+        """
+        return asyncio.run(self.aget_documents_from_urls(urls, scraper=scraper, source=source))
+
+    async def astream_documents_from_urls(self, urls: List[str], scraper: str = None, source: str = "search",
+                                          url_timeout: float = None,
+                                          total_timeout: float = None) -> AsyncGenerator[Tuple[str, List], None]:
+        """
+        Scrapes all the URLs concurrently and yields the documents of each URL as soon as it has been scraped. URLs
+        still in flight are cancelled when the generator is closed or when the time budget of the stage runs out.
 
-    def _scrape_with_spider(self, url: str):
-        return self._spider_reader.load_data(url=url)
+        Args:
+            urls (List[str]): URLs to scrape
+            scraper (str): Scraper to use. One of 'spider', 'hedged' (see `_ascrape_hedged`) or 'default'. Defaults to
+                the `SCRAPER` env variable
+            source (str): Source the URLs were retrieved from ('news' or 'search'). Decides how long cached pages
+                stay fresh
+            url_timeout (float): Time budget in seconds for scraping a single URL. No limit if None
+            total_timeout (float): Time budget in seconds for scraping all the URLs. No limit if None
 
-    def get_documents_from_urls(self, urls: List[str], scraper: str = None) -> (List, List):
+        Yields:
+            (str, List): A successfully scraped URL and the documents scraped from it
+        """
         scraper = scraper or os.getenv("SCRAPER")
         match scraper:
             case "spider":
                 print("Scraping with spider...")
-                scrape_url_func = self._scrape_with_spider
+                scrape_url_func = self._ascrape_with_spider
+            case "hedged":
+                print("Scraping with trafilatura, hedged with spider...")
+                scrape_url_func = self._ascrape_hedged
             case _:
                 print("Scraping with trafilatura...")
-                scrape_url_func = self._scrape_with_trafilatura
+                scrape_url_func = self._ascrape_with_trafilatura
+
+        async def _scrape(url: str):
+            try:
+                documents = await asyncio.wait_for(self._single_flight.do(
+                    (scrape_url_func.__name__, normalize_url(url)), lambda: scrape_url_func(url, source)
+                ), url_timeout)
+            except Exception as exc:
+                print(f"Failed to scrape {url}: {repr(exc)}")
+                increment('scrape_failures', status='timeout' if isinstance(exc, TimeoutError) else 'error')
+                return url, None
+            if not documents:
+                print(f"No text was extracted from {url}")
+                increment('scrape_failures', status='empty')
+            return url, documents
+
+        tasks = [asyncio.ensure_future(_scrape(url)) for url in urls]
+        try:
+            for future in asyncio.as_completed(tasks, timeout=total_timeout):
+                url, document = await future
+                if document:
+                    yield url, document
+        except TimeoutError:
+            print(f"Scraping stopped after the time budget of {total_timeout} seconds ran out.")
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def aget_documents_from_urls(self, urls: List[str], scraper: str = None, source: str = "search",
+                                       min_documents: int = None, soft_timeout: float = None,
+                                       url_timeout: float = None, total_timeout: float = None) -> (List, List):
+        """
+        Async version of `get_documents_from_urls`. All the URLs are fetched concurrently over a pooled HTTP client
+        without blocking the event loop. Returns early, cancelling the remaining URLs, once enough of them have been
+        scraped (see `collect_documents`).
 
+        Args:
+            urls (List[str]): URLs to scrape
+            scraper (str): Scraper to use. One of 'spider', 'hedged' or 'default'. Defaults to the `SCRAPER` env
+                variable
+            source (str): Source the URLs were retrieved from ('news' or 'search')
+            min_documents (int): Number of scraped URLs that is enough to return. Waits for all of them if None
+            soft_timeout (float): Seconds after which any scraped URLs are enough to return. No limit if None
+            url_timeout (float): Time budget in seconds for scraping a single URL. No limit if None
+            total_timeout (float): Time budget in seconds for scraping all the URLs. No limit if None
+
+        Returns:
+            (List, List): Documents scraped and the URLs they were successfully scraped from
+        """
         start_time = time()
-        with concurrent.futures.ThreadPoolExecutor(max_workers=6) as executor:
-            future_to_url = {executor.submit(scrape_url_func, url): url for url in urls}
-            documents, scraped_urls = [], []
-
-            for future in concurrent.futures.as_completed(future_to_url):
-                url = future_to_url[future]
-                try:
-                    document = future.result()
-                    if document:
-                        documents.extend(document)
-                        scraped_urls.append(url)
-                except Exception as exc:
-                    pass
-                    # print(f'{url} generated an exception: {exc}')
+        with span('scraping', source=source, urls=len(urls)) as scraping_span:
+            documents, scraped_urls = await collect_documents(
+                self.astream_documents_from_urls(urls, scraper=scraper, source=source, url_timeout=url_timeout,
+                                                 total_timeout=total_timeout),
+                min_documents=min_documents, soft_timeout=soft_timeout
+            )
+            scraping_span.set_attribute('scraped_urls', len(scraped_urls))
         end_time = time()
-        print(f"Scraping {len(urls)} URLs took {end_time - start_time} seconds.")
+        print(f"Scraping {len(scraped_urls)} of {len(urls)} URLs took {end_time - start_time} seconds.")
         return documents, scraped_urls
 
     def get_documents_from_texts(self, texts: List[str]) -> List[Document]:
@@ -88,6 +299,54 @@ class DocumentGetter:
         return documents
 
 
+async def collect_documents(document_stream: AsyncIterable[Tuple[str, List]], min_documents: int = None,
+                            soft_timeout: float = None) -> (List, List):
+    """
+    Collects documents from a stream (see `DocumentGetter.astream_documents_from_urls`) until "enough" have arrived,
+    and closes the stream so that the stragglers are cancelled.
+
+    Args:
+        document_stream (AsyncIterable[Tuple[str, List]]): Stream of scraped URLs and their documents
+        min_documents (int): Stops once documents from this many URLs have arrived. Consumes the whole stream if None
+        soft_timeout (float): Stops once this many seconds have passed and at least one URL has arrived. No limit if
+            None
+
+    Returns:
+        (List, List): Documents collected and the URLs they were scraped from
+    """
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + soft_timeout if soft_timeout is not None else None
+    documents, scraped_urls = [], []
+    stream = aiter(document_stream)
+    next_item = None
+    try:
+        while not min_documents or len(scraped_urls) < min_documents:
+            timeout = max(deadline - loop.time(), 0) if deadline is not None and scraped_urls else None
+            next_item = asyncio.ensure_future(anext(stream))
+            done, _ = await asyncio.wait({next_item}, timeout=timeout)
+            if not done:
+                next_item.cancel()
+                await asyncio.gather(next_item, return_exceptions=True)
+                break
+            try:
+                url, document = next_item.result()
+            except StopAsyncIteration:
+                break
+            documents.extend(document)
+            scraped_urls.append(url)
+    finally:
+        # The stream can only be closed once the pending item is done, e.g. if the collection itself was cancelled
+        if next_item is not None and not next_item.done():
+            next_item.cancel()
+            await asyncio.gather(next_item, return_exceptions=True)
+        if hasattr(stream, 'aclose'):
+            await stream.aclose()
+    return documents, scraped_urls
+
+
+__all__ = ['DocumentGetter', 'collect_documents']
+
+
 if __name__ == "__main__":
     document_getter = DocumentGetter()
     documents, scraped_urls = document_getter.get_documents_from_urls(urls=[
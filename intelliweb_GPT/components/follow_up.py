@@ -1,16 +1,12 @@
 import os
 from annotated_types import Len
 from typing import List, Dict, Annotated
-from json.decoder import JSONDecodeError
-from pydantic import BaseModel, Field, ValidationError
-from tenacity import retry, wait_fixed, stop_after_attempt, retry_if_exception_type
+from pydantic import BaseModel, Field
 
-from intelliweb_GPT.llms import load_llm
+from intelliweb_GPT.llms import load_llm, StructuredProgram
 from intelliweb_GPT.prompts import FOLLOW_UP_QUERY_CREATION
 
 from llama_index.core.llms import LLM
-from llama_index.core.program import LLMTextCompletionProgram
-from llama_index.core.output_parsers import PydanticOutputParser
 
 
 class FollowUpQueries(BaseModel):
@@ -54,17 +50,9 @@ class FollowUpQueryCreator:
         # Concatenate all messages into a single string and eliminate duplicate references, returning both
         return "\n".join(messages) + "\n"
 
-    @retry(stop=stop_after_attempt(3), wait=wait_fixed(0.2),
-           retry=(retry_if_exception_type((JSONDecodeError, ValidationError))))
     async def create_follow_up_queries(self, conversation: List[Dict], model: None | LLM = None) -> List[str]:
         llm = model or load_llm(model=os.getenv('GPT_MODEL_LITE', 'gpt-4o'))
-
-        program = LLMTextCompletionProgram.from_defaults(
-            output_parser=PydanticOutputParser(FollowUpQueries),
-            prompt_template_str=FOLLOW_UP_QUERY_CREATION,
-            llm=llm,
-            verbose=True,
-        )
+        program = StructuredProgram(FollowUpQueries, FOLLOW_UP_QUERY_CREATION, llm, verbose=True)
 
         serialized_conversation = self._serialize_conversation(conversation)
 
@@ -72,8 +60,8 @@ class FollowUpQueryCreator:
             output = await program.acall(serialized_conversation=serialized_conversation)
             print("Generating follow-up queries")
             return output.queries
-        except:
-            print("Failed to generate any follow-up queries.")
+        except Exception as exc:
+            print(f"Failed to generate any follow-up queries: {exc}")
         return []
 
 
@@ -0,0 +1,157 @@
+import os
+import json
+import asyncio
+import hashlib
+from typing import Dict, List, Literal
+from pydantic import BaseModel, Field
+
+from intelliweb_GPT.cache import TTLCache
+from intelliweb_GPT.llms import load_llm, StructuredProgram
+from intelliweb_GPT.prompts import QUERY_PLANNING
+from intelliweb_GPT.components.source import SourceSelector
+
+from llama_index.core.llms import LLM
+
+
+class QueryPlan(BaseModel):
+    """
+    Pydantic Class holding everything decided about a user query before retrieval: the query reframed to be
+    standalone, the source to answer it from and the search query for that source.
+    """
+    reframed_query: str = Field(
+        description="A user's query that has been modified to be self-sufficient and does not rely on prior "
+                    "conversation context"
+    )
+    source: Literal['Google Web Search', 'Google News Search', 'LLM'] = Field(
+        description="Denotes the source employed to provide the most suitable answer for the reframed query",
+        example="Google Web Search"
+    )
+    search_query: str = Field(
+        description="Represents the most suitable search query for obtaining the optimum results for the user's web "
+                    "search. In case of no web search, 'NA' is returned. It must not contain any conditional operators "
+                    "such as 'AND', 'OR', etc. and filters like 'site', etc."
+    )
+
+
+class QueryPlanner:
+    """
+    Plans how to answer the latest user query of a conversation. Reframing the query from the conversation and
+    selecting its source take a single structured LLM call, instead of one call each. Queries that start a conversation
+    need no reframing, so they are routed by the tiers of the `SourceSelector` instead (see `SourceSelector`).
+
+    Plans are cached, keyed by the hash of the conversation tail they were made for, so that retrying a turn or
+    reframing and routing the same turn separately (see `QueryReframer`) costs a single call.
+    """
+
+    def __init__(self, source_selector: SourceSelector = None, plan_cache: TTLCache = None):
+        self._source_selector = source_selector or SourceSelector()
+        self._plan_cache = plan_cache or TTLCache(
+            max_entries=int(os.getenv('PLANNER_CACHE_MAX_ENTRIES', 1024)),
+            ttl=float(os.getenv('PLANNER_CACHE_TTL', 60 * 60)),
+        )
+
+    @staticmethod
+    def _create_program(model: None | LLM = None, attempts: int = None) -> StructuredProgram:
+        llm = model or load_llm(model=os.getenv('GPT_MODEL_LITE', 'gpt-4o'))
+        return StructuredProgram(QueryPlan, QUERY_PLANNING, llm, attempts=attempts, verbose=True)
+
+    @staticmethod
+    def _format_to_chat_buffer(messages: List[Dict]) -> str:
+        buffer = ""
+        for chat in messages:
+            role = f"{chat['role'].title() if chat['role'] != 'user' else 'Human'}: " \
+                   f"{chat['content'].split('<hr><h3>References:</h3>')[0]}"
+            buffer += "\n" + role + "\n"
+        return buffer
+
+    def _cache_key(self, messages: List[Dict]) -> str:
+        return hashlib.sha256(json.dumps(
+            [[chat['role'], chat['content'].split('<hr><h3>References:</h3>')[0].strip()] for chat in messages]
+        ).encode()).hexdigest()
+
+    def _fallback_plan(self, query: str) -> QueryPlan:
+        print(f"Failed to plan the query. Defaulting to 'Google Web Search' with search query: {repr(query)}")
+        return QueryPlan(reframed_query=query, source='Google Web Search', search_query=query)
+
+    def _log_plan(self, plan: QueryPlan):
+        print(f"Planned query {repr(plan.reframed_query)} with source: {repr(plan.source)} and search query: "
+              f"{repr(plan.search_query)}")
+
+    def plan(self, messages: List[Dict], model: None | LLM = None) -> QueryPlan:
+        """
+        Reframes the latest user query of the conversation and selects the source to answer it from.
+
+        Args:
+            messages (List[Dict]): Chat history, ending with the user query
+            model (None | LLM): Model to use for planning. If none, loads the `GPT_MODEL_LITE` model
+
+        Returns:
+            QueryPlan: The reframed query, its source and its search query.
+        """
+        query = messages[-1]['content']
+        if len(messages) == 1:
+            source, search_query = self._source_selector.select_optimal_source(query)
+            return QueryPlan(reframed_query=query, source=source, search_query=search_query)
+
+        key = self._cache_key(messages)
+        plan = self._plan_cache.get(key)
+        if plan is not None:
+            return plan
+        print(f"Planning user query {repr(query)} from chat history: {messages[:-1]}")
+        program = self._create_program(model)
+        try:
+            plan = program(chat_history=self._format_to_chat_buffer(messages[:-1]), user_query=query)
+        except Exception as exc:
+            print(f"Failed to plan the query: {exc}")
+        if plan is None or not plan.reframed_query:
+            return self._fallback_plan(query)
+        self._log_plan(plan)
+        self._plan_cache.set(key, plan)
+        return plan
+
+    async def aplan(self, messages: List[Dict], model: None | LLM = None, attempts: int = None,
+                    timeout: float = None) -> QueryPlan:
+        """
+        Async version of `plan`. Does not block the event loop while waiting on the LLM, and can be cancelled (e.g.
+        when the user stops the chat turn). Falls back to a web search for the query as it is after `attempts` failed
+        attempts or once `timeout` seconds have passed.
+
+        Args:
+            messages (List[Dict]): Chat history, ending with the user query
+            model (None | LLM): Model to use for planning. If none, loads the `GPT_MODEL_LITE` model
+            attempts (int): Number of attempts if the output fails to parse. Defaults to the
+                `STRUCTURED_OUTPUT_ATTEMPTS` env variable, or 2
+            timeout (float): Time budget in seconds for all the attempts. Defaults to the `PLANNER_TIMEOUT` env
+                variable, or 5
+
+        Returns:
+            QueryPlan: The reframed query, its source and its search query.
+        """
+        query = messages[-1]['content']
+        if len(messages) == 1:
+            source, search_query = await self._source_selector.aselect_optimal_source(query)
+            return QueryPlan(reframed_query=query, source=source, search_query=search_query)
+
+        key = self._cache_key(messages)
+        plan = self._plan_cache.get(key)
+        if plan is not None:
+            return plan
+        print(f"Planning user query {repr(query)} from chat history: {messages[:-1]}")
+        program = self._create_program(model, attempts)
+        try:
+            plan = await asyncio.wait_for(
+                program.acall(chat_history=self._format_to_chat_buffer(messages[:-1]), user_query=query),
+                timeout or float(os.getenv('PLANNER_TIMEOUT', 5))
+            )
+        except TimeoutError:
+            print("Planning the query ran out of time.")
+        except Exception as exc:
+            print(f"Failed to plan the query: {exc}")
+        if plan is None or not plan.reframed_query:
+            return self._fallback_plan(query)
+        self._log_plan(plan)
+        self._plan_cache.set(key, plan)
+        return plan
+
+
+__all__ = ['QueryPlan', 'QueryPlanner']
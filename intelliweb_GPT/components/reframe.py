@@ -1,39 +1,18 @@
-import os
 from typing import List, Dict
-from pydantic import BaseModel, Field
 
-from intelliweb_GPT.llms import load_llm
-from intelliweb_GPT.prompts import QUERY_REFRAMING
+from intelliweb_GPT.components.planner import QueryPlanner
 
 from llama_index.core.llms import LLM
-from llama_index.core.output_parsers import PydanticOutputParser
-from llama_index.core.program import LLMTextCompletionProgram
-
-
-class ReframedQuery(BaseModel):
-    """
-    This Pydantic class aids in reformulating user queries based on the context of the conversation, ensuring that
-    the reframed query can function independently.
-    """
-    reframed_query: str = Field(
-        description="A user's query that has been modified to be self-sufficient and does not rely on prior "
-                    "conversation context"
-    )
 
 
 class QueryReframer:
     """
-    A class for reframing queries.
+    A class for reframing queries. Reframes them with the `QueryPlanner`, which selects their source in the same LLM
+    call, so that planning the same turn afterwards is served from its cache.
     """
 
-    @staticmethod
-    def _format_to_chat_buffer(messages: List):
-        buffer = ""
-        for chat in messages:
-            role = f"{chat['role'].title() if chat['role'] != 'user' else 'Human'}: " \
-                   f"{chat['content'].split('<hr><h3>References:</h3>')[0]}"
-            buffer += "\n" + role + "\n"
-        return buffer
+    def __init__(self, planner: QueryPlanner = None):
+        self._planner = planner or QueryPlanner()
 
     def reframe_query(self, messages: List[Dict], model: None | LLM = None):
         """
@@ -48,30 +27,28 @@ class QueryReframer:
         """
         if len(messages) == 1:
             return messages[0]['content']
+        return self._planner.plan(messages, model=model).reframed_query
 
-        llm = model or load_llm(model=os.getenv('GPT_MODEL_LITE', 'gpt-4o'))
+    async def areframe_query(self, messages: List[Dict], model: None | LLM = None, attempts: int = None,
+                             timeout: float = None) -> str:
+        """
+        Async version of `reframe_query`. Does not block the event loop while waiting on the LLM, and can be
+        cancelled (e.g. when the user stops the chat turn). Gives up, keeping the user query as it is, after
+        `attempts` failed attempts or once `timeout` seconds have passed (see `QueryPlanner.aplan`).
 
-        user_query, chat_history = messages[-1], messages[:-1]
-        print(f"Reframing user query {repr(user_query['content'])} from chat history: {chat_history}")
-        chat_buffer = self._format_to_chat_buffer(chat_history)
+        Args:
+           messages (List[Dict]): Chat history
+           model (None | LLM): Model to use for reframing the query. If none, loads the `GPT_MODEL_LITE` model
+           attempts (int): Number of attempts
+           timeout (float): Time budget in seconds for all the attempts
 
-        program = LLMTextCompletionProgram.from_defaults(
-            output_parser=PydanticOutputParser(ReframedQuery),
-            prompt_template_str=QUERY_REFRAMING,
-            llm=llm,
-            verbose=True,
-        )
-        reframed_query = user_query['content']  # default value
-        for _ in range(4):
-            try:
-                output = program(chat_history=chat_buffer, user_query=user_query['content'])
-                reframed_query = output.reframed_query
-                break
-            except:
-                pass
-        reframed_query = reframed_query or user_query['content']
-        print(f"Reframed query from chat history: {repr(reframed_query)}")
-        return reframed_query
+        Returns:
+           str: Reframed query.
+        """
+        if len(messages) == 1:
+            return messages[0]['content']
+        plan = await self._planner.aplan(messages, model=model, attempts=attempts, timeout=timeout)
+        return plan.reframed_query
 
 
 __all__ = ['QueryReframer']
@@ -0,0 +1,94 @@
+import re
+from datetime import date
+from typing import List, NamedTuple, Sequence
+
+import numpy as np
+
+
+class RoutingDecision(NamedTuple):
+    source: str
+    search_query: str
+    confidence: float
+
+
+class RuleRouter:
+    """
+    Routes queries with keyword rules. Only the unambiguous cases are decided: conversational queries and questions
+    about the assistant go to the LLM, queries explicitly asking for recent events go to Google News Search and
+    queries explicitly asking for a web search go to Google Web Search. Anything else is left to the next tier.
+
+    A time word alone ("today", "yesterday", ...) does not make a query about news ("what is today's date"), so such
+    queries are routed to Google News Search with a confidence below the default threshold, and left to the next tier.
+    """
+
+    _CONVERSATIONAL = re.compile(
+        r"^\s*(hi|hello|hey|thanks|thank you|good (morning|afternoon|evening)|bye|goodbye|ok(ay)?|cool|great)\b[\s!.]*$"
+        r"|^\s*((who|what) are you|what can you do|what('s| is| are) your (name|capabilities))\s*\??\s*$"
+        r"|^\s*(write|compose|draft) (me )?(a|an) (poem|story|song|joke|haiku|limerick|essay)\b"
+        r"|^\s*(translate|rephrase|paraphrase|proofread)\b"
+        # Arithmetic, with at least one operator so that bare numbers and years are not taken for it
+        r"|^\s*\(*\s*\d[\d.]*\s*\)*(\s*[+\-*/^%x]\s*\(*\s*\d[\d.]*\s*\)*)+\s*(=\s*)?$",
+        re.IGNORECASE,
+    )
+    _RECENCY = re.compile(
+        # "breaking" and "headlines" alone also appear in other queries ("breaking bad plot summary")
+        r"\b(breaking news|latest news|just (announced|happened|released)|news (about|on)"
+        r"|(news|top|today'?s) headlines)\b", re.IGNORECASE
+    )
+    _TIME_WORDS = re.compile(r"\b(today|tonight|yesterday|this (morning|week|weekend)|right now)\b", re.IGNORECASE)
+    _WEB_SEARCH = re.compile(r"\b(search|google|look up) (the web|online|the internet|for)\b", re.IGNORECASE)
+
+    def route(self, query: str) -> RoutingDecision | None:
+        if self._CONVERSATIONAL.search(query):
+            return RoutingDecision('LLM', 'NA', 0.95)
+        if self._RECENCY.search(query) or re.search(rf"\b{date.today().year}\b.*\bnews\b", query, re.IGNORECASE) \
+                or (self._TIME_WORDS.search(query) and re.search(r"\bnews\b", query, re.IGNORECASE)):
+            return RoutingDecision('Google News Search', query, 0.85)
+        if self._WEB_SEARCH.search(query):
+            return RoutingDecision('Google Web Search', query, 0.9)
+        if self._TIME_WORDS.search(query):
+            return RoutingDecision('Google News Search', query, 0.6)
+        return None
+
+
+class NearestNeighbourRouter:
+    """
+    Routes queries by a vote of their nearest neighbours among past queries labeled with the source they were
+    routed to. The confidence of a decision is the similarity of the neighbours agreeing with it, so queries unlike
+    anything seen before are left to the next tier.
+    """
+
+    def __init__(self, max_examples: int = 5000, n_neighbours: int = 5, min_similarity: float = 0.85):
+        self._max_examples = max_examples
+        self._n_neighbours = n_neighbours
+        self._min_similarity = min_similarity
+        self._embeddings: np.ndarray | None = None
+        self._sources: List[str] = []
+
+    def add(self, embedding: Sequence[float], source: str):
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector = (vector / (np.linalg.norm(vector) or 1))[None, :]
+        self._embeddings = vector if self._embeddings is None else \
+            np.concatenate([self._embeddings, vector])[-self._max_examples:]
+        self._sources = (self._sources + [source])[-self._max_examples:]
+
+    def route(self, query: str, embedding: Sequence[float]) -> RoutingDecision | None:
+        if self._embeddings is None:
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        similarities = self._embeddings @ (vector / (np.linalg.norm(vector) or 1))
+        k = min(self._n_neighbours, len(similarities))
+        neighbours = np.argpartition(-similarities, k - 1)[:k]
+        neighbours = neighbours[similarities[neighbours] >= self._min_similarity]
+        if not len(neighbours):
+            return None
+
+        votes = {}
+        for i in neighbours:
+            votes[self._sources[i]] = votes.get(self._sources[i], 0.0) + float(similarities[i])
+        source, score = max(votes.items(), key=lambda vote: vote[1])
+        confidence = score / self._n_neighbours
+        return RoutingDecision(source, 'NA' if source == 'LLM' else query, confidence)
+
+
+__all__ = ['RoutingDecision', 'RuleRouter', 'NearestNeighbourRouter']
@@ -1,12 +1,17 @@
-from typing import Tuple, Literal
+import os
+import re
+import asyncio
+from time import perf_counter
+from typing import Dict, List, Tuple, Literal
 from pydantic import BaseModel, Field
 
-from intelliweb_GPT.llms import load_llm
-from intelliweb_GPT.prompts import SOURCE_SELECTION
+from intelliweb_GPT.cache import TTLCache
+from intelliweb_GPT.llms import load_llm, load_embed_model, StructuredProgram
+from intelliweb_GPT.prompts import SOURCE_SELECTION, SOURCE_SELECTION_BATCH
+from intelliweb_GPT.telemetry import set_attributes
+from intelliweb_GPT.components.routing import RoutingDecision, RuleRouter, NearestNeighbourRouter
 
 from llama_index.core.llms import LLM
-from llama_index.core.program import LLMTextCompletionProgram
-from llama_index.core.output_parsers import PydanticOutputParser
 
 
 class SearchHelper(BaseModel):
@@ -26,11 +31,107 @@ class SearchHelper(BaseModel):
     )
 
 
+class SearchHelpers(BaseModel):
+    """
+    Pydantic Class holding a `SearchHelper` for each of several user queries, in the order of the queries.
+    """
+    decisions: List[SearchHelper] = Field(
+        description="The source and search query selected for each user query, in the same order as the queries"
+    )
+
+
 class SourceSelector:
     """
     SourceSelector class to select the optimal source for answering user query.
+
+    Sources are selected by a series of tiers, cheapest first, and the LLM is only consulted when no earlier tier is
+    confident enough:
+        1. cache: decisions made for the same query before
+        2. rules: keyword rules for unambiguous queries
+        3. knn: nearest neighbours among past queries routed by the LLM. Disabled unless the `ROUTER_KNN_ENABLED` env
+           variable is true, as it needs a query embedding (best paired with a local embedding backend)
+        4. llm: a structured LLM call
     """
 
+    def __init__(self, decision_cache: TTLCache = None, confidence_threshold: float = None):
+        self._decision_cache = decision_cache or TTLCache(
+            max_entries=int(os.getenv('ROUTER_CACHE_MAX_ENTRIES', 4096)),
+            ttl=float(os.getenv('ROUTER_CACHE_TTL', 60 * 60)),
+        )
+        self._confidence_threshold = confidence_threshold or float(os.getenv('ROUTER_CONFIDENCE_THRESHOLD', 0.8))
+        self._rule_router = RuleRouter()
+        self._knn_router = NearestNeighbourRouter() \
+            if os.getenv('ROUTER_KNN_ENABLED', 'false').lower() == 'true' else None
+        self._tier_stats = {tier: {'calls': 0, 'hits': 0, 'seconds': 0.0} for tier in ('cache', 'rules', 'knn', 'llm')}
+
+    @staticmethod
+    def _create_program(model: None | LLM = None) -> StructuredProgram:
+        llm = model or load_llm(model='gpt-4o')
+        return StructuredProgram(SearchHelper, SOURCE_SELECTION, llm, verbose=True)
+
+    @staticmethod
+    def _create_batch_program(model: None | LLM = None) -> StructuredProgram:
+        llm = model or load_llm(model='gpt-4o')
+        return StructuredProgram(SearchHelpers, SOURCE_SELECTION_BATCH, llm, verbose=True)
+
+    @staticmethod
+    def _cache_key(query: str) -> str:
+        return re.sub(r'\s+', ' ', query).strip().lower()
+
+    @staticmethod
+    def _log_selection(source: str, search_query: str, tier: str):
+        print(f"Using source: {repr(source)} with search query: {repr(search_query)} (decided by {tier})")
+        set_attributes(tier=tier)
+
+    @staticmethod
+    def _log_fallback(query: str):
+        print("Failed to pick any source for answering. Defaulting to 'Google Web Search' with "
+              f"search query: {repr(query)}")
+        set_attributes(tier='fallback')
+
+    def _record(self, tier: str, start_time: float, hit: bool, seconds: float = None):
+        stats = self._tier_stats[tier]
+        stats['calls'] += 1
+        stats['hits'] += hit
+        stats['seconds'] += perf_counter() - start_time if seconds is None else seconds
+
+    def _route_locally(self, query: str) -> RoutingDecision | None:
+        """
+        Runs the cache and rules tiers.
+        """
+        start_time = perf_counter()
+        decision = self._decision_cache.get(self._cache_key(query))
+        self._record('cache', start_time, decision is not None)
+        if decision is not None:
+            self._log_selection(decision.source, decision.search_query, 'cache')
+            return decision
+
+        start_time = perf_counter()
+        decision = self._rule_router.route(query)
+        confident = decision is not None and decision.confidence >= self._confidence_threshold
+        self._record('rules', start_time, confident)
+        if confident:
+            self._log_selection(decision.source, decision.search_query, 'rules')
+            self._decision_cache.set(self._cache_key(query), decision)
+            return decision
+        return None
+
+    def _route_with_knn(self, query: str, embedding: List[float], start_time: float) -> RoutingDecision | None:
+        decision = self._knn_router.route(query, embedding)
+        confident = decision is not None and decision.confidence >= self._confidence_threshold
+        self._record('knn', start_time, confident)
+        if confident:
+            self._log_selection(decision.source, decision.search_query, 'knn')
+            self._decision_cache.set(self._cache_key(query), decision)
+            return decision
+        return None
+
+    def _learn(self, query: str, output: SearchHelper, embedding: List[float] | None):
+        decision = RoutingDecision(output.source, output.search_query, 1.0)
+        self._decision_cache.set(self._cache_key(query), decision)
+        if self._knn_router is not None and embedding is not None:
+            self._knn_router.add(embedding, output.source)
+
     def select_optimal_source(self, query: str, model: None | LLM = None) -> Tuple[str, str]:
         """
         Select the optimal source to answer the user query.
@@ -42,23 +143,147 @@ class SourceSelector:
         Returns:
             Tuple[str, str]: The selected source and the optimal search query.
         """
-        llm = model or load_llm(model='gpt-4o')
+        decision = self._route_locally(query)
+        if decision is not None:
+            return decision.source, decision.search_query
 
-        program = LLMTextCompletionProgram.from_defaults(
-            output_parser=PydanticOutputParser(SearchHelper),
-            prompt_template_str=SOURCE_SELECTION,
-            llm=llm,
-            verbose=True,
-        )
+        embedding = None
+        if self._knn_router is not None:
+            start_time = perf_counter()
+            embedding = load_embed_model().get_query_embedding(query)
+            decision = self._route_with_knn(query, embedding, start_time)
+            if decision is not None:
+                return decision.source, decision.search_query
+
+        start_time = perf_counter()
+        program = self._create_program(model)
         try:
             output = program(query=query)
-            print(
-                f"Using source: {repr(output.source)} with search query: {repr(output.search_query)}")
+            self._record('llm', start_time, True)
+            self._log_selection(output.source, output.search_query, 'llm')
+            self._learn(query, output, embedding)
+            return output.source, output.search_query
+        except Exception as exc:
+            print(f"Failed to select a source with the LLM: {exc}")
+            self._record('llm', start_time, False)
+            self._log_fallback(query)
+        return "Google Web Search", query
+
+    async def aselect_optimal_source(self, query: str, model: None | LLM = None) -> Tuple[str, str]:
+        """
+        Async version of `select_optimal_source`. Does not block the event loop while waiting on the LLM.
+
+        Args:
+            query (str): The user query.
+            model (None | LLM): Model to use for selecting the source. If none, loads a gpt-4 model
+
+        Returns:
+            Tuple[str, str]: The selected source and the optimal search query.
+        """
+        decision = self._route_locally(query)
+        if decision is not None:
+            return decision.source, decision.search_query
+        return await self._aselect_with_models(query, model)
+
+    async def _aselect_with_models(self, query: str, model: None | LLM = None) -> Tuple[str, str]:
+        """
+        Runs the knn and LLM tiers, for a query the cache and rules tiers could not decide.
+        """
+        embedding = None
+        if self._knn_router is not None:
+            start_time = perf_counter()
+            embedding = await load_embed_model().aget_query_embedding(query)
+            decision = self._route_with_knn(query, embedding, start_time)
+            if decision is not None:
+                return decision.source, decision.search_query
+
+        start_time = perf_counter()
+        program = self._create_program(model)
+        try:
+            output = await program.acall(query=query)
+            self._record('llm', start_time, True)
+            self._log_selection(output.source, output.search_query, 'llm')
+            self._learn(query, output, embedding)
             return output.source, output.search_query
-        except:
-            print("Failed to pick any source for answering. Defaulting to 'Google Web Search' with "
-                  f"search query: {repr(query)}")
+        except Exception as exc:
+            print(f"Failed to select a source with the LLM: {exc}")
+            self._record('llm', start_time, False)
+            self._log_fallback(query)
         return "Google Web Search", query
 
+    async def _aselect_batch_with_llm(self, queries: List[str], model: None | LLM = None) -> List[Tuple[str, str]]:
+        start_time = perf_counter()
+        try:
+            output = await self._create_batch_program(model).acall(
+                queries="\n".join(f"{i + 1}. {query}" for i, query in enumerate(queries))
+            )
+            if len(output.decisions) != len(queries):
+                raise Exception(f"Expected {len(queries)} decisions, got {len(output.decisions)}")
+        except Exception as exc:
+            print(f"Failed to route {len(queries)} queries in one call, routing them one by one: {exc}")
+            # The cache and rules tiers have already been tried (and counted) for these queries, and the failed call
+            # decided none of them, so only the calls that do decide them are counted
+            return list(await asyncio.gather(*(self._aselect_with_models(query, model) for query in queries)))
+
+        # The call is shared by the queries of the batch, and so is its latency
+        decisions, seconds_per_query = [], (perf_counter() - start_time) / len(queries)
+        for query, output in zip(queries, output.decisions):
+            self._record('llm', start_time, True, seconds=seconds_per_query)
+            self._log_selection(output.source, output.search_query, 'llm')
+            self._learn(query, output, None)
+            decisions.append((output.source, output.search_query))
+        return decisions
+
+    async def aselect_optimal_sources(self, queries: List[str], model: None | LLM = None,
+                                      batch_size: int = None) -> List[Tuple[str, str]]:
+        """
+        Selects the optimal sources for many queries at once. The queries that the cache and rules tiers cannot
+        decide are routed by the LLM in a single structured call per `batch_size` queries, rather than one call each
+        (the knn tier is skipped). Repeated queries are only routed once.
+
+        Args:
+            queries (List[str]): The user queries.
+            model (None | LLM): Model to use for selecting the sources. If none, loads a gpt-4 model
+            batch_size (int): Largest number of queries routed in one LLM call. Defaults to the `ROUTER_BATCH_SIZE`
+                env variable, or 20
+
+        Returns:
+            List[Tuple[str, str]]: The selected source and the optimal search query for each query, in order.
+        """
+        batch_size = batch_size or int(os.getenv('ROUTER_BATCH_SIZE', 20))
+        decisions, pending = {}, {}
+        for query in queries:
+            key = self._cache_key(query)
+            if key in decisions or key in pending:
+                continue
+            decision = self._route_locally(query)
+            if decision is not None:
+                decisions[key] = (decision.source, decision.search_query)
+            else:
+                pending[key] = query
+
+        pending = list(pending.values())
+        batches = [pending[i:i + batch_size] for i in range(0, len(pending), batch_size)]
+        for batch, batch_decisions in zip(batches, await asyncio.gather(*(
+                self._aselect_batch_with_llm(batch, model) for batch in batches
+        ))):
+            for query, decision in zip(batch, batch_decisions):
+                decisions[self._cache_key(query)] = decision
+        return [decisions[self._cache_key(query)] for query in queries]
+
+    def stats(self) -> Dict:
+        """
+        Returns, for each routing tier, how many queries it saw, the share of them it decided and its mean latency.
+        """
+        return {
+            tier: {
+                'calls': stats['calls'],
+                'hits': stats['hits'],
+                'hit_rate': stats['hits'] / stats['calls'] if stats['calls'] else 0.0,
+                'mean_latency_ms': stats['seconds'] / stats['calls'] * 1000 if stats['calls'] else 0.0,
+            }
+            for tier, stats in self._tier_stats.items()
+        }
+
 
 __all__ = ['SourceSelector']
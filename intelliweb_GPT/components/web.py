@@ -1,14 +1,35 @@
 import os
+import re
 import json
+import asyncio
 import requests
-from GoogleNews import GoogleNews
-from googlesearch import search
+from typing import Dict, List, Tuple
+
+from intelliweb_GPT.http_client import get_async_client
+from intelliweb_GPT.cache import TTLCache, SingleFlight
+from intelliweb_GPT.telemetry import span
 
 
 class WebRetriever:
-    def __init__(self):
+    """
+    Retrieves the URLs relevant to a query from Google Web Search or Google News Search.
+
+    Attributes:
+        _serper_api_url: Base URL of the Serper API. Can be pointed to a compatible stand-in with the
+            `SERPER_API_URL` env variable
+        _search_cache: Cache of the URLs found for previous searches. News searches expire faster than web searches
+        _single_flight: Coalesces concurrent identical searches into a single upstream call
+    """
+
+    def __init__(self, search_cache: TTLCache = None):
         self._headers = self.generate_headers()
-        self._googlenews = GoogleNews()
+        self._serper_api_url = os.getenv('SERPER_API_URL', 'https://google.serper.dev').rstrip('/')
+        self._search_cache = search_cache or TTLCache(max_entries=int(os.getenv('SEARCH_CACHE_MAX_ENTRIES', 1024)))
+        self._search_cache_ttls = {
+            'news': float(os.getenv('SEARCH_CACHE_TTL_NEWS', 10 * 60)),
+            'search': float(os.getenv('SEARCH_CACHE_TTL_SEARCH', 6 * 60 * 60)),
+        }
+        self._single_flight = SingleFlight()
 
     @staticmethod
     def generate_headers():
@@ -17,14 +38,8 @@ class WebRetriever:
             'Content-Type': 'application/json'
         }
 
-    def _retrieve_from_serper_api(self, query: str, source: str):
-        url = f"https://google.serper.dev/{source}"
-
-        payload = json.dumps({
-            "q": query
-        })
-
-        response = requests.request("POST", url, headers=self._headers, data=payload).json()
+    @staticmethod
+    def _parse_serper_response(response: Dict, source: str) -> List[str]:
         if source == "news":
             urls = [r['link'] for r in response['news'][:7]]
         else:
@@ -37,11 +52,34 @@ class WebRetriever:
         print(f"Relevant urls fetched: {urls}")
         return urls
 
-    def _retrieve_from_scraping(self, query: str, source: str):
+    def _retrieve_from_serper_api(self, query: str, source: str):
+        url = f"{self._serper_api_url}/{source}"
+
+        payload = json.dumps({
+            "q": query
+        })
+
+        response = requests.request("POST", url, headers=self._headers, data=payload).json()
+        return self._parse_serper_response(response, source)
+
+    async def _aretrieve_from_serper_api(self, query: str, source: str):
+        url = f"{self._serper_api_url}/{source}"
+
+        response = await get_async_client('search').post(url, headers=self._headers, json={"q": query})
+        return self._parse_serper_response(response.json(), source)
+
+    @staticmethod
+    def _retrieve_from_scraping(query: str, source: str):
+        # Only imported when scraping is used instead of the Serper API
+        from GoogleNews import GoogleNews
+        from googlesearch import search
+
         if source == "news":
-            self._googlenews.search(query)
-            urls = [data['link'] for data in self._googlenews.results(sort=True)[:7]]
-            self._googlenews.clear()
+            # A fresh client per search, as GoogleNews keeps the results of a search on the instance
+            googlenews = GoogleNews()
+            googlenews.search(query)
+            urls = [data['link'] for data in googlenews.results(sort=True)[:7]]
+            googlenews.clear()
         else:
             res = search(query, num_results=7)
             urls = [r for r in res]
@@ -49,8 +87,61 @@ class WebRetriever:
         print(f"Relevant urls fetched: {urls}")
         return urls
 
+    @staticmethod
+    def _search_key(query: str, source: str, use_serper_api: bool) -> Tuple[str, str, str]:
+        return re.sub(r'\s+', ' ', query).strip().lower(), source, 'serper' if use_serper_api else 'scraping'
+
+    def _cache_urls(self, key: Tuple[str, str, str], urls: List[str]):
+        # Empty results are most likely a failed or blocked search, and are retried the next time instead
+        if urls:
+            ttl = self._search_cache_ttls.get(key[1], self._search_cache_ttls['search'])
+            self._search_cache.set(key, urls, ttl=ttl)
+
     def retrieve_relevant_urls(self, query: str, source: str, use_serper_api: bool):
+        key = self._search_key(query, source, use_serper_api)
+        urls = self._search_cache.get(key)
+        if urls is not None:
+            print(f"Relevant urls found in cache: {urls}")
+            return list(urls)
+
         if use_serper_api:
-            return self._retrieve_from_serper_api(query, source)
+            urls = self._retrieve_from_serper_api(query, source)
         else:
-            return self._retrieve_from_scraping(query, source)
+            urls = self._retrieve_from_scraping(query, source)
+        self._cache_urls(key, urls)
+        return urls
+
+    async def aretrieve_relevant_urls(self, query: str, source: str, use_serper_api: bool):
+        key = self._search_key(query, source, use_serper_api)
+
+        async def _search():
+            if use_serper_api:
+                search_urls = await self._aretrieve_from_serper_api(query, source)
+            else:
+                # GoogleNews and googlesearch only offer blocking APIs
+                search_urls = await asyncio.to_thread(self._retrieve_from_scraping, query, source)
+            self._cache_urls(key, search_urls)
+            return search_urls
+
+        with span('search', source=source, backend=key[2]) as search_span:
+            urls = self._search_cache.get(key)
+            if urls is not None:
+                search_span.set_attribute('cache', 'hit')
+                print(f"Relevant urls found in cache: {urls}")
+                return list(urls)
+
+            search_span.set_attribute('cache', 'miss')
+            urls = list(await self._single_flight.do(key, _search))
+            search_span.set_attribute('urls', len(urls))
+            return urls
+
+    def stats(self) -> Dict:
+        """
+        Returns the hit rate of the search cache and the number of upstream searches saved by coalescing.
+        """
+        return {
+            'cache_hits': self._search_cache.hits,
+            'cache_misses': self._search_cache.misses,
+            'cache_hit_rate': self._search_cache.hit_rate,
+            'coalesced_searches': self._single_flight.coalesced,
+        }
@@ -0,0 +1,61 @@
+import os
+import asyncio
+import weakref
+from typing import Dict
+
+import httpx
+
+_DEFAULT_HEADERS = {
+    'User-Agent': 'Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/124.0 Safari/537.36',
+    'Accept-Language': 'en-US,en;q=0.9',
+}
+
+# One set of clients per event loop: an httpx.AsyncClient's connection pool is bound to the loop that created it.
+_async_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]' = \
+    weakref.WeakKeyDictionary()
+
+
+def _client_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv('HTTP_MAX_CONNECTIONS', 100)),
+        max_keepalive_connections=int(os.getenv('HTTP_MAX_KEEPALIVE_CONNECTIONS', 20)),
+        keepalive_expiry=float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30)),
+    )
+
+
+def get_async_client(name: str = 'default', limits: httpx.Limits = None) -> httpx.AsyncClient:
+    """
+    Returns a pooled keep-alive async HTTP client shared by every caller on the running event loop.
+
+    Args:
+        name (str): Name of the pool. Callers with different needs (e.g. a search API vs. scraping arbitrary
+            websites) can use separate pools so that one cannot starve the other.
+        limits (httpx.Limits): Connection limits of the pool, if it has to be created. Set by the `HTTP_*` env
+            variables by default
+
+    Returns:
+        httpx.AsyncClient: The shared client for `name`.
+    """
+    loop = asyncio.get_running_loop()
+    clients = _async_clients.setdefault(loop, {})
+    client = clients.get(name)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            headers=_DEFAULT_HEADERS,
+            limits=limits or _client_limits(),
+            timeout=httpx.Timeout(float(os.getenv('HTTP_TIMEOUT', 10)), connect=5.0),
+            follow_redirects=True,
+        )
+        clients[name] = client
+    return client
+
+
+async def aclose_clients():
+    """
+    Closes all the pooled clients created on the running event loop.
+    """
+    clients = _async_clients.pop(asyncio.get_running_loop(), {})
+    await asyncio.gather(*(client.aclose() for client in clients.values()))
+
+
+__all__ = ['get_async_client', 'aclose_clients']
@@ -1,3 +1,7 @@
-from intelliweb_GPT.llms.loaders import load_llm
+from intelliweb_GPT.llms.loaders import load_llm, register_llm, awarm_up_llms, get_token_limits
+from intelliweb_GPT.llms.embeddings import LocalEmbedding, load_embed_model
+from intelliweb_GPT.llms.utils import get_model_tokenizer
+from intelliweb_GPT.llms.structured import StructuredProgram, structured_output_mode
 
-__all__ = ['load_llm']
+__all__ = ['load_llm', 'register_llm', 'awarm_up_llms', 'get_token_limits', 'get_model_tokenizer', 'load_embed_model',
+           'LocalEmbedding', 'StructuredProgram', 'structured_output_mode']
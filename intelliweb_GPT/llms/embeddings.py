@@ -0,0 +1,165 @@
+import os
+import asyncio
+import weakref
+import threading
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+from llama_index.core import Settings
+from llama_index.core.bridge.pydantic import Field, PrivateAttr
+from llama_index.core.base.embeddings.base import BaseEmbedding, Embedding
+
+# Loaded models stay resident for the lifetime of the process, and are shared by all the embedding instances using them
+_sentence_transformers: Dict[Tuple[str, str | None], Any] = {}
+_sentence_transformers_lock = threading.Lock()
+
+
+def _get_sentence_transformer(model_name: str, device: str | None):
+    key = (model_name, device)
+    with _sentence_transformers_lock:
+        if key not in _sentence_transformers:
+            from sentence_transformers import SentenceTransformer
+
+            _sentence_transformers[key] = SentenceTransformer(model_name, device=device)
+            print(f"Loaded local embedding model: {model_name}")
+        return _sentence_transformers[key]
+
+
+class _MicroBatcher:
+    """
+    Coalesces the texts submitted by concurrent callers within a short window into a single call of `encode`.
+    """
+
+    def __init__(self, encode: Callable[[List[str]], np.ndarray], window: float, max_batch_size: int):
+        self._encode = encode
+        self._window = window
+        self._max_batch_size = max_batch_size
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._pending_texts = 0
+        self._flush_handle: asyncio.TimerHandle | None = None
+
+    async def submit(self, texts: List[str]) -> np.ndarray:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((texts, future))
+        self._pending_texts += len(texts)
+        if self._pending_texts >= self._max_batch_size:
+            self._flush()
+        elif self._flush_handle is None:
+            self._flush_handle = loop.call_later(self._window, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        batch, self._pending, self._pending_texts = self._pending, [], 0
+        if batch:
+            asyncio.ensure_future(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        try:
+            vectors = await asyncio.to_thread(self._encode, [text for texts, _ in batch for text in texts])
+        except Exception as exc:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(exc)
+            return
+        offset = 0
+        for texts, future in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(texts)])
+            offset += len(texts)
+
+
+class LocalEmbedding(BaseEmbedding):
+    """
+    Embeds texts in process with a sentence-transformers model, so that no network round trip is needed. All the texts
+    of a call are embedded in one forward pass and, if `micro_batch_window` is set, texts from concurrent async calls
+    are coalesced into a single forward pass too. The model is loaded on first use.
+    """
+    device: str | None = Field(default=None, description="Device to run the model on. Picked automatically if None.")
+    query_instruction: str | None = Field(default=None, description="Instruction to prepend to queries.")
+    text_instruction: str | None = Field(default=None, description="Instruction to prepend to texts.")
+    micro_batch_window: float = Field(
+        default=0.0, description="Seconds to wait for texts from concurrent calls to batch them together. Disabled "
+                                 "if 0."
+    )
+
+    _encode_lock: threading.Lock = PrivateAttr()
+    _batchers: weakref.WeakKeyDictionary = PrivateAttr()
+
+    def __init__(self, model_name: str = 'BAAI/bge-small-en-v1.5', embed_batch_size: int = 256, **kwargs: Any):
+        super().__init__(model_name=model_name, embed_batch_size=embed_batch_size, **kwargs)
+        self._encode_lock = threading.Lock()
+        self._batchers = weakref.WeakKeyDictionary()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "LocalEmbedding"
+
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        model = _get_sentence_transformer(self.model_name, self.device)
+        # One forward pass at a time: concurrent passes only compete for the same cores
+        with self._encode_lock:
+            return model.encode(texts, batch_size=max(len(texts), 1), normalize_embeddings=True,
+                                convert_to_numpy=True, show_progress_bar=False)
+
+    def _get_batcher(self) -> _MicroBatcher:
+        loop = asyncio.get_running_loop()
+        if loop not in self._batchers:
+            self._batchers[loop] = _MicroBatcher(self._encode, self.micro_batch_window, self.embed_batch_size)
+        return self._batchers[loop]
+
+    async def _aencode(self, texts: List[str]) -> np.ndarray:
+        if self.micro_batch_window > 0:
+            return await self._get_batcher().submit(texts)
+        return await asyncio.to_thread(self._encode, texts)
+
+    def _with_instruction(self, texts: List[str], instruction: str | None) -> List[str]:
+        return [f"{instruction} {text}" for text in texts] if instruction else texts
+
+    def _get_query_embedding(self, query: str) -> Embedding:
+        return self._encode(self._with_instruction([query], self.query_instruction))[0].tolist()
+
+    async def _aget_query_embedding(self, query: str) -> Embedding:
+        return (await self._aencode(self._with_instruction([query], self.query_instruction)))[0].tolist()
+
+    def _get_text_embedding(self, text: str) -> Embedding:
+        return self._get_text_embeddings([text])[0]
+
+    async def _aget_text_embedding(self, text: str) -> Embedding:
+        return (await self._aget_text_embeddings([text]))[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return self._encode(self._with_instruction(texts, self.text_instruction)).tolist()
+
+    async def _aget_text_embeddings(self, texts: List[str]) -> List[Embedding]:
+        return (await self._aencode(self._with_instruction(texts, self.text_instruction))).tolist()
+
+
+_local_embed_model: LocalEmbedding | None = None
+
+
+def load_embed_model() -> BaseEmbedding:
+    """
+    Loads the embedding model configured by the `EMBED_BACKEND` env variable: 'local' for an in-process
+    sentence-transformers model (`EMBED_MODEL`, `EMBED_DEVICE`, `EMBED_MICRO_BATCH_MS`), otherwise llama_index's
+    default embedding model. The local model is created once and reused.
+    """
+    global _local_embed_model
+    if os.getenv('EMBED_BACKEND', 'default').lower() != 'local':
+        return Settings.embed_model
+
+    if _local_embed_model is None:
+        _local_embed_model = LocalEmbedding(
+            model_name=os.getenv('EMBED_MODEL', 'BAAI/bge-small-en-v1.5'),
+            device=os.getenv('EMBED_DEVICE'),
+            query_instruction=os.getenv('EMBED_QUERY_INSTRUCTION'),
+            micro_batch_window=float(os.getenv('EMBED_MICRO_BATCH_MS', 0)) / 1000,
+        )
+    return _local_embed_model
+
+
+__all__ = ['LocalEmbedding', 'load_embed_model']
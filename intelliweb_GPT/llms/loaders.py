@@ -1,10 +1,13 @@
 import os
 import re
+import asyncio
+import weakref
+import threading
+from typing import Dict, List, Tuple
+
+import httpx
 
 from llama_index.core.llms import LLM
-from llama_index.llms.openai import OpenAI
-from llama_index.llms.ollama import Ollama
-from llama_index.llms.anthropic import Anthropic
 
 ollama_api_url = os.getenv("OLLAMA_API_URL")
 
@@ -20,35 +23,167 @@ _llm_token_limits = {
     'mixtral-8x7b': 4096 - 512,
 }
 
+_llm_context_windows = {
+    'gpt-4o': 128000,
+    'gpt-4-turbo': 128000,
+    'gpt-4': 8192,
+    'gpt-3.5-turbo': 16385,
+    'claude-3-opus-20240229': 200000,
+    'claude-3-sonnet-20240229': 200000,
+    'claude-3-haiku-20240307': 200000,
+    'zephyr-7b': 8192,
+    'mixtral-8x7b': 32768,
+}
+
+# LLM instances are shared per event loop, as async connection pools are bound to the loop they are first used on.
+# Instances loaded outside any event loop are shared by all sync callers.
+_llm_registry: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[Tuple, LLM]]' = weakref.WeakKeyDictionary()
+_sync_llm_registry: Dict[Tuple, LLM] = {}
+_llm_registry_lock = threading.Lock()
 
-def load_llm(model: str = 'gpt-4o', temperature: float = 0.4, **kwargs) -> LLM:
+# Connection pools shared by all the OpenAI instances
+_openai_http_client: httpx.Client | None = None
+_openai_async_http_clients: 'weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]' = \
+    weakref.WeakKeyDictionary()
+
+
+def _connection_limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=int(os.getenv('LLM_MAX_CONNECTIONS', 50)),
+        max_keepalive_connections=int(os.getenv('LLM_MAX_KEEPALIVE_CONNECTIONS', 20)),
+        keepalive_expiry=float(os.getenv('LLM_KEEPALIVE_EXPIRY', 60)),
+    )
+
+
+def _get_openai_http_clients() -> (httpx.Client, httpx.AsyncClient | None):
+    global _openai_http_client
+    if _openai_http_client is None:
+        _openai_http_client = httpx.Client(limits=_connection_limits(), timeout=120)
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return _openai_http_client, None
+    if loop not in _openai_async_http_clients:
+        _openai_async_http_clients[loop] = httpx.AsyncClient(limits=_connection_limits(), timeout=120)
+    return _openai_http_client, _openai_async_http_clients[loop]
+
+
+def _create_llm(model: str = 'gpt-4o', temperature: float = 0.4, **kwargs) -> LLM:
+    # Provider integrations are imported on first use, as each of them pulls in its own SDK. `kwargs` override the
+    # default params of the integration
     if bool(re.match(r'^gpt', model)):
-        llm = OpenAI(
-            model=model,
-            temperature=temperature,
-            max_tokens=_llm_token_limits[model],
-            request_timeout=120,
-            seed=42
-        )
+        from llama_index.llms.openai import OpenAI
+
+        http_client, async_http_client = _get_openai_http_clients()
+        llm = OpenAI(**{
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': _llm_token_limits[model],
+            'request_timeout': 120,
+            'seed': 42,
+            'http_client': http_client,
+            'async_http_client': async_http_client,
+            **kwargs,
+        })
     elif bool(re.match(r'^claude', model)):
-        llm = Anthropic(
-            model=model,
-            temperature=temperature,
-            max_tokens=_llm_token_limits[model],
-        )
+        from llama_index.llms.anthropic import Anthropic
+
+        llm = Anthropic(**{
+            'model': model,
+            'temperature': temperature,
+            'max_tokens': _llm_token_limits[model],
+            **kwargs,
+        })
     elif ollama_api_url:
-        llm = Ollama(
-            model=model,
-            base_url=ollama_api_url,
-            temperature=temperature,
-            additional_kwargs={
+        from llama_index.llms.ollama import Ollama
+
+        llm = Ollama(**{
+            'model': model,
+            'base_url': ollama_api_url,
+            'temperature': temperature,
+            'context_window': _llm_context_windows[model],
+            'additional_kwargs': {
                 'num_predict': _llm_token_limits[model]
                 # 'template': "{{ .Prompt }}",  # Not sure if this is necessary or not
             },
-        )
+            **kwargs,
+        })
     else:
         raise Exception(f"Configuration for {model} model not found. Please re-verify your model name."
                         f"Valid model names are: {', '.join([f'{repr(m)}' for m in _llm_token_limits.keys()])}.")
 
     print(f"Loaded LLM: {model}")
     return llm
+
+
+def get_token_limits(model: str) -> (int, int):
+    """
+    Returns the context window of the model and the number of tokens reserved for its output, both in tokens.
+    """
+    return _llm_context_windows[model], _llm_token_limits[model]
+
+
+def _get_registry() -> Dict[Tuple, LLM]:
+    try:
+        return _llm_registry.setdefault(asyncio.get_running_loop(), {})
+    except RuntimeError:
+        return _sync_llm_registry
+
+
+def _registry_key(model: str, temperature: float, kwargs: Dict) -> Tuple:
+    # Params are compared by their repr, as some of them (e.g. `additional_kwargs`) are not hashable
+    return model, temperature, tuple(sorted((name, repr(value)) for name, value in kwargs.items()))
+
+
+def load_llm(model: str = 'gpt-4o', temperature: float = 0.4, **kwargs) -> LLM:
+    """
+    Returns a shared LLM instance for the model and params (`kwargs` being passed on to the LLM integration, e.g.
+    `max_tokens`). Instances are created on first use and then reused, so that their keep-alive connections are reused
+    across all the LLM calls of a chat turn and across turns.
+    """
+    key = _registry_key(model, temperature, kwargs)
+    registry = _get_registry()
+    with _llm_registry_lock:
+        if key not in registry:
+            registry[key] = _create_llm(model=model, temperature=temperature, **kwargs)
+        return registry[key]
+
+
+def register_llm(llm: LLM, model: str = 'gpt-4o', temperature: float = 0.4, **kwargs):
+    """
+    Makes `load_llm` return the given instance for the model and params, e.g. to plug in a custom or local LLM.
+    """
+    with _llm_registry_lock:
+        _get_registry()[_registry_key(model, temperature, kwargs)] = llm
+
+
+async def awarm_up_llms(models: List[str] = None, temperatures: List[float] = (0.4, 0.8), connections: int = None):
+    """
+    Loads the LLMs for the running event loop ahead of the first query, and opens connections to the OpenAI API so
+    that the TCP/TLS handshakes are out of the way.
+
+    Args:
+        models (List[str]): Models to warm up. Defaults to the comma-separated `LLM_WARM_UP_MODELS` env variable,
+            or 'gpt-4o'
+        temperatures (List[float]): Temperatures to load each model with
+        connections (int): Number of connections to open. Defaults to the `LLM_WARM_UP_CONNECTIONS` env variable,
+            or 4
+    """
+    models = models or os.getenv('LLM_WARM_UP_MODELS', 'gpt-4o').split(',')
+    connections = connections or int(os.getenv('LLM_WARM_UP_CONNECTIONS', 4))
+    openai_llm = None
+    for model in models:
+        for temperature in temperatures:
+            llm = load_llm(model=model.strip(), temperature=temperature)
+            if llm.class_name() == 'openai_llm':
+                openai_llm = llm
+    if openai_llm is not None:
+        # Any response will do, the point is to leave established connections in the shared pool
+        _, async_http_client = _get_openai_http_clients()
+        url, headers = f"{openai_llm.api_base.rstrip('/')}/models", {'Authorization': f"Bearer {openai_llm.api_key}"}
+        await asyncio.gather(*(async_http_client.get(url, headers=headers) for _ in range(connections)),
+                             return_exceptions=True)
+    print(f"Warmed up LLMs: {models}")
+
+
+__all__ = ['load_llm', 'register_llm', 'awarm_up_llms', 'get_token_limits']
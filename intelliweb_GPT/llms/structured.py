@@ -0,0 +1,144 @@
+import os
+from typing import Any, Dict, Type
+from pydantic import BaseModel
+
+from intelliweb_GPT.telemetry import increment
+
+from llama_index.core.llms import LLM, ChatMessage, MessageRole
+from llama_index.core.output_parsers import PydanticOutputParser
+from llama_index.core.program import LLMTextCompletionProgram
+from llama_index.core.prompts import PromptTemplate
+
+
+def _json_schema(output_cls: Type[BaseModel]) -> Dict:
+    # Pydantic v2 renamed `schema` and `parse_raw`, and the output classes may be of either version
+    if hasattr(output_cls, 'model_json_schema'):
+        return output_cls.model_json_schema()
+    return output_cls.schema()
+
+
+def _validate_json(output_cls: Type[BaseModel], data: str) -> BaseModel:
+    if hasattr(output_cls, 'model_validate_json'):
+        return output_cls.model_validate_json(data)
+    return output_cls.parse_raw(data)
+
+
+def structured_output_mode(llm: LLM) -> str:
+    """
+    Returns the most reliable way to get structured output from the LLM, unless set by the `STRUCTURED_OUTPUT_MODE`
+    env variable:
+        - 'tools': a function call forced to the output class, for LLMs with native function calling (OpenAI)
+        - 'prefill': the reply prefilled with '{' so that it can only be JSON, for Anthropic models
+        - 'text': format instructions in the prompt and the JSON parsed out of the completion, for any LLM
+    """
+    mode = os.getenv('STRUCTURED_OUTPUT_MODE', 'auto').lower()
+    if mode != 'auto':
+        return mode
+    if hasattr(llm, 'achat_with_tools') and llm.metadata.is_function_calling_model:
+        return 'tools'
+    if llm.class_name() == 'Anthropic_LLM':
+        return 'prefill'
+    return 'text'
+
+
+class StructuredProgram:
+    """
+    Fills a pydantic output class from an LLM call on a prompt template, with the native structured output of the LLM
+    where it has one (see `structured_output_mode`), so that the output almost never fails to parse. Outputs that
+    still fail to parse are retried, up to `attempts` calls in all. Calls, by outcome, and retries are counted in
+    the `structured_output_calls` and `structured_output_retries` metrics.
+
+    A drop-in replacement for `LLMTextCompletionProgram`: called with the variables of the prompt template, sync or
+    async, it returns an instance of the output class.
+    """
+
+    def __init__(self, output_cls: Type[BaseModel], prompt_template_str: str, llm: LLM, attempts: int = None,
+                 verbose: bool = False):
+        self._output_cls = output_cls
+        self._llm = llm
+        self._attempts = attempts or int(os.getenv('STRUCTURED_OUTPUT_ATTEMPTS', 2))
+        self._mode = structured_output_mode(llm)
+        self._output_parser = PydanticOutputParser(output_cls)
+        if self._mode == 'text':
+            self._program = LLMTextCompletionProgram.from_defaults(
+                output_parser=self._output_parser, prompt_template_str=prompt_template_str, llm=llm, verbose=verbose
+            )
+        elif self._mode == 'tools':
+            self._prompt = PromptTemplate(prompt_template_str)
+        else:
+            self._prompt = PromptTemplate(self._output_parser.format(prompt_template_str))
+
+    @property
+    def mode(self) -> str:
+        return self._mode
+
+    def _tool(self) -> Dict:
+        return {'type': 'function', 'function': {
+            'name': self._output_cls.__name__,
+            'description': (self._output_cls.__doc__ or '').strip(),
+            'parameters': _json_schema(self._output_cls),
+        }}
+
+    def _messages(self, **kwargs: Any) -> list:
+        messages = [ChatMessage(role=MessageRole.USER, content=self._prompt.format(**kwargs))]
+        if self._mode == 'prefill':
+            messages.append(ChatMessage(role=MessageRole.ASSISTANT, content='{'))
+        return messages
+
+    def _llm_kwargs(self) -> Dict:
+        if self._mode != 'tools':
+            return {}
+        return {'tools': [self._tool()],
+                'tool_choice': {'type': 'function', 'function': {'name': self._output_cls.__name__}}}
+
+    def _parse(self, response) -> BaseModel:
+        if self._mode == 'tools':
+            tool_calls = response.message.additional_kwargs.get('tool_calls') or []
+            if not tool_calls:
+                raise ValueError(f"Expected a call to {self._output_cls.__name__}, got: {response.message.content}")
+            return _validate_json(self._output_cls, tool_calls[0].function.arguments)
+        return self._output_parser.parse('{' + (response.message.content or ''))
+
+    def _record(self, status: str, attempt: int):
+        increment('structured_output_calls', program=self._output_cls.__name__, mode=self._mode, status=status)
+        if attempt:
+            increment('structured_output_retries', program=self._output_cls.__name__, mode=self._mode)
+
+    def __call__(self, **kwargs: Any) -> BaseModel:
+        for attempt in range(self._attempts):
+            try:
+                if self._mode == 'text':
+                    output = self._program(**kwargs)
+                else:
+                    output = self._parse(self._llm.chat(self._messages(**kwargs), **self._llm_kwargs()))
+            except ValueError:  # Includes JSON and validation errors
+                self._record('parse_error', attempt)
+                if attempt == self._attempts - 1:
+                    raise
+                continue
+            except Exception:
+                self._record('error', attempt)
+                raise
+            self._record('ok', attempt)
+            return output
+
+    async def acall(self, **kwargs: Any) -> BaseModel:
+        for attempt in range(self._attempts):
+            try:
+                if self._mode == 'text':
+                    output = await self._program.acall(**kwargs)
+                else:
+                    output = self._parse(await self._llm.achat(self._messages(**kwargs), **self._llm_kwargs()))
+            except ValueError:  # Includes JSON and validation errors
+                self._record('parse_error', attempt)
+                if attempt == self._attempts - 1:
+                    raise
+                continue
+            except Exception:
+                self._record('error', attempt)
+                raise
+            self._record('ok', attempt)
+            return output
+
+
+__all__ = ['StructuredProgram', 'structured_output_mode']
@@ -1,17 +1,45 @@
-from transformers import AutoTokenizer
-from typing import Optional, Sequence, List
+import re
+from functools import cache, partial
+from typing import Callable, Optional, Sequence, List
 from llama_index.core.llms import ChatMessage
+from llama_index.core.utils import get_tokenizer
 
-_tokenizers = {
-    'zephyr-7b': AutoTokenizer.from_pretrained('HuggingFaceH4/zephyr-7b-beta'),
-    'mixtral-8x7b': AutoTokenizer.from_pretrained('mistralai/Mixtral-8x7B-Instruct-v0.1'),
+_tokenizer_names = {
+    'zephyr-7b': 'HuggingFaceH4/zephyr-7b-beta',
+    'mixtral-8x7b': 'mistralai/Mixtral-8x7B-Instruct-v0.1',
 }
 
 
+@cache
+def _get_tokenizer(model: str):
+    # Loaded on first use, as it imports transformers and downloads the tokenizer from HuggingFace
+    from transformers import AutoTokenizer
+
+    return AutoTokenizer.from_pretrained(_tokenizer_names[model])
+
+
+@cache
+def get_model_tokenizer(model: str) -> Callable[[str], List]:
+    """
+    Returns the function encoding texts into the tokens of the model, to count tokens exactly.
+    """
+    if model in _tokenizer_names:
+        return partial(_get_tokenizer(model).encode, add_special_tokens=False)
+    if re.match(r'^gpt', model):
+        import tiktoken
+
+        try:
+            return tiktoken.encoding_for_model(model).encode
+        except Exception as exc:
+            print(f"Failed to load the tokenizer of {model}, counting tokens with the default tokenizer: {exc}")
+    # Anthropic does not publish the tokenizer of its Claude 3 models, the default tokenizer is a close estimate
+    return get_tokenizer()
+
+
 def messages_to_prompt(
         messages: Sequence[ChatMessage], model: str, system_prompt: Optional[str] = None
 ) -> str:
-    tokenizer = _tokenizers[model]
+    tokenizer = _get_tokenizer(model)
     if messages[0].role != 'system' and isinstance(messages, List):
         messages.insert(0, system_prompt)
     match model:
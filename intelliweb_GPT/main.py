@@ -1,60 +1,329 @@
-import nest_asyncio
-
-nest_asyncio.apply()
-
-from typing import Dict
+import os
+import re
+import asyncio
+from time import perf_counter
+from typing import AsyncGenerator, Dict, List, Tuple
+from functools import cache
 from intelliweb_GPT.prompts import *
+from intelliweb_GPT.cache import AnswerCache, CachedAnswer
+from intelliweb_GPT.llms import load_embed_model
+from intelliweb_GPT.telemetry import configure_from_env, increment, record_span, span, start_trace
 from intelliweb_GPT.components import QueryAnswerer, SourceSelector, WebRetriever, DocumentGetter
 
-source_selector = SourceSelector()
-query_answerer = QueryAnswerer()
-web_retriever = WebRetriever()
-document_getter = DocumentGetter()
 
+@cache
+def _get_components() -> (SourceSelector, QueryAnswerer, WebRetriever, DocumentGetter):
+    # Created on the first query rather than at import, to keep the cold start of the package short
+    configure_from_env()
+    return SourceSelector(), QueryAnswerer(), WebRetriever(), DocumentGetter()
+
+
+def get_source_selector() -> SourceSelector:
+    """
+    Returns the source selector used by `generate_answer`, for other components routing queries (e.g. the
+    `QueryPlanner`) to share its routing cache, nearest neighbours and stats.
+    """
+    return _get_components()[0]
+
+
+@cache
+def _get_answer_cache() -> AnswerCache | None:
+    return AnswerCache() if os.getenv('ANSWER_CACHE_ENABLED', 'false').lower() == 'true' else None
+
+
+async def _traced(response: AsyncGenerator, trace_id: str, start_time: float, source: str,
+                  **attributes) -> AsyncGenerator:
+    """
+    Passes the answer through, recording the time to its first token and the total time of the query.
+    """
+    first_token, status = True, 'cancelled'
+    try:
+        async for token in response:
+            if first_token:
+                record_span('ttft', perf_counter() - start_time, trace_id=trace_id, source=source, **attributes)
+                first_token = False
+            yield token
+        status = 'ok'
+    except Exception:
+        status = 'error'
+        raise
+    finally:
+        record_span('total', perf_counter() - start_time, trace_id=trace_id, source=source, status=status,
+                    **attributes)
+
+
+async def _alookup_answer(query: str) -> (CachedAnswer | None, List[float] | None):
+    """
+    Looks up the answer cache for a paraphrase of the query answered before. Returns the cached answer, if any, and
+    the embedding of the query to cache its answer with otherwise.
+    """
+    answer_cache = _get_answer_cache()
+    if answer_cache is None:
+        return None, None
+    with span('answer_cache') as cache_span:
+        try:
+            embedding = await load_embed_model().aget_query_embedding(query)
+        except Exception as exc:
+            print(f"Failed to embed the query for the answer cache: {exc}")
+            cache_span.set_attribute('cache', 'error')
+            return None, None
+        cached = answer_cache.get(embedding, query)
+        cache_span.set_attribute('cache', 'miss' if cached is None else 'hit')
+    increment('answer_cache_lookups', cache='miss' if cached is None else 'hit')
+    if cached is not None:
+        print(f"Answering from the answer cache, with the answer to {repr(cached.query)} "
+              f"(similarity {cached.similarity:.3f})")
+    return cached, embedding
+
+
+async def _replay(answer: str) -> AsyncGenerator:
+    """
+    Streams a cached answer word by word, like the LLM would.
+    """
+    for token in re.findall(r'\s*\S+', answer):
+        yield token
+
+
+async def _cached(response: AsyncGenerator, query: str, embedding: List[float] | None, source: str,
+                  references: List[str]) -> AsyncGenerator:
+    """
+    Passes the answer through, caching it once it has been generated in full.
+    """
+    tokens = []
+    async for token in response:
+        tokens.append(token)
+        yield token
+    answer = "".join(tokens).strip()
+    # Answers from the web are only cached if there were pages to answer from, as a failed search should be retried
+    if embedding is not None and answer and (source == "LLM" or references):
+        _get_answer_cache().set(query, embedding, answer, references, source)
+
+
+async def _aretrieve_documents(search_query: str, source: str, use_serper_api: bool) -> (List, List):
+    _, _, web_retriever, document_getter = _get_components()
+    retrieved_urls = await web_retriever.aretrieve_relevant_urls(search_query, source, use_serper_api)
+    return await document_getter.aget_documents_from_urls(
+        retrieved_urls,
+        source=source,
+        min_documents=int(os.getenv('SCRAPER_MIN_DOCUMENTS', 5)),
+        soft_timeout=float(os.getenv('SCRAPER_SOFT_TIMEOUT', 4)),
+        url_timeout=float(os.getenv('SCRAPER_URL_TIMEOUT', 10)),
+        total_timeout=float(os.getenv('SCRAPER_TOTAL_TIMEOUT', 15)),
+    )
+
+
+def _document_source(source_to_use: str) -> (str, List, List):
+    """
+    Returns the search source for a source selected by the router, and the QA and refine prompts to answer from its
+    documents with.
+    """
+    if source_to_use == "Google News Search":
+        source, qa_prompt, refine_prompt = 'news', QA_NEWS, REFINE_QA_NEWS
+    else:
+        source, qa_prompt, refine_prompt = 'search', QA_WEB, REFINE_QA_WEB
+    return source, create_chat_messages(SYSTEM_MESSAGE, qa_prompt), create_chat_messages(SYSTEM_MESSAGE, refine_prompt)
+
+
+def _token_overlap(a: str, b: str) -> float:
+    """
+    Jaccard similarity of the sets of words of the two texts.
+    """
+    tokens_a, tokens_b = set(re.findall(r'\w+', a.lower())), set(re.findall(r'\w+', b.lower()))
+    return len(tokens_a & tokens_b) / len(tokens_a | tokens_b) if tokens_a | tokens_b else 1.0
+
+
+async def _resolve_speculation(speculation: asyncio.Task | None, started_at: float, speculative_query: str,
+                               source: str, search_query: str) -> Tuple[List, List] | None:
+    """
+    Returns the documents fetched speculatively for a web search of the raw query, if the router's decision is close
+    enough for them to answer it. Otherwise the speculative work is cancelled and counted as wasted.
+    """
+    if speculation is None:
+        return None
+    if source == 'search' and _token_overlap(speculative_query, search_query) >= \
+            float(os.getenv('SPECULATIVE_MIN_OVERLAP', 0.6)):
+        try:
+            documents_and_references = await speculation
+            increment('speculative_searches', outcome='used')
+            return documents_and_references
+        except Exception as exc:
+            print(f"Speculative search failed, searching again: {exc}")
+            increment('speculative_searches', outcome='failed')
+            return None
 
-async def generate_answer(query: str, use_serper_api: bool = False, stream: bool = False) -> Dict | str:
+    outcome = f'cancelled_{source}' if source in ('llm', 'cache') else 'cancelled_mismatch'
+    if speculation.done():
+        if not speculation.cancelled():
+            speculation.exception()  # Retrieved, so that a failure is not reported as never retrieved
+    else:
+        speculation.cancel()
+    increment('speculative_searches', outcome=outcome)
+    # Work is counted until it is discarded, even if it completed earlier
+    increment('speculative_wasted_seconds', perf_counter() - started_at, outcome=outcome)
+    print(f"Discarded speculative search for {repr(speculative_query)} ({outcome})")
+    return None
+
+
+async def generate_answer(query: str, use_serper_api: bool = False, stream: bool = False,
+                          speculative: bool = None, source: str = None, search_query: str = None) -> Dict | str:
     """
     Generates answer for a given user query
     Args:
         query: User query
         use_serper_api: Whether to use serper_api or directly scrape from the search results. Defaults to False.
         stream: Whether to stream the answer or not. Defaults to False
+        speculative: Whether to start a web search for the raw query and prefetch its pages while the source is
+            still being selected. The prefetched pages are used if a web search with a similar query is selected, and
+            discarded otherwise. Defaults to the `SPECULATIVE_ROUTING` env variable, or False
+        source: Source to answer from ('Google Web Search', 'Google News Search' or 'LLM'), if already selected (e.g.
+            by the `QueryPlanner`). Selected by the `SourceSelector` if None
+        search_query: Search query for `source`. Defaults to the query
+
+    Paraphrases of queries answered before are answered from the answer cache (see `AnswerCache`) if the
+    `ANSWER_CACHE_ENABLED` env variable is true (false by default). A cached answer is streamed through
+    `answer_generator` like a new one.
 
     Returns:
         Returns a dictionary with the answer to the query and URL references from the web used to generate the answer
-        (if any)
-    """
-    source_to_use, search_query = source_selector.select_optimal_source(query)
-    if source_to_use == "LLM":
-        formatted_chat_history = [{'role': 'system', 'content': SYSTEM_MESSAGE}]
-        response = await query_answerer.answer_from_knowledge(query, chat_history=formatted_chat_history, stream=stream)
-        if stream:
-            return response
+        (if any). When streaming, the answer is replaced by an async generator of its tokens, `answer_generator`
+    """
+    source_selector, query_answerer, _, _ = _get_components()
+    start_time, trace_id = perf_counter(), start_trace()
+    if speculative is None:
+        speculative = os.getenv('SPECULATIVE_ROUTING', 'false').lower() == 'true'
+    decided_route = (source, search_query or query) if source is not None else None
+    # There is nothing to overlap the search with if the source has already been selected
+    speculative = speculative and decided_route is None
+    speculation = asyncio.create_task(_aretrieve_documents(query, 'search', use_serper_api)) if speculative else None
+
+    async def _aroute() -> (str, str):
+        if decided_route is not None:
+            return decided_route
+        with span('routing', speculative=speculative) as routing_span:
+            route = await source_selector.aselect_optimal_source(query)
+            routing_span.set_attribute('source', route[0])
+        return route
+
+    # The source is selected while the answer cache is looked up, so that a miss does not wait for both in turn
+    routing = asyncio.create_task(_aroute())
+    try:
+        cached, embedding = await _alookup_answer(query)
+        if cached is None:
+            source_to_use, search_query = await routing
+    except BaseException:
+        routing.cancel()
+        if speculation is not None:
+            speculation.cancel()
+        raise
+
+    if cached is not None:
+        if routing.done():
+            if not routing.cancelled():
+                routing.exception()  # Retrieved, so that a failure is not reported as never retrieved
         else:
-            async for r in response:
-                return {"answer": r}
-    elif source_to_use == "Google News Search":
-        source = 'news'
-        QA_PROMPT, CHAT_REFINE_QA_PROMPT_LC = QA_NEWS, REFINE_QA_NEWS
+            routing.cancel()
+        await _resolve_speculation(speculation, start_time, query, 'cache', cached.query)
+        response = _traced(_replay(cached.answer), trace_id, start_time, cached.source, cache='hit')
+        references = cached.references
     else:
-        source = 'search'
-        QA_PROMPT, CHAT_REFINE_QA_PROMPT_LC = QA_WEB, REFINE_QA_WEB
-
-    retrieved_urls = web_retriever.retrieve_relevant_urls(search_query, source, use_serper_api)
-    documents, references = document_getter.get_documents_from_urls(retrieved_urls)
-    response = await query_answerer.answer_from_documents(
-        query, documents, stream=stream,
-        qa_prompt=create_chat_messages(SYSTEM_MESSAGE, QA_PROMPT),
-        refine_prompt=create_chat_messages(SYSTEM_MESSAGE, CHAT_REFINE_QA_PROMPT_LC)
-    )
+        if source_to_use == "LLM":
+            await _resolve_speculation(speculation, start_time, query, 'llm', search_query)
+            formatted_chat_history = [{'role': 'system', 'content': SYSTEM_MESSAGE}]
+            response = await query_answerer.answer_from_knowledge(query, chat_history=formatted_chat_history,
+                                                                  stream=stream)
+            references = []
+        else:
+            source, qa_prompt, refine_prompt = _document_source(source_to_use)
+            documents_and_references = await _resolve_speculation(speculation, start_time, query, source,
+                                                                  search_query)
+            documents, references = documents_and_references or await _aretrieve_documents(search_query, source,
+                                                                                            use_serper_api)
+            response = await query_answerer.answer_from_documents(
+                query, documents, stream=stream, qa_prompt=qa_prompt, refine_prompt=refine_prompt
+            )
+        response = _traced(_cached(response, query, embedding, source_to_use, references), trace_id, start_time,
+                           source_to_use)
+
     if stream:
         return {
             "answer_generator": response,
             "references": references
         }
     else:
-        async for r in response:
-            return {
-                "answer": r,
-                "references": references
-            }
+        return {
+            "answer": "".join([r async for r in response]),
+            "references": references
+        }
+
+
+async def generate_answers(queries: List[str], use_serper_api: bool = False,
+                           concurrency: int = None) -> AsyncGenerator[Tuple[int, Dict], None]:
+    """
+    Generates answers for many queries (e.g. for offline jobs), sharing the work they have in common instead of
+    answering each one independently:
+        - The sources of all the queries are selected together, with one LLM call per batch of queries
+        - Queries with the same search query and source share a single search, and the documents scraped for it are
+          only chunked and embedded once
+        - Pages linked from several searches are only scraped once at a time, and the page and embedding caches
+          (if enabled) serve them afterwards
+
+    Args:
+        queries: User queries
+        use_serper_api: Whether to use serper_api or directly scrape from the search results. Defaults to False.
+        concurrency: Number of queries answered at a time. Defaults to the `BATCH_CONCURRENCY` env variable, or 8
+
+    Yields:
+        (int, Dict): The index of a query in `queries` and its result, as soon as it has been answered. The result is
+            the same as that of `generate_answer`, or holds the 'error' that prevented answering the query
+    """
+    source_selector, query_answerer, _, _ = _get_components()
+    semaphore = asyncio.Semaphore(concurrency or int(os.getenv('BATCH_CONCURRENCY', 8)))
+    with span('routing', queries=len(queries)):
+        decisions = await source_selector.aselect_optimal_sources(queries)
+
+    searches: Dict[Tuple[str, str], asyncio.Future] = {}
+
+    async def _aindexed_search(search_query: str, source: str) -> (Tuple, List):
+        documents, references = await _aretrieve_documents(search_query, source, use_serper_api)
+        return await query_answerer.aindex_documents(documents), references
+
+    def _shared_search(search_query: str, source: str) -> asyncio.Future:
+        key = (source, re.sub(r'\s+', ' ', search_query).strip().lower())
+        if key not in searches:
+            searches[key] = asyncio.ensure_future(_aindexed_search(search_query, source))
+        return searches[key]
+
+    async def _answer(query: str, source_to_use: str, search_query: str) -> Dict:
+        start_time, trace_id = perf_counter(), start_trace()
+        if source_to_use == "LLM":
+            response = await query_answerer.answer_from_knowledge(
+                query, chat_history=[{'role': 'system', 'content': SYSTEM_MESSAGE}]
+            )
+            return {"answer": [r async for r in _traced(response, trace_id, start_time, source_to_use)][0]}
+
+        source, qa_prompt, refine_prompt = _document_source(source_to_use)
+        # Shielded, as the other queries sharing the search still need it if this one is cancelled
+        indexed_documents, references = await asyncio.shield(_shared_search(search_query, source))
+        response = await query_answerer.answer_from_documents(
+            query, [], qa_prompt=qa_prompt, refine_prompt=refine_prompt, indexed_documents=indexed_documents
+        )
+        return {
+            "answer": [r async for r in _traced(response, trace_id, start_time, source_to_use)][0],
+            "references": references
+        }
+
+    async def _guarded_answer(index: int) -> (int, Dict):
+        async with semaphore:
+            try:
+                return index, await _answer(queries[index], *decisions[index])
+            except Exception as exc:
+                print(f"Failed to answer {repr(queries[index])}: {exc}")
+                return index, {"error": str(exc)}
+
+    tasks = [asyncio.ensure_future(_guarded_answer(index)) for index in range(len(queries))]
+    try:
+        for future in asyncio.as_completed(tasks):
+            yield await future
+    finally:
+        for task in [*tasks, *searches.values()]:
+            task.cancel()
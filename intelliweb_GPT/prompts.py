@@ -96,15 +96,36 @@ SOURCE_SELECTION = (
     "{query}\n"
 )
 
-QUERY_REFRAMING = (
-    "You are given a conversation between a human and an assistant and a user query below. If the user query is "
-    "related to the topic of messages in the conversation, reframe the query to include context from previous "
-    "messages, specifically mentioning all relevant terms like diseases, genes, drugs, conditions, companies or "
-    "organizations etc., in case it is mentioned in the conversation, so that the reframed query becomes standalone.\n"
-    "If the user query is in no way related to the topic of the previous messages, return the query unmodified.\n\n"
+SOURCE_SELECTION_BATCH = (
+    "Based on each of the numbered user queries below, decide on what source to use to best answer it. Your possible "
+    "sources are given below:\n"
+    "1. LLM: Useful for answering conversational queries and for queries related to capabilities of the model.\n"
+    "If query is related to time-sensitive information, recent developments, or needs current data, then "
+    "choose one of the sources below to get up-to-date info:\n"
+    "2. Google Web Search: Useful when query asks about a specific topic or for events more than 3 weeks old. (Prefer "
+    "this source for most cases)\n"
+    "3. Google News Search: Useful when query asks about very recent events or news\n\n"
+    "Return one decision for every query, in the same order as the queries.\n\n"
+    "{queries}\n"
+)
+
+QUERY_PLANNING = (
+    "You are given a conversation between a human and an assistant and a user query below.\n"
+    "First, if the user query is related to the topic of messages in the conversation, reframe the query to include "
+    "context from previous messages, specifically mentioning all relevant terms like diseases, genes, drugs, "
+    "conditions, companies or organizations etc., in case it is mentioned in the conversation, so that the reframed "
+    "query becomes standalone. If the user query is in no way related to the topic of the previous messages, keep the "
+    "query unmodified.\n"
+    "Then, based on the reframed query, decide on what source to use to best answer it. Your possible sources are "
+    "given below:\n"
+    "1. LLM: Useful for answering conversational queries and for queries related to capabilities of the model.\n"
+    "If query is related to time-sensitive information, recent developments, or needs current data, then "
+    "choose one of the sources below to get up-to-date info:\n"
+    "2. Google Web Search: Useful when query asks about a specific topic or for events more than 3 weeks old. (Prefer "
+    "this source for most cases)\n"
+    "3. Google News Search: Useful when query asks about very recent events or news\n\n"
     "<Conversation>\n{chat_history}\n"
     "<User Query>\n{user_query}\n"
-    "<Reframed Query>\n"
 )
 
 FOLLOW_UP_QUERY_CREATION = (
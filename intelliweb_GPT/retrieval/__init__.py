@@ -0,0 +1,7 @@
+from intelliweb_GPT.retrieval.vector import NumpyRetriever
+from intelliweb_GPT.retrieval.lexical import BM25Retriever
+from intelliweb_GPT.retrieval.hybrid import HybridRetriever
+from intelliweb_GPT.retrieval.dedup import MinHashDeduplicator
+from intelliweb_GPT.retrieval.packing import ContextPacker
+
+__all__ = ['NumpyRetriever', 'BM25Retriever', 'HybridRetriever', 'MinHashDeduplicator', 'ContextPacker']
@@ -0,0 +1,67 @@
+import re
+import zlib
+from typing import Callable, List, Sequence, TypeVar
+
+import numpy as np
+
+T = TypeVar('T')
+
+
+class MinHashDeduplicator:
+    """
+    Drops near-duplicate texts, e.g. syndicated copies of the same wire story scraped from different sites. Texts are
+    split into overlapping word shingles, and the Jaccard similarity of their shingle sets is estimated from MinHash
+    signatures. Of each group of texts at least `threshold` similar, only the longest is kept.
+    """
+
+    def __init__(self, threshold: float = 0.8, shingle_size: int = 5, num_perm: int = 64, seed: int = 0):
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # Multiply-shift hash functions: (a * x + b) >> 32, with odd a, over wrapping 64-bit arithmetic
+        self._a = rng.integers(1, 1 << 63, size=num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 1 << 63, size=num_perm, dtype=np.uint64)
+        self._powers = np.uint64(1000003) ** np.arange(shingle_size, dtype=np.uint64)
+
+    def _shingles(self, text: str) -> np.ndarray:
+        words = re.findall(r'\w+', text.lower())
+        word_hashes = np.fromiter((zlib.crc32(word.encode()) for word in words), dtype=np.uint64, count=len(words))
+        if len(word_hashes) < self.shingle_size:
+            return np.array([int(np.sum(word_hashes * self._powers[:len(word_hashes)]))], dtype=np.uint64)
+        # Each shingle hashes as a polynomial of the hashes of its words
+        windows = np.lib.stride_tricks.sliding_window_view(word_hashes, self.shingle_size)
+        return np.unique(windows @ self._powers)
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = self._shingles(text)
+        signature = np.full(len(self._a), np.iinfo(np.uint64).max, dtype=np.uint64)
+        # In blocks, to bound the size of the (shingles x permutations) matrix for long pages
+        for start in range(0, len(hashes), 4096):
+            block = hashes[start:start + 4096, None]
+            signature = np.minimum(signature, ((block * self._a + self._b) >> np.uint64(32)).min(axis=0))
+        return signature
+
+    def unique_indices(self, texts: Sequence[str]) -> List[int]:
+        """
+        Returns the indices of the texts to keep, in their original order.
+        """
+        if self.threshold >= 1 or len(texts) < 2:
+            return list(range(len(texts)))
+        kept, signatures = [], np.empty((0, len(self._a)), dtype=np.uint64)
+        for i in sorted(range(len(texts)), key=lambda i: -len(texts[i])):
+            signature = self.signature(texts[i])
+            if len(kept) and (signatures == signature).mean(axis=1).max() >= self.threshold:
+                continue
+            kept.append(i)
+            signatures = np.vstack([signatures, signature])
+        return sorted(kept)
+
+    def deduplicate(self, items: Sequence[T], key: Callable[[T], str]) -> List[T]:
+        """
+        Returns the items whose text (given by `key`) is not a near-duplicate of a longer item's, in their original
+        order.
+        """
+        return [items[i] for i in self.unique_indices([key(item) for item in items])]
+
+
+__all__ = ['MinHashDeduplicator']
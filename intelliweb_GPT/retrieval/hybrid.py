@@ -0,0 +1,39 @@
+import asyncio
+from typing import Dict, List, Sequence
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import NodeWithScore, QueryBundle
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Fuses the rankings of several retrievers (e.g. BM25 and vector similarity) with reciprocal-rank fusion: each node
+    scores the sum of 1 / (`rrf_k` + rank) over the rankings it appears in. Ranks are used instead of the raw scores,
+    as BM25 scores and cosine similarities are not on comparable scales.
+    """
+
+    def __init__(self, retrievers: Sequence[BaseRetriever], similarity_top_k: int = 5, rrf_k: int = 60, **kwargs):
+        super().__init__(**kwargs)
+        self._retrievers = list(retrievers)
+        self._similarity_top_k = similarity_top_k
+        self._rrf_k = rrf_k
+
+    def _fuse(self, rankings: List[List[NodeWithScore]]) -> List[NodeWithScore]:
+        fused: Dict[str, NodeWithScore] = {}
+        for ranking in rankings:
+            for rank, node in enumerate(ranking, start=1):
+                score = 1 / (self._rrf_k + rank)
+                if node.node.node_id in fused:
+                    fused[node.node.node_id].score += score
+                else:
+                    fused[node.node.node_id] = NodeWithScore(node=node.node, score=score)
+        return sorted(fused.values(), key=lambda node: -node.score)[:self._similarity_top_k]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._fuse([retriever.retrieve(query_bundle) for retriever in self._retrievers])
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        return self._fuse(await asyncio.gather(*(retriever.aretrieve(query_bundle) for retriever in self._retrievers)))
+
+
+__all__ = ['HybridRetriever']
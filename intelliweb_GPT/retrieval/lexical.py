@@ -0,0 +1,88 @@
+import re
+from collections import Counter
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, MetadataMode, NodeWithScore, QueryBundle
+
+_TOKEN = re.compile(r'\w+')
+
+
+def _tokenize(text: str) -> List[str]:
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Retriever(BaseRetriever):
+    """
+    Top-k BM25 retriever over an in-memory set of nodes, needing no embeddings. The inverted index is built in a single
+    pass over the nodes and held as compact arrays: the postings (node index and term weight) of all terms are
+    stored contiguously, sorted by term, with `_offsets` marking where each term's postings start. Scoring a query
+    touches only the postings of its terms.
+    """
+
+    def __init__(self, nodes: Sequence[BaseNode], similarity_top_k: int = 5, k1: float = 1.5, b: float = 0.75,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self._nodes = list(nodes)
+        self._similarity_top_k = similarity_top_k
+
+        self._vocabulary: Dict[str, int] = {}
+        term_ids, node_ids, frequencies = [], [], []
+        lengths = np.zeros(len(self._nodes), dtype=np.float32)
+        for i, node in enumerate(self._nodes):
+            tokens = _tokenize(node.get_content(metadata_mode=MetadataMode.EMBED))
+            lengths[i] = len(tokens)
+            for term, frequency in Counter(tokens).items():
+                term_ids.append(self._vocabulary.setdefault(term, len(self._vocabulary)))
+                node_ids.append(i)
+                frequencies.append(frequency)
+
+        term_ids = np.asarray(term_ids, dtype=np.int32)
+        order = np.argsort(term_ids, kind='stable')
+        self._postings = np.asarray(node_ids, dtype=np.int32)[order]
+        document_frequencies = np.bincount(term_ids, minlength=len(self._vocabulary))
+        self._offsets = np.concatenate([[0], np.cumsum(document_frequencies)])
+        self._idf = np.log1p((len(self._nodes) - document_frequencies + 0.5) / (document_frequencies + 0.5))
+        # The length-normalized term frequency part of the BM25 score does not depend on the query, so it is computed
+        # once for all postings
+        frequencies = np.asarray(frequencies, dtype=np.float32)[order]
+        norms = k1 * (1 - b + b * lengths / max(lengths.mean(), 1)) if len(self._nodes) else lengths
+        self._weights = (frequencies * (k1 + 1) / (frequencies + norms[self._postings])).astype(np.float32)
+
+    def scores(self, query: str) -> np.ndarray:
+        """
+        Returns the BM25 score of every node for the query.
+        """
+        scores = np.zeros(len(self._nodes), dtype=np.float32)
+        for term, count in Counter(_tokenize(query)).items():
+            term_id = self._vocabulary.get(term)
+            if term_id is None:
+                continue
+            start, end = self._offsets[term_id], self._offsets[term_id + 1]
+            # Each node appears at most once in a term's postings, so the scores can be added with fancy indexing
+            scores[self._postings[start:end]] += count * self._idf[term_id] * self._weights[start:end]
+        return scores
+
+    def top_k(self, query: str) -> (np.ndarray, np.ndarray):
+        """
+        Returns the indices of the top-k nodes for the query and their BM25 scores, sorted by decreasing score. Nodes
+        sharing no term with the query are left out, so fewer than k nodes are returned if fewer match. Otherwise a
+        ranking fused with others (see `HybridRetriever`) would credit them like actual matches.
+        """
+        scores = self.scores(query)
+        k = min(self._similarity_top_k, len(self._nodes))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        indices = np.argpartition(-scores, k - 1)[:k]
+        indices = indices[np.lexsort((indices, -scores[indices]))]
+        indices = indices[scores[indices] > 0]
+        return indices, scores[indices]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        indices, scores = self.top_k(query_bundle.query_str)
+        return [NodeWithScore(node=self._nodes[i], score=float(score)) for i, score in zip(indices, scores)]
+
+
+__all__ = ['BM25Retriever']
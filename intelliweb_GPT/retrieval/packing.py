@@ -0,0 +1,110 @@
+import re
+from typing import Callable, Dict, List
+
+from intelliweb_GPT.telemetry import set_attributes
+
+from llama_index.core.schema import MetadataMode, NodeWithScore
+
+_WORD = re.compile(r'\w{3,}')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+')
+
+
+class ContextPacker:
+    """
+    Fits the highest scoring retrieved chunks into the token budget of a single prompt, so that answering takes one
+    LLM call instead of a chain of refine calls. Chunks are added in order of score while they fit. The first chunk
+    that does not fit is trimmed to its sentences most relevant to the query, and the rest are dropped.
+    """
+
+    def __init__(self, min_trimmed_tokens: int = 64, separator: str = "\n\n"):
+        self._min_trimmed_tokens = min_trimmed_tokens
+        self._separator = separator
+        self._stats = {'queries': 0, 'refine_avoided': 0, 'retrieved_chunks': 0, 'packed_chunks': 0,
+                       'trimmed_chunks': 0, 'context_tokens': 0}
+
+    @staticmethod
+    def _trim(text: str, query: str, budget: int, tokenizer: Callable[[str], List]) -> str:
+        """
+        Shortens the text to fit the budget by keeping its sentences sharing the most words with the query, in their
+        original order.
+        """
+        query_words = set(_WORD.findall(query.lower()))
+        sentences = [sentence for sentence in _SENTENCE_END.split(text) if sentence.strip()]
+        ranked = sorted(range(len(sentences)),
+                        key=lambda i: (-len(query_words & set(_WORD.findall(sentences[i].lower()))), i))
+        kept, used = set(), 0
+        for i in ranked:
+            tokens = len(tokenizer(sentences[i])) + 1
+            if used + tokens <= budget:
+                kept.add(i)
+                used += tokens
+        if kept:
+            return " ".join(sentences[i] for i in sorted(kept))
+        # Not even a single sentence fits, so the text is cut instead
+        words = text.split(" ")
+        while words and len(tokenizer(" ".join(words))) > budget:
+            words = words[:max(int(len(words) * 0.9), len(words) - 1)]
+        return " ".join(words)
+
+    def pack(self, nodes: List[NodeWithScore], query: str, token_budget: int,
+             tokenizer: Callable[[str], List]) -> List[NodeWithScore]:
+        """
+        Args:
+            nodes (List[NodeWithScore]): Retrieved chunks
+            query (str): Query the chunks were retrieved for
+            token_budget (int): Number of tokens the chunks may take up in the prompt, separators included
+            tokenizer (Callable[[str], List]): Tokenizer of the model the prompt is for
+
+        Returns:
+            List[NodeWithScore]: The chunks to put in the prompt, highest scoring first
+        """
+        separator_tokens = len(tokenizer(self._separator))
+        ranked = sorted(nodes, key=lambda node: -(node.score or 0.0))
+        packed, used, trimmed, total = [], 0, 0, 0
+        for node in ranked:
+            text = node.node.get_content(metadata_mode=MetadataMode.LLM)
+            tokens = len(tokenizer(text)) + separator_tokens
+            total += tokens
+            if used + tokens <= token_budget:
+                packed.append(node)
+                used += tokens
+                continue
+            if trimmed:
+                continue
+            # Room for the content of the chunk, not counting its metadata
+            content = node.node.get_content(metadata_mode=MetadataMode.NONE)
+            room = token_budget - used - separator_tokens - (len(tokenizer(text)) - len(tokenizer(content)))
+            if room >= self._min_trimmed_tokens:
+                trimmed_node = node.node.copy()
+                trimmed_node.set_content(self._trim(content, query, room, tokenizer))
+                packed.append(NodeWithScore(node=trimmed_node, score=node.score))
+                used += len(tokenizer(trimmed_node.get_content(metadata_mode=MetadataMode.LLM))) + separator_tokens
+                trimmed += 1
+
+        set_attributes(retrieved_chunks=len(nodes), packed_chunks=len(packed), trimmed_chunks=trimmed,
+                       context_tokens=used, token_budget=token_budget, refine_avoided=total > token_budget)
+        self._stats['queries'] += 1
+        self._stats['refine_avoided'] += total > token_budget
+        self._stats['retrieved_chunks'] += len(nodes)
+        self._stats['packed_chunks'] += len(packed)
+        self._stats['trimmed_chunks'] += trimmed
+        self._stats['context_tokens'] += used
+        return packed
+
+    def stats(self) -> Dict:
+        """
+        Returns how often packing saved refine calls, and how many chunks and tokens went into the prompts on average.
+        """
+        queries = self._stats['queries'] or 1
+        return {
+            'queries': self._stats['queries'],
+            'refine_avoided': self._stats['refine_avoided'],
+            'refine_avoided_rate': self._stats['refine_avoided'] / queries,
+            'mean_retrieved_chunks': self._stats['retrieved_chunks'] / queries,
+            'mean_packed_chunks': self._stats['packed_chunks'] / queries,
+            'trimmed_chunks': self._stats['trimmed_chunks'],
+            'mean_context_tokens': self._stats['context_tokens'] / queries,
+        }
+
+
+__all__ = ['ContextPacker']
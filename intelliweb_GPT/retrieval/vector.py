@@ -0,0 +1,71 @@
+from typing import List, Sequence
+
+import numpy as np
+
+from llama_index.core import Settings
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.retrievers import BaseRetriever
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+
+
+class NumpyRetriever(BaseRetriever):
+    """
+    Top-k cosine similarity retriever over an in-memory set of nodes. The node embeddings are held as one contiguous,
+    L2-normalized float32 matrix, so scoring any number of queries is a single matrix product and the top-k selection
+    an `argpartition`. Meant for the small per-query corpora built from scraped pages, where a full vector store index
+    is mostly overhead.
+    """
+
+    def __init__(self, nodes: Sequence[BaseNode], embeddings: Sequence[Sequence[float]] | np.ndarray,
+                 embed_model: BaseEmbedding = None, similarity_top_k: int = 5, **kwargs):
+        super().__init__(**kwargs)
+        self._nodes = list(nodes)
+        # Without nodes there is nothing to infer the dimension from, and `top_k` returns no results anyway
+        self._matrix = self._normalize(np.asarray(embeddings, dtype=np.float32).reshape(len(self._nodes), -1)) \
+            if self._nodes else np.empty((0, 0), dtype=np.float32)
+        self._embed_model = embed_model or Settings.embed_model
+        self._similarity_top_k = similarity_top_k
+
+    @staticmethod
+    def _normalize(matrix: np.ndarray) -> np.ndarray:
+        norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+        return np.ascontiguousarray(matrix / np.where(norms == 0, 1, norms), dtype=np.float32)
+
+    def top_k(self, query_embeddings: Sequence[Sequence[float]] | np.ndarray) -> (np.ndarray, np.ndarray):
+        """
+        Finds the most similar nodes for a batch of query embeddings.
+
+        Args:
+            query_embeddings: Matrix of shape (n_queries, dim)
+
+        Returns:
+            (np.ndarray, np.ndarray): Indices of the top-k nodes and their cosine similarities, both of shape
+                (n_queries, k), sorted by decreasing similarity
+        """
+        queries = self._normalize(np.atleast_2d(np.asarray(query_embeddings, dtype=np.float32)))
+        k = min(self._similarity_top_k, len(self._nodes))
+        if k == 0:
+            return np.empty((len(queries), 0), dtype=np.int64), np.empty((len(queries), 0), dtype=np.float32)
+
+        scores = queries @ self._matrix.T
+        indices = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, indices, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        return np.take_along_axis(indices, order, axis=1), np.take_along_axis(top_scores, order, axis=1)
+
+    def _to_nodes_with_scores(self, indices: np.ndarray, scores: np.ndarray) -> List[NodeWithScore]:
+        return [NodeWithScore(node=self._nodes[i], score=float(score)) for i, score in zip(indices, scores)]
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        query_embedding = query_bundle.embedding or self._embed_model.get_query_embedding(query_bundle.query_str)
+        indices, scores = self.top_k([query_embedding])
+        return self._to_nodes_with_scores(indices[0], scores[0])
+
+    async def _aretrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        query_embedding = query_bundle.embedding or \
+            await self._embed_model.aget_query_embedding(query_bundle.query_str)
+        indices, scores = self.top_k([query_embedding])
+        return self._to_nodes_with_scores(indices[0], scores[0])
+
+
+__all__ = ['NumpyRetriever']
@@ -0,0 +1,6 @@
+from intelliweb_GPT.scraping.scheduler import FetchScheduler
+from intelliweb_GPT.scraping.fetch import PageFetcher, FetchedPage
+from intelliweb_GPT.scraping.extraction import TextExtractor, extract_text
+from intelliweb_GPT.scraping.stats import ScraperStats
+
+__all__ = ['FetchScheduler', 'PageFetcher', 'FetchedPage', 'TextExtractor', 'extract_text', 'ScraperStats']
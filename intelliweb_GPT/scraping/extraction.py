@@ -0,0 +1,106 @@
+import os
+import asyncio
+import threading
+import multiprocessing
+from functools import cache
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+@cache
+def _trafilatura_config():
+    from trafilatura.settings import use_config
+
+    config = use_config()
+    # Extraction runs in worker processes or threads, where trafilatura's signal-based timeout cannot be used
+    config.set("DEFAULT", "EXTRACTION_TIMEOUT", "0")
+    return config
+
+
+def _warm_up():
+    # Imports trafilatura in each worker process up front, as the import takes seconds
+    _trafilatura_config()
+
+
+def extract_text(content: bytes, include_comments: bool = False, include_tables: bool = False) -> str | None:
+    """
+    Extracts the main text of an HTML page with trafilatura. Returns None if no text could be extracted.
+    """
+    import trafilatura
+
+    return trafilatura.extract(content, include_comments=include_comments, include_tables=include_tables,
+                               config=_trafilatura_config())
+
+
+class TextExtractor:
+    """
+    Runs trafilatura on raw page bytes in a pool of worker processes, so that parsing pages (CPU bound and holding the
+    GIL) neither blocks the event loop nor serializes with the rest of the app. The pool is started on first use, and
+    replaced if a worker dies (e.g. out of memory or crashing in lxml), in which case the page is extracted again in
+    the new pool. A page that kills a worker twice fails to extract.
+
+    Attributes:
+        max_workers: Number of worker processes. Set by the `SCRAPER_EXTRACTION_WORKERS` env variable, by default the
+            number of CPUs (at most 4). With 0, pages are extracted in the default thread pool instead
+        start_method: How worker processes are started. Set by the `SCRAPER_EXTRACTION_START_METHOD` env variable,
+            'spawn' by default, as forking a process running an event loop and other threads is unsafe
+    """
+
+    def __init__(self, max_workers: int = None, start_method: str = None):
+        self.max_workers = max_workers if max_workers is not None else int(
+            os.getenv('SCRAPER_EXTRACTION_WORKERS', min(os.cpu_count() or 1, 4))
+        )
+        self.start_method = start_method or os.getenv('SCRAPER_EXTRACTION_START_METHOD', 'spawn')
+        self._executor: Executor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> Executor | None:
+        if self.max_workers <= 0:
+            return None
+        with self._lock:
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=_warm_up,
+                                                     mp_context=multiprocessing.get_context(self.start_method))
+            return self._executor
+
+    def _replace_broken(self, executor: Executor):
+        with self._lock:
+            # Pages extracting concurrently see the same pool break, and only the first replaces it
+            if self._executor is executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+    async def aextract(self, content: bytes, include_comments: bool = False,
+                       include_tables: bool = False) -> str | None:
+        """
+        Extracts the main text of an HTML page, given its raw bytes.
+        """
+        for attempt in range(2):
+            executor = self._get_executor()
+            try:
+                return await asyncio.get_running_loop().run_in_executor(
+                    executor, extract_text, content, include_comments, include_tables
+                )
+            except BrokenProcessPool:
+                print("An extraction worker died. Replacing the extraction pool.")
+                self._replace_broken(executor)
+                if attempt:
+                    raise
+
+    def warm_up(self):
+        """
+        Starts the worker processes ahead of the first page, so that it does not wait for them to import trafilatura.
+        """
+        executor = self._get_executor()
+        if executor is not None:
+            for future in [executor.submit(_warm_up) for _ in range(self.max_workers)]:
+                future.result()
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+
+
+__all__ = ['TextExtractor', 'extract_text']
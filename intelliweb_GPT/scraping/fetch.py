@@ -0,0 +1,79 @@
+import os
+from dataclasses import dataclass
+from typing import Dict, Sequence
+
+import httpx
+
+from intelliweb_GPT.http_client import get_async_client
+from intelliweb_GPT.scraping.scheduler import FetchScheduler
+
+_DEFAULT_CONTENT_TYPES = ('text/html', 'application/xhtml+xml', 'application/xml', 'text/xml', 'text/plain')
+
+
+@dataclass
+class FetchedPage:
+    url: str
+    status_code: int
+    content: bytes
+    headers: httpx.Headers
+
+
+class PageFetcher:
+    """
+    Downloads raw pages over the pooled async HTTP client, without parsing them. Responses that are not text, or that
+    are larger than `max_bytes`, are rejected as soon as their headers (or their first `max_bytes` bytes) arrive, so a
+    PDF or a video linked from the search results cannot tie up a connection or the extraction workers. When each
+    page is fetched is up to the scheduler, which spreads the requests over hosts and adapts their concurrency.
+
+    Attributes:
+        max_bytes: Largest response body accepted. Set by the `SCRAPER_MAX_PAGE_BYTES` env variable, 5 MB by default
+        content_types: Accepted content types. Set by the comma-separated `SCRAPER_CONTENT_TYPES` env variable
+    """
+
+    def __init__(self, max_bytes: int = None, content_types: Sequence[str] = None, client_name: str = 'scraper',
+                 scheduler: FetchScheduler = None):
+        self.max_bytes = max_bytes or int(os.getenv('SCRAPER_MAX_PAGE_BYTES', 5 * 1024 * 1024))
+        self.content_types = tuple(content_types or (
+            os.getenv('SCRAPER_CONTENT_TYPES').split(',') if os.getenv('SCRAPER_CONTENT_TYPES')
+            else _DEFAULT_CONTENT_TYPES
+        ))
+        self._client_name = client_name
+        self._scheduler = scheduler or FetchScheduler()
+        # Enough connections, kept alive, for the scheduler's largest concurrency, to be reused for pages on the same
+        # hosts
+        self._client_limits = httpx.Limits(max_connections=self._scheduler.max_concurrency,
+                                           max_keepalive_connections=self._scheduler.max_concurrency,
+                                           keepalive_expiry=float(os.getenv('HTTP_KEEPALIVE_EXPIRY', 30)))
+
+    @property
+    def scheduler(self) -> FetchScheduler:
+        return self._scheduler
+
+    async def afetch(self, url: str, headers: Dict[str, str] = None) -> FetchedPage:
+        """
+        Fetches the page at the URL. A 304 (for conditional requests) is returned with an empty body, and any other
+        error status is raised as an `httpx.HTTPStatusError`.
+        """
+        client = get_async_client(self._client_name, limits=self._client_limits)
+        async with self._scheduler.slot(url), client.stream('GET', url, headers=headers) as response:
+            if response.status_code == 304:
+                return FetchedPage(url=url, status_code=304, content=b'', headers=response.headers)
+            response.raise_for_status()
+
+            content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+            if content_type and not content_type.startswith(self.content_types):
+                raise Exception(f"Unsupported content type {repr(content_type)} for {url}")
+            if int(response.headers.get('Content-Length') or 0) > self.max_bytes:
+                raise Exception(f"Page at {url} is larger than {self.max_bytes} bytes")
+
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > self.max_bytes:
+                    raise Exception(f"Page at {url} is larger than {self.max_bytes} bytes")
+                chunks.append(chunk)
+        return FetchedPage(url=url, status_code=response.status_code, content=b''.join(chunks),
+                           headers=response.headers)
+
+
+__all__ = ['FetchedPage', 'PageFetcher']
@@ -0,0 +1,232 @@
+import os
+import asyncio
+from time import monotonic, perf_counter, time
+from collections import deque
+from contextlib import asynccontextmanager
+from email.utils import parsedate_to_datetime
+from typing import AsyncIterator, Deque, Dict
+from urllib.parse import urlsplit
+
+import httpx
+
+from intelliweb_GPT.telemetry import increment, set_attributes
+
+_THROTTLING_STATUSES = (429, 503)
+
+
+class _Limiter:
+    """
+    Counting semaphore whose limit can be changed while it is in use. Waiters are served in order.
+    """
+
+    def __init__(self, limit: float):
+        self.limit = limit
+        self.in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    async def acquire(self):
+        if self.in_flight < self.limit and not self._waiters:
+            self.in_flight += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # The slot was handed over just as the wait was cancelled
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+            raise
+
+    def release(self):
+        self.in_flight -= 1
+        self.wake()
+
+    def wake(self):
+        # Slots are handed over to the waiters directly, so that no new caller can take them in between
+        while self._waiters and self.in_flight < self.limit:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+
+class _HostState:
+    def __init__(self, max_per_host: int):
+        self.limiter = _Limiter(max_per_host)
+        self.blocked_until = 0.0
+        self.throttled = 0
+
+
+class FetchScheduler:
+    """
+    Decides when each page may be fetched, to keep both throughput high and the chance of being blocked low when many
+    queries scrape at once:
+
+    - At most `max_per_host` requests are in flight to any one host, however many of the URLs are on it. The cap of a
+      host is halved whenever it throttles requests, and grows back as its requests succeed
+    - The number of requests in flight overall adapts to how the fetches go (AIMD): it grows by about one per round
+      of successful requests, and shrinks by `decrease_factor` (at most once per `decrease_interval` seconds) when
+      requests time out or take longer than `latency_target` seconds, or when more than `max_error_rate` of the
+      recent requests failed
+    - A host answering 429 or 503 is backed off for its `Retry-After` (or exponentially longer on repeated throttling).
+      Requests for it fail right away while the backoff lasts longer than `max_backoff_wait` seconds, as other URLs can
+      answer the query in the meantime, and wait for it otherwise
+
+    Attributes:
+        max_per_host: Set by the `SCRAPER_MAX_PER_HOST` env variable, 4 by default
+        min_concurrency, max_concurrency: Bounds of the overall concurrency. Set by the `SCRAPER_MIN_CONCURRENCY` and
+            `SCRAPER_MAX_CONCURRENCY` env variables, 4 and 64 by default. It starts at `SCRAPER_INITIAL_CONCURRENCY`
+        latency_target: Set by the `SCRAPER_LATENCY_TARGET` env variable, 3 seconds by default
+        max_error_rate: Set by the `SCRAPER_MAX_ERROR_RATE` env variable, 0.25 by default
+    """
+
+    def __init__(self, max_per_host: int = None, min_concurrency: int = None, max_concurrency: int = None,
+                 initial_concurrency: int = None, latency_target: float = None, max_error_rate: float = None,
+                 decrease_factor: float = 0.7, decrease_interval: float = 1.0, max_backoff: float = 60.0,
+                 max_backoff_wait: float = 2.0):
+        self.max_per_host = max_per_host or int(os.getenv('SCRAPER_MAX_PER_HOST', 4))
+        self.min_concurrency = min_concurrency or int(os.getenv('SCRAPER_MIN_CONCURRENCY', 4))
+        self.max_concurrency = max_concurrency or int(os.getenv('SCRAPER_MAX_CONCURRENCY', 64))
+        self.latency_target = latency_target or float(os.getenv('SCRAPER_LATENCY_TARGET', 3.0))
+        self.max_error_rate = max_error_rate or float(os.getenv('SCRAPER_MAX_ERROR_RATE', 0.25))
+        self._decrease_factor = decrease_factor
+        self._decrease_interval = decrease_interval
+        self._max_backoff = max_backoff
+        self._max_backoff_wait = max_backoff_wait
+        self._limiter = _Limiter(initial_concurrency or int(os.getenv('SCRAPER_INITIAL_CONCURRENCY', 16)))
+        self._last_decrease = 0.0
+        # Moving average of the share of requests failing, over roughly the last 1 / alpha requests
+        self._error_rate, self._error_rate_alpha = 0.0, 0.1
+        self._hosts: Dict[str, _HostState] = {}
+        self._stats = {'requests': 0, 'failures': 0, 'slow': 0, 'throttled': 0, 'rejected': 0}
+
+    @property
+    def concurrency(self) -> float:
+        return self._limiter.limit
+
+    def _increase(self):
+        self._limiter.limit = min(self._limiter.limit + 1 / self._limiter.limit, self.max_concurrency)
+        self._limiter.wake()
+
+    def _decrease(self):
+        now = monotonic()
+        # A burst of failures from one round of requests only counts once
+        if now - self._last_decrease >= self._decrease_interval:
+            self._last_decrease = now
+            self._limiter.limit = max(self._limiter.limit * self._decrease_factor, self.min_concurrency)
+
+    def _record(self, failed: bool, congested: bool):
+        """
+        Adapts the overall concurrency to the outcome of a request. It shrinks on signs of congestion (timeouts,
+        connection errors, slow responses) or while the recent error rate is above `max_error_rate`, and grows
+        otherwise.
+        """
+        self._stats['failures'] += failed
+        self._error_rate += self._error_rate_alpha * (failed - self._error_rate)
+        if congested or self._error_rate > self.max_error_rate:
+            self._decrease()
+        elif not failed:
+            self._increase()
+
+    @staticmethod
+    def _retry_after(response: httpx.Response) -> float | None:
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return float(value)
+        except ValueError:
+            pass
+        # Otherwise, it is an HTTP date
+        try:
+            return parsedate_to_datetime(value).timestamp() - time()
+        except (TypeError, ValueError):
+            return None
+
+    def _back_off(self, host: str, state: _HostState, response: httpx.Response):
+        # The host's own concurrency is halved as well, so that the requests waiting for it do not all retry at once
+        state.limiter.limit = max(state.limiter.limit / 2, 1)
+        state.throttled += 1
+        self._stats['throttled'] += 1
+        increment('scrape_throttled_responses')
+        delay = self._retry_after(response)
+        if delay is None:
+            delay = 2 ** (state.throttled - 1)
+        delay = min(max(delay, 0), self._max_backoff)
+        state.blocked_until = max(state.blocked_until, monotonic() + delay)
+        print(f"Backing off {host} for {delay:.1f} seconds after a {response.status_code} response.")
+
+    async def _wait_for_host(self, host: str, state: _HostState):
+        backoff = state.blocked_until - monotonic()
+        if backoff <= 0:
+            return
+        if backoff > self._max_backoff_wait:
+            self._stats['rejected'] += 1
+            raise Exception(f"Not fetching from {host} for another {backoff:.1f} seconds, after it throttled requests")
+        await asyncio.sleep(backoff)
+
+    @asynccontextmanager
+    async def slot(self, url: str) -> AsyncIterator[None]:
+        """
+        Waits until the URL may be fetched, and learns from how the fetch made in the `async with` block went: from the
+        exception it raised, if any (an `httpx.HTTPStatusError` for error statuses).
+        """
+        host = (urlsplit(url).hostname or '').lower()
+        state = self._hosts.setdefault(host, _HostState(self.max_per_host))
+        await self._wait_for_host(host, state)
+        wait_start = perf_counter()
+        await state.limiter.acquire()
+        try:
+            await self._limiter.acquire()
+        except BaseException:
+            state.limiter.release()
+            raise
+        set_attributes(scheduler_wait=perf_counter() - wait_start)
+
+        start = perf_counter()
+        self._stats['requests'] += 1
+        try:
+            yield
+        except httpx.HTTPStatusError as exc:
+            # Throttling is down to a single host, which is backed off, rather than to the overall concurrency
+            if exc.response.status_code in _THROTTLING_STATUSES:
+                self._back_off(host, state, exc.response)
+            elif exc.response.status_code >= 500:
+                self._record(failed=True, congested=False)
+            raise
+        except httpx.TransportError:
+            # Timeouts, refused or reset connections
+            self._record(failed=True, congested=True)
+            raise
+        else:
+            state.throttled = 0
+            state.limiter.limit = min(state.limiter.limit + 1 / state.limiter.limit, self.max_per_host)
+            slow = perf_counter() - start > self.latency_target
+            self._stats['slow'] += slow
+            self._record(failed=False, congested=slow)
+        finally:
+            self._limiter.release()
+            state.limiter.release()
+            if not state.limiter.in_flight and state.limiter.limit >= self.max_per_host and \
+                    state.blocked_until < monotonic():
+                # Forgets idle hosts back to normal, so that the states of one-off hosts do not pile up
+                self._hosts.pop(host, None)
+
+    def stats(self) -> Dict:
+        """
+        Returns the current overall concurrency and the number of requests in flight, how many requests were made,
+        failed, were slow or throttled, and how many were refused while their host was backed off.
+        """
+        return {
+            'concurrency': self._limiter.limit,
+            'in_flight': self._limiter.in_flight,
+            'error_rate': self._error_rate,
+            'backed_off_hosts': sum(state.blocked_until > monotonic() for state in self._hosts.values()),
+            **self._stats,
+        }
+
+
+__all__ = ['FetchScheduler']
@@ -0,0 +1,82 @@
+import os
+import random
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Sequence
+from urllib.parse import urlsplit
+
+
+class _ScraperRecord:
+    __slots__ = ('attempts', 'successes', 'success_rate', 'latency')
+
+    def __init__(self):
+        self.attempts = 0
+        self.successes = 0
+        self.success_rate = 0.0
+        self.latency = 0.0
+
+
+class ScraperStats:
+    """
+    Success rates and latencies of the scrapers on each host, kept as exponentially weighted moving averages so that
+    they follow sites as they change. A scrape succeeds if it returns text. The least recently scraped hosts are
+    forgotten beyond `max_hosts`.
+
+    A share `explore_rate` of the rankings keeps the default order regardless of the stats, so that a scraper that
+    lost a host gets to try it again (e.g. once the site stops blocking it).
+    """
+
+    def __init__(self, alpha: float = 0.2, max_hosts: int = None, explore_rate: float = None):
+        self._alpha = alpha
+        self._explore_rate = float(os.getenv('SCRAPER_EXPLORE_RATE', 0.05)) if explore_rate is None else explore_rate
+        self._max_hosts = max_hosts or int(os.getenv('SCRAPER_STATS_MAX_HOSTS', 10000))
+        self._hosts: OrderedDict[str, Dict[str, _ScraperRecord]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _host(url: str) -> str:
+        return (urlsplit(url).hostname or '').lower()
+
+    def record(self, url: str, scraper: str, success: bool, latency: float):
+        host = self._host(url)
+        with self._lock:
+            records = self._hosts.setdefault(host, {})
+            self._hosts.move_to_end(host)
+            while len(self._hosts) > self._max_hosts:
+                self._hosts.popitem(last=False)
+            record = records.setdefault(scraper, _ScraperRecord())
+            alpha = max(self._alpha, 1 / (record.attempts + 1))  # Plain mean until there are enough samples
+            record.attempts += 1
+            record.successes += success
+            record.success_rate += alpha * (success - record.success_rate)
+            record.latency += alpha * (latency - record.latency)
+
+    def rank(self, url: str, scrapers: Sequence[str]) -> List[str]:
+        """
+        Orders the scrapers by the expected time to get text from the host of the URL (their mean latency over their
+        success rate), fastest first. Keeps the given order until every scraper has been tried on the host.
+        """
+        with self._lock:
+            records = self._hosts.get(self._host(url), {})
+            if not all(scraper in records for scraper in scrapers) or random.random() < self._explore_rate:
+                return list(scrapers)
+
+            def _expected_time(scraper: str) -> float:
+                return records[scraper].latency / max(records[scraper].success_rate, 0.05)
+
+            return sorted(scrapers, key=_expected_time)
+
+    def stats(self) -> Dict:
+        """
+        Returns, for each host, the attempts, success rate and mean latency of each scraper tried on it.
+        """
+        with self._lock:
+            return {
+                host: {scraper: {'attempts': record.attempts, 'successes': record.successes,
+                                 'success_rate': record.success_rate, 'mean_latency_ms': record.latency * 1000}
+                       for scraper, record in records.items()}
+                for host, records in self._hosts.items()
+            }
+
+
+__all__ = ['ScraperStats']
@@ -0,0 +1,326 @@
+import os
+import json
+import asyncio
+from time import perf_counter
+from contextlib import asynccontextmanager
+from typing import Any, Callable, Dict, Tuple
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+from intelliweb_GPT.telemetry import configure_from_env, increment, metrics, record_span, set_gauge
+
+# Events of an answer stream that end it
+_TERMINAL_EVENTS = ('done', 'error')
+
+
+class Overloaded(Exception):
+    """
+    Raised when a request is shed, because the wait queue is full or no slot freed up in time.
+    """
+
+    def __init__(self, reason: str):
+        super().__init__(f"Server overloaded: {reason}")
+        self.reason = reason
+
+
+class AdmissionController:
+    """
+    Bounds the requests answered at once to `max_in_flight`, with up to `max_queue` more waiting for a slot, first
+    come first served. Requests beyond that are rejected straight away, so that a burst of traffic is shed at the door
+    instead of fanning out into LLM, search and scraping work that slows every request down. The slots in use and
+    the requests waiting are kept in the `server_in_flight` and `server_queued` gauges.
+    """
+
+    def __init__(self, max_in_flight: int = None, max_queue: int = None):
+        self.max_in_flight = max_in_flight or int(os.getenv('SERVER_MAX_IN_FLIGHT', 8))
+        self.max_queue = int(os.getenv('SERVER_MAX_QUEUE', 32)) if max_queue is None else max_queue
+        self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        self.in_flight = 0
+        self.queued = 0
+
+    @property
+    def saturated(self) -> bool:
+        return self._semaphore.locked() and self.queued >= self.max_queue
+
+    def _update_gauges(self):
+        set_gauge('server_in_flight', self.in_flight)
+        set_gauge('server_queued', self.queued)
+
+    async def acquire(self, timeout: float):
+        """
+        Waits up to `timeout` seconds for a slot. Raises `Overloaded` if the queue is full or the wait times out.
+        """
+        if self.saturated:
+            raise Overloaded('queue_full')
+        if self._semaphore.locked():
+            self.queued += 1
+            self._update_gauges()
+            try:
+                await asyncio.wait_for(self._semaphore.acquire(), max(timeout, 0))
+            except TimeoutError:
+                raise Overloaded('queue_timeout')
+            finally:
+                self.queued -= 1
+        else:
+            # Taken right away, unlike through `wait_for`, so that a burst arriving at once sees the slots it fills
+            await self._semaphore.acquire()
+        self.in_flight += 1
+        self._update_gauges()
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+        self._update_gauges()
+
+
+def _sse(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+class _EventStreamResponse(StreamingResponse):
+    """
+    Server-sent events response that closes its event stream and calls `on_close` however the response ends, even if
+    the client disconnects before the stream started.
+    """
+    media_type = 'text/event-stream'
+
+    def __init__(self, content, on_close: Callable[[], None], **kwargs: Any):
+        super().__init__(content, headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}, **kwargs)
+        self._on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            await self.body_iterator.aclose()
+            self._on_close()
+
+
+class AnswerServer:
+    """
+    HTTP service around `generate_answer`, as an ASGI app (`AnswerServer().app`):
+        - `POST /answer` with a JSON body, or `GET /answer` with query parameters: `query`, `use_serper_api`
+          (default true), `stream` (default true) and `timeout` in seconds. Streams the answer as server-sent events,
+          `token` events with the text of each token and a final `done` event with the references, or an `error`
+          event if the answer fails or runs out of time. Without streaming, returns the answer and its references as
+          JSON.
+        - `GET /healthz`: Liveness, 200 while the server is up.
+        - `GET /readyz`: Readiness, 200 once the pipeline is loaded, 503 while starting, shutting down or shedding
+          requests, with the slots in use and the requests waiting.
+        - `GET /metrics`: The metrics in the Prometheus text format.
+
+    Requests are admitted by an `AdmissionController`, and rejected with a 503 and a `Retry-After` header when the
+    server is overloaded. Each request has a deadline, `timeout` seconds after it arrived (capped by the
+    `SERVER_MAX_TIMEOUT` env variable, 120 by default), covering both its wait for a slot and its answer. The pipeline
+    is cancelled at the deadline, and when the client disconnects from a stream.
+
+    Args:
+        admission (AdmissionController): Controls the requests answered at once. Configured from the
+            `SERVER_MAX_IN_FLIGHT` and `SERVER_MAX_QUEUE` env variables if None
+        queue_timeout (float): Longest wait for a slot, in seconds. Defaults to the `SERVER_QUEUE_TIMEOUT` env
+            variable, or 10
+        default_timeout (float): Deadline of requests without a `timeout`, in seconds. Defaults to the
+            `SERVER_REQUEST_TIMEOUT` env variable, or 60
+        heartbeat (float): Seconds without events after which a stream gets a comment, so that proxies keep it open.
+            Defaults to the `SERVER_SSE_HEARTBEAT` env variable, or 15
+        warm_up (bool): Whether to load the pipeline and warm up the LLMs before the server is ready. Defaults to the
+            `SERVER_WARM_UP` env variable, or True
+    """
+
+    def __init__(self, admission: AdmissionController = None, queue_timeout: float = None,
+                 default_timeout: float = None, heartbeat: float = None, warm_up: bool = None):
+        self._admission = admission
+        self._queue_timeout = queue_timeout or float(os.getenv('SERVER_QUEUE_TIMEOUT', 10))
+        self._default_timeout = default_timeout or float(os.getenv('SERVER_REQUEST_TIMEOUT', 60))
+        self._max_timeout = float(os.getenv('SERVER_MAX_TIMEOUT', 120))
+        self._heartbeat = heartbeat or float(os.getenv('SERVER_SSE_HEARTBEAT', 15))
+        self._warm_up = os.getenv('SERVER_WARM_UP', 'true').lower() == 'true' if warm_up is None else warm_up
+        self._retry_after = os.getenv('SERVER_RETRY_AFTER', '1')
+        self._ready = False
+        self.app = Starlette(routes=[
+            Route('/answer', self.answer, methods=['GET', 'POST']),
+            Route('/healthz', self.healthz, methods=['GET']),
+            Route('/readyz', self.readyz, methods=['GET']),
+            Route('/metrics', self.metrics, methods=['GET']),
+        ], lifespan=self._lifespan)
+
+    @asynccontextmanager
+    async def _lifespan(self, app: Starlette):
+        configure_from_env()
+        # Created in the server's event loop, like the LLMs it answers with
+        self._admission = self._admission or AdmissionController()
+        if self._warm_up:
+            from intelliweb_GPT.main import _get_components
+            from intelliweb_GPT.llms import awarm_up_llms
+
+            await asyncio.to_thread(_get_components)
+            await awarm_up_llms()
+        self._ready = True
+        print(f"Serving answers with up to {self._admission.max_in_flight} requests in flight and "
+              f"{self._admission.max_queue} waiting")
+        try:
+            yield
+        finally:
+            self._ready = False
+
+    @staticmethod
+    def _flag(value: Any, default: bool) -> bool:
+        if value is None:
+            return default
+        return value if isinstance(value, bool) else str(value).lower() in ('1', 'true', 'yes')
+
+    async def _params(self, request: Request) -> Dict:
+        if request.method == 'GET':
+            params = dict(request.query_params)
+        else:
+            try:
+                params = await request.json()
+            except ValueError:
+                raise Exception("Request body is not valid JSON")
+            if not isinstance(params, dict):
+                raise Exception("Request body must be a JSON object")
+        query = params.get('query')
+        if not isinstance(query, str) or not query.strip():
+            raise Exception("'query' must be a non-empty string")
+        try:
+            timeout = float(params.get('timeout') or self._default_timeout)
+        except (TypeError, ValueError):
+            raise Exception("'timeout' must be a number of seconds")
+        return {'query': query.strip(), 'use_serper_api': self._flag(params.get('use_serper_api'), True),
+                'stream': self._flag(params.get('stream'), True), 'timeout': min(timeout, self._max_timeout)}
+
+    def _reject(self, reason: str) -> Response:
+        increment('server_rejections', reason=reason)
+        return JSONResponse({'error': 'overloaded', 'reason': reason}, status_code=503,
+                            headers={'Retry-After': self._retry_after})
+
+    async def answer(self, request: Request) -> Response:
+        loop = asyncio.get_running_loop()
+        arrived_at = loop.time()
+        try:
+            params = await self._params(request)
+        except Exception as exc:
+            increment('server_requests', status='bad_request')
+            return JSONResponse({'error': str(exc)}, status_code=400)
+        deadline = arrived_at + params['timeout']
+
+        waiting_since = perf_counter()
+        try:
+            await self._admission.acquire(min(self._queue_timeout, deadline - loop.time()))
+        except Overloaded as exc:
+            record_span('admission', perf_counter() - waiting_since, status='rejected')
+            return self._reject(exc.reason)
+        record_span('admission', perf_counter() - waiting_since, status='admitted')
+
+        released = False
+
+        def _release():
+            nonlocal released
+            if not released:
+                released = True
+                self._admission.release()
+
+        if params['stream']:
+            return _EventStreamResponse(self._event_stream(params, deadline), on_close=_release)
+        try:
+            status, body = await self._answer(params, deadline)
+        finally:
+            _release()
+        return JSONResponse(body, status_code=status)
+
+    async def _answer(self, params: Dict, deadline: float) -> Tuple[int, Dict]:
+        from intelliweb_GPT.main import generate_answer
+
+        try:
+            response = await asyncio.wait_for(
+                generate_answer(params['query'], use_serper_api=params['use_serper_api'], stream=False),
+                deadline - asyncio.get_running_loop().time()
+            )
+        except TimeoutError:
+            increment('server_requests', status='deadline_exceeded')
+            return 504, {'error': 'deadline_exceeded'}
+        except Exception as exc:
+            print(f"Failed to answer {repr(params['query'])}: {repr(exc)}")
+            increment('server_requests', status='error')
+            return 500, {'error': 'answer_failed'}
+        increment('server_requests', status='ok')
+        return 200, response
+
+    async def _produce(self, params: Dict, events: asyncio.Queue):
+        from intelliweb_GPT.main import generate_answer
+
+        response = await generate_answer(params['query'], use_serper_api=params['use_serper_api'], stream=True)
+        answer_generator = response['answer_generator']
+        try:
+            async for token in answer_generator:
+                await events.put(('token', {'text': token}))
+        finally:
+            await answer_generator.aclose()
+        await events.put(('done', {'references': response['references']}))
+
+    async def _produce_until(self, params: Dict, events: asyncio.Queue, deadline: float):
+        """
+        Puts the events of the answer in the queue, ending with a `done` event, or with an `error` event once the
+        answer fails or the deadline passes (the pipeline is cancelled then).
+        """
+        try:
+            await asyncio.wait_for(self._produce(params, events), deadline - asyncio.get_running_loop().time())
+            increment('server_requests', status='ok')
+            return
+        except TimeoutError:
+            increment('server_requests', status='deadline_exceeded')
+            event = ('error', {'error': 'deadline_exceeded'})
+        except Exception as exc:
+            print(f"Failed to answer {repr(params['query'])}: {repr(exc)}")
+            increment('server_requests', status='error')
+            event = ('error', {'error': 'answer_failed'})
+        await events.put(event)
+
+    async def _event_stream(self, params: Dict, deadline: float):
+        # The answer is produced in a task, so that the stream can send heartbeats while the pipeline is busy (e.g.
+        # searching and scraping before the first token), and a bounded queue, so that it cannot run far ahead of a
+        # slow client
+        events = asyncio.Queue(maxsize=64)
+        producer = asyncio.create_task(self._produce_until(params, events, deadline))
+        finished = False
+        try:
+            while not finished:
+                try:
+                    event, data = await asyncio.wait_for(events.get(), self._heartbeat)
+                except TimeoutError:
+                    yield ": keep-alive\n\n"
+                    continue
+                finished = event in _TERMINAL_EVENTS
+                yield _sse(event, data)
+        finally:
+            if not finished:
+                # The client disconnected
+                producer.cancel()
+                increment('server_requests', status='disconnected')
+            await asyncio.gather(producer, return_exceptions=True)
+
+    async def healthz(self, request: Request) -> Response:
+        return JSONResponse({'status': 'ok'})
+
+    async def readyz(self, request: Request) -> Response:
+        if not self._ready:
+            return JSONResponse({'ready': False}, status_code=503)
+        ready = not self._admission.saturated
+        return JSONResponse({'ready': ready, 'in_flight': self._admission.in_flight, 'queued': self._admission.queued},
+                            status_code=200 if ready else 503)
+
+    async def metrics(self, request: Request) -> Response:
+        return PlainTextResponse(metrics.render_prometheus(), media_type='text/plain; version=0.0.4')
+
+
+app = AnswerServer().app
+
+__all__ = ['Overloaded', 'AdmissionController', 'AnswerServer', 'app']
+
+if __name__ == "__main__":
+    import uvicorn
+
+    uvicorn.run(app, host=os.getenv('SERVER_HOST', '0.0.0.0'), port=int(os.getenv('SERVER_PORT', 8000)))
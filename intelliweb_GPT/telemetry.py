@@ -0,0 +1,281 @@
+import os
+import json
+import uuid
+import threading
+from time import time, perf_counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, List, Tuple
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Span attributes that become metric labels. Everything else (URLs, counts, ...) is only kept on the exported spans, to
+# keep the number of metric series bounded.
+_LABEL_KEYS = ('source', 'backend', 'scraper', 'cache', 'tier', 'mode', 'status')
+_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Span:
+    """
+    A timed stage of the answer pipeline, along with attributes describing it.
+    """
+    __slots__ = ('name', 'trace_id', 'start_time', 'duration', 'attributes', '_start')
+
+    def __init__(self, name: str, trace_id: str | None, attributes: Dict[str, Any]):
+        self.name = name
+        self.trace_id = trace_id
+        self.start_time = time()
+        self.duration: float | None = None
+        self.attributes = attributes
+        self._start = perf_counter()
+
+    def set_attribute(self, key: str, value: Any):
+        self.attributes[key] = value
+
+    def end(self):
+        self.duration = perf_counter() - self._start
+
+    def to_dict(self) -> Dict:
+        return {'name': self.name, 'trace_id': self.trace_id, 'start_time': self.start_time,
+                'duration': self.duration, 'attributes': self.attributes}
+
+
+class SpanExporter:
+    """
+    Receives every finished span. Subclass it to ship spans elsewhere and register it with `add_exporter`.
+    """
+
+    def export(self, span: Span):
+        raise NotImplementedError
+
+
+class JsonLinesExporter(SpanExporter):
+    """
+    Appends finished spans to a file, one JSON object per line.
+    """
+
+    def __init__(self, path: str):
+        self._path = path
+        self._lock = threading.Lock()
+
+    def export(self, span: Span):
+        line = json.dumps(span.to_dict(), default=str)
+        with self._lock, open(self._path, 'a') as f:
+            f.write(line + '\n')
+
+
+class _Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(_BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """
+    Aggregates span durations into histograms and keeps counters and gauges, all keyed by name and labels.
+    """
+
+    def __init__(self):
+        self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], float] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, name: str, value: float, labels: Dict[str, Any]):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._histograms.setdefault(key, _Histogram()).observe(value)
+
+    def increment(self, name: str, value: float = 1, labels: Dict[str, Any] = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, labels: Dict[str, Any] = None):
+        key = (name, tuple(sorted((labels or {}).items())))
+        with self._lock:
+            self._gauges[key] = value
+
+    def snapshot(self) -> Dict:
+        """
+        Returns the counters, the gauges and, for each histogram, its count, sum and mean.
+        """
+        with self._lock:
+            return {
+                'counters': [{'name': name, 'labels': dict(labels), 'value': value}
+                             for (name, labels), value in self._counters.items()],
+                'gauges': [{'name': name, 'labels': dict(labels), 'value': value}
+                           for (name, labels), value in self._gauges.items()],
+                'histograms': [{'name': name, 'labels': dict(labels), 'count': histogram.count, 'sum': histogram.sum,
+                                'mean': histogram.sum / histogram.count if histogram.count else 0.0}
+                               for (name, labels), histogram in self._histograms.items()],
+            }
+
+    def render_prometheus(self) -> str:
+        """
+        Renders all the metrics in the Prometheus text exposition format.
+        """
+        def _labels(labels: Tuple, **extra) -> str:
+            pairs = [(key, str(value)) for key, value in labels] + list(extra.items())
+            return '{' + ','.join(f'{key}="{value}"' for key, value in pairs) + '}' if pairs else ''
+
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE intelliweb_{name} histogram")
+                for (metric, labels), histogram in self._histograms.items():
+                    if metric != name:
+                        continue
+                    for bound, count in zip(_BUCKETS, histogram.counts):
+                        lines.append(f"intelliweb_{name}_bucket{_labels(labels, le=bound)} {count}")
+                    lines.append(f"intelliweb_{name}_bucket{_labels(labels, le='+Inf')} {histogram.count}")
+                    lines.append(f"intelliweb_{name}_sum{_labels(labels)} {histogram.sum}")
+                    lines.append(f"intelliweb_{name}_count{_labels(labels)} {histogram.count}")
+            for name in sorted({name for name, _ in self._counters}):
+                lines.append(f"# TYPE intelliweb_{name}_total counter")
+                for (metric, labels), value in self._counters.items():
+                    if metric == name:
+                        lines.append(f"intelliweb_{name}_total{_labels(labels)} {value}")
+            for name in sorted({name for name, _ in self._gauges}):
+                lines.append(f"# TYPE intelliweb_{name} gauge")
+                for (metric, labels), value in self._gauges.items():
+                    if metric == name:
+                        lines.append(f"intelliweb_{name}{_labels(labels)} {value}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+_exporters: List[SpanExporter] = []
+_current_trace_id: ContextVar[str | None] = ContextVar('intelliweb_trace_id', default=None)
+_current_span: ContextVar[Span | None] = ContextVar('intelliweb_span', default=None)
+
+
+def add_exporter(exporter: SpanExporter):
+    _exporters.append(exporter)
+
+
+def start_trace() -> str:
+    """
+    Starts a new trace for the current context (e.g. a query). Spans finished in this context, and in the tasks it
+    creates, carry its id.
+    """
+    trace_id = uuid.uuid4().hex
+    _current_trace_id.set(trace_id)
+    return trace_id
+
+
+def _finish(span: Span):
+    metrics.observe('stage_duration_seconds', span.duration,
+                    {'stage': span.name, **{key: span.attributes[key] for key in _LABEL_KEYS if key in span.attributes}})
+    for exporter in _exporters:
+        try:
+            exporter.export(span)
+        except Exception as exc:
+            print(f"Failed to export span {repr(span.name)}: {exc}")
+
+
+def current_trace_id() -> str | None:
+    return _current_trace_id.get()
+
+
+@contextmanager
+def span(name: str, trace_id: str = None, **attributes) -> Iterator[Span]:
+    """
+    Times the enclosed block as a stage of the pipeline. Must not enclose a `yield`, as it relies on context variables.
+    Code running outside the context of the trace (e.g. a stream consumed by the caller) passes `trace_id` explicitly.
+    """
+    current = Span(name, trace_id or _current_trace_id.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as exc:
+        current.set_attribute('status', 'cancelled' if isinstance(exc, GeneratorExit) else 'error')
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+        _finish(current)
+
+
+def record_span(name: str, duration: float, trace_id: str = None, **attributes):
+    """
+    Records a stage that could not be timed with `span`, e.g. because it spans the consumption of a stream.
+    """
+    finished = Span(name, trace_id or _current_trace_id.get(), attributes)
+    finished.duration = duration
+    _finish(finished)
+
+
+def set_attributes(**attributes):
+    """
+    Sets attributes on the innermost span currently open, if any.
+    """
+    current = _current_span.get()
+    if current is not None:
+        current.attributes.update(attributes)
+
+
+def increment(name: str, value: float = 1, **labels):
+    metrics.increment(name, value, labels)
+
+
+def set_gauge(name: str, value: float, **labels):
+    metrics.set_gauge(name, value, labels)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.rstrip('/') != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render_prometheus().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port: int, host: str = '0.0.0.0') -> ThreadingHTTPServer:
+    """
+    Serves the metrics in the Prometheus text format at `/metrics` from a background thread.
+    """
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    print(f"Serving metrics on http://{host}:{port}/metrics")
+    return server
+
+
+_configured = False
+
+
+def configure_from_env():
+    """
+    Sets up the exporters requested through env variables: `TELEMETRY_JSONL_PATH` for a JSON-lines span sink and
+    `METRICS_PORT` for a Prometheus endpoint. Only the first call has an effect.
+    """
+    global _configured
+    if _configured:
+        return
+    _configured = True
+    if os.getenv('TELEMETRY_JSONL_PATH'):
+        add_exporter(JsonLinesExporter(os.getenv('TELEMETRY_JSONL_PATH')))
+    if os.getenv('METRICS_PORT'):
+        start_metrics_server(int(os.getenv('METRICS_PORT')))
+
+
+__all__ = ['Span', 'SpanExporter', 'JsonLinesExporter', 'MetricsRegistry', 'metrics', 'add_exporter', 'start_trace',
+           'current_trace_id', 'span', 'record_span', 'set_attributes', 'increment', 'set_gauge',
+           'start_metrics_server', 'configure_from_env']